@@ -0,0 +1,50 @@
+"""Benchmark accelerometer trace decoding and analysis.
+
+Run with ``uv run python benchmarks/bench_accel.py``. Times decoding an OEM
+trace field and running the vectorised analysis over traces of increasing
+length, alongside the size of the stored trace versus the JSON sample list.
+"""
+import json
+import time
+
+import numpy as np
+
+from dm_common import accel
+
+
+def make_field(n: int, rate_hz: int = 400, scale_mg: int = 4) -> dict:
+    rng = np.random.default_rng(0)
+    samples = rng.normal(0, 20, size=(n, 3))
+    samples[:, 2] += 1000 / scale_mg
+    impact = slice(n // 2, n // 2 + rate_hz // 10)
+    samples[impact, 0] -= 4000 / scale_mg
+    return {
+        "FType": 15,
+        "Rate": rate_hz,
+        "Scale": scale_mg,
+        "Samples": samples.round().astype(int).tolist(),
+    }
+
+
+def timeit(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    print(f"{'samples':>8} {'decode ms':>10} {'analyse ms':>11} {'json KB':>8} {'stored KB':>10}")
+    for n in (1_000, 4_000, 16_000, 64_000):
+        field = make_field(n)
+        args = field["Samples"], field["Rate"], field["Scale"]
+        trace = accel.decode_trace(*args)
+        decode_ms = timeit(lambda: accel.decode_trace(*args), 20)
+        analyse_ms = timeit(lambda: accel.analyse(trace), 50)
+        json_kb = len(json.dumps(field["Samples"])) / 1024
+        stored_kb = len(trace.to_bytes()) / 1024
+        print(f"{n:>8} {decode_ms:>10.2f} {analyse_ms:>11.3f} {json_kb:>8.1f} {stored_kb:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
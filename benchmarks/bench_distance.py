@@ -0,0 +1,102 @@
+"""Benchmark GPS distance over long synthetic tracks.
+
+Run with ``uv run python benchmarks/bench_distance.py``. Each track is a
+vehicle driving a wandering route with stops, sampled every 10 s with a few
+metres of GPS noise. Times a pure-Python loop applying the same jitter rules
+fix by fix against :func:`dm_common.distance.measure` over the whole track
+(from ``Fix`` objects, and from arrays via ``measure_track``), and one fix at
+a time as a processor sees Digital Matter records. Distances are compared
+with the true route length and with summing every raw step.
+"""
+import math
+import time
+
+import numpy as np
+
+from dm_common import distance
+from dm_common.distance import Fix
+
+
+M_PER_DEG_LAT = 111_195.0
+
+
+def make_track(n: int, noise_m: float = 3.0) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(0)
+    # ~1 in 3 fixes parked, the rest at 20-100 km/h with a wandering heading
+    moving = rng.random(n) > 0.33
+    speed_kmh = np.where(moving, rng.uniform(20, 100, n), 0.0)
+    heading = np.cumsum(rng.normal(0, 0.2, n))
+    step_m = speed_kmh / 3.6 * 10
+    north = np.cumsum(step_m * np.cos(heading))
+    east = np.cumsum(step_m * np.sin(heading))
+    return {
+        "true_km": step_m[1:].sum() / 1000,
+        "t": np.arange(n) * 10.0,
+        "lat": -33.0 + (north + rng.normal(0, noise_m, n)) / M_PER_DEG_LAT,
+        "lng": 151.0 + (east + rng.normal(0, noise_m, n)) / (M_PER_DEG_LAT * math.cos(math.radians(33))),
+        "accuracy_m": np.full(n, 5.0),
+        "pdop": np.full(n, 12.0),
+        "speed_kmh": speed_kmh,
+    }
+
+
+def python_km(fixes: list[Fix]) -> tuple[float, float]:
+    """(filtered, raw) distance, one step at a time."""
+    filtered = raw = 0.0
+    for a, b in zip(fixes, fixes[1:]):
+        p1, p2 = math.radians(a.lat), math.radians(b.lat)
+        dp, dl = p2 - p1, math.radians(b.lng - a.lng)
+        h = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+        step = 2 * distance.EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+        raw += step
+        noise = distance.JITTER_FACTOR * math.hypot(a.accuracy_m, b.accuracy_m) / 1000
+        speed = step / ((b.t - a.t) / 3600)
+        if speed <= distance.MAX_SPEED_KMH and (step > noise or b.speed_kmh >= distance.MOVING_KMH):
+            filtered += step
+    return filtered, raw
+
+
+def per_fix_km(fixes: list[Fix]) -> float:
+    total, anchor = 0.0, None
+    for fix in fixes:
+        travel = distance.measure([fix], anchor)
+        total += travel.distance_km
+        anchor = travel.anchor
+    return total
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    print(
+        f"{'fixes':>8} {'true km':>8} {'raw km':>8} {'km':>8}"
+        f" {'python ms':>10} {'fixes ms':>9} {'arrays ms':>10} {'per-fix ms':>11}"
+    )
+    for n in (1_000, 10_000, 100_000):
+        track = make_track(n)
+        columns = [track[k] for k in ("t", "lat", "lng", "accuracy_m", "pdop", "speed_kmh")]
+        fixes = [Fix(*map(float, row)) for row in zip(*columns)]
+
+        (python_filtered, raw_km), python_ms = timed(python_km, fixes)
+        travel, fixes_ms = timed(distance.measure, fixes)
+        arrays, arrays_ms = timed(distance.measure_track, *columns)
+        assert math.isclose(travel.distance_km, arrays.distance_km)
+        assert math.isclose(travel.distance_km, python_filtered, rel_tol=1e-9)
+        # per-fix is linear; time a slice of long tracks and scale it
+        sample = fixes[:10_000]
+        per_km, per_ms = timed(per_fix_km, sample)
+        assert math.isclose(per_km, distance.measure(sample).distance_km, rel_tol=1e-9)
+        per_ms *= n / len(sample)
+
+        print(
+            f"{n:>8} {track['true_km']:>8.1f} {raw_km:>8.1f} {travel.distance_km:>8.1f}"
+            f" {python_ms:>10.1f} {fixes_ms:>9.1f} {arrays_ms:>10.2f} {per_ms:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
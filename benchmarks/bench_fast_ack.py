@@ -0,0 +1,128 @@
+"""Benchmark ingestion ack latency, inline versus fast-ack.
+
+Run with ``uv run python benchmarks/bench_fast_ack.py``. Replays a burst of
+OEM Server uploads against an in-process stand-in for the Doover API that
+takes ``API_LATENCY_S`` per call. It reports the time to answer each upload
+(p50 / p95 / max) with inline processing and with fast-ack queueing, plus the
+end-to-end throughput of the queue consumer.
+"""
+import asyncio
+import base64
+import json
+import statistics
+import tempfile
+import time
+
+from pydoover.models import Aggregate, IngestionEndpointEvent, Message
+
+from dm_common import spool
+from integration import archive
+from integration.application import DigitalMatterIntegration
+from integration.upload_queue import MemoryQueue
+
+API_LATENCY_S = 0.005
+UPLOADS = 100
+RECORDS_PER_UPLOAD = 40
+
+
+class LatencyApi:
+    def __init__(self):
+        self.calls = 0
+
+    async def create_message(self, channel_name, data, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(API_LATENCY_S)
+        return Message(self.calls, 0, None, data, [])
+
+    async def update_channel_aggregate(self, channel_name, data, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(API_LATENCY_S)
+
+    async def fetch_channel_aggregate(self, channel_name, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(API_LATENCY_S)
+        return Aggregate({}, [], None)
+
+
+class Tags:
+    def get_tag(self, key, default=None, app_key=None, raise_key_error=False):
+        return {str(s): s for s in range(1, UPLOADS + 1)}
+
+
+def make_app(**options) -> DigitalMatterIntegration:
+    app = DigitalMatterIntegration()
+    app.config._inject_deployment_config({
+        "dv_proc_ingestion": {"cidr_ranges": []},
+        "dv_proc_extended_permissions": {"devices": [], "groups": [], "apps_installed": []},
+        **options,
+    })
+    app.api = LatencyApi()
+    app.tag_manager = Tags()
+    return app
+
+
+def make_body(serial: int) -> str:
+    payload = {
+        "SerNo": serial,
+        "Records": [
+            {
+                "SeqNo": i,
+                "Reason": 11,
+                "DateUTC": f"2024-01-01 00:{i // 60:02d}:{i % 60:02d}",
+                "Fields": [
+                    {"FType": 0, "Lat": -33.8688 + i * 1e-4, "Long": 151.2093, "Alt": 50, "Spd": 1500},
+                    {"FType": 2, "DIn": 1},
+                    {"FType": 6, "AnalogueData": {"1": 4100, "2": 1350, "3": 2500, "4": 20}},
+                ],
+            }
+            for i in range(RECORDS_PER_UPLOAD)
+        ],
+    }
+    return base64.b64encode(json.dumps(payload).encode()).decode()
+
+
+async def ack_latencies(bodies, **options) -> tuple[list[float], DigitalMatterIntegration]:
+    app = make_app(**options)
+    latencies = []
+
+    async def upload(body):
+        start = time.perf_counter()
+        # the platform builds a fresh event (and parses it) per invocation
+        event = IngestionEndpointEvent(1, 1, 1, body, parser=app.parse_ingestion_event_payload)
+        await app.on_ingestion_endpoint(event)
+        latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(upload(b) for b in bodies))
+    return latencies, app
+
+
+def summary(latencies: list[float]) -> str:
+    ms = sorted(x * 1000 for x in latencies)
+    p95 = ms[int(len(ms) * 0.95) - 1]
+    return f"p50 {statistics.median(ms):8.1f} ms  p95 {p95:8.1f} ms  max {ms[-1]:8.1f} ms"
+
+
+async def main():
+    spool.SPOOL_DIR = tempfile.mkdtemp()
+    bodies = [make_body(s) for s in range(1, UPLOADS + 1)]
+    records = UPLOADS * RECORDS_PER_UPLOAD
+    print(f"{UPLOADS} concurrent uploads x {RECORDS_PER_UPLOAD} records, {API_LATENCY_S * 1000:.0f} ms per API call\n")
+
+    start = time.perf_counter()
+    latencies, _ = await ack_latencies(bodies)
+    inline_s = time.perf_counter() - start
+    print(f"inline    ack {summary(latencies)}  ({records / inline_s:,.0f} records/s)")
+
+    # the same bodies again, as if to a fresh container rather than as retries
+    archive._seen.clear()
+    latencies, app = await ack_latencies(bodies, fast_ack_queue="memory://bench")
+    print(f"fast-ack  ack {summary(latencies)}")
+
+    start = time.perf_counter()
+    consumed = await app.consume_uploads(MemoryQueue("bench"))
+    consume_s = time.perf_counter() - start
+    print(f"consumer  {consumed} uploads in {consume_s:.2f} s ({records / consume_s:,.0f} records/s)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
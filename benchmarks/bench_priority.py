@@ -0,0 +1,100 @@
+"""Benchmark time-to-alarm-publish against upload size.
+
+Run with ``uv run python benchmarks/bench_priority.py``. Each upload is a
+backlog of heartbeats with one Duress record at the back, published against
+an in-process stand-in for the Doover API that takes ``API_LATENCY_S`` per
+call. It reports how long after the upload arrives the alarm is forwarded to
+the device agent, in list order (priority lane disabled) and with the
+priority lane, plus the time to publish the whole upload.
+"""
+import asyncio
+import base64
+import json
+import tempfile
+import time
+
+from pydoover.models import Aggregate, IngestionEndpointEvent, Message
+
+from dm_common import spool
+from integration import application, archive
+from integration.application import DigitalMatterIntegration
+
+API_LATENCY_S = 0.005
+BATCH_SIZES = (10, 50, 100, 250)
+DURESS = 48
+
+
+class LatencyApi:
+    def __init__(self):
+        self.alarm_at = None
+
+    async def create_message(self, channel_name, data, **kwargs):
+        await asyncio.sleep(API_LATENCY_S)
+        if channel_name == "on_dm_event" and data.get("uplink_reason_code") == DURESS and self.alarm_at is None:
+            self.alarm_at = time.perf_counter()
+        return Message(1, 0, None, data, [])
+
+    async def update_channel_aggregate(self, channel_name, data, **kwargs):
+        await asyncio.sleep(API_LATENCY_S)
+
+    async def fetch_channel_aggregate(self, channel_name, **kwargs):
+        await asyncio.sleep(API_LATENCY_S)
+        return Aggregate({}, [], None)
+
+
+class Tags:
+    def get_tag(self, key, default=None, app_key=None, raise_key_error=False):
+        return {"1001": 42}
+
+
+def make_body(records: int) -> str:
+    payload = {
+        "SerNo": 1001,
+        "Records": [
+            {
+                "SeqNo": i,
+                "Reason": DURESS if i == records - 1 else 11,
+                "DateUTC": f"2024-01-01 {i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}",
+                "Fields": [
+                    {"FType": 0, "Lat": -33.8688 + i * 1e-4, "Long": 151.2093, "Alt": 50, "Spd": 1500},
+                    {"FType": 2, "DIn": 1},
+                    {"FType": 6, "AnalogueData": {"1": 4100, "2": 1350, "3": 2500, "4": 20}},
+                ],
+            }
+            for i in range(records)
+        ],
+    }
+    return base64.b64encode(json.dumps(payload).encode()).decode()
+
+
+async def run(body: str) -> tuple[float, float]:
+    archive._seen.clear()  # each run is a fresh container, not a retry
+    app = DigitalMatterIntegration()
+    app.config._inject_deployment_config({
+        "dv_proc_ingestion": {"cidr_ranges": []},
+        "dv_proc_extended_permissions": {"devices": [], "groups": [], "apps_installed": []},
+    })
+    app.api = LatencyApi()
+    app.tag_manager = Tags()
+    event = IngestionEndpointEvent(1, 1, 1, body, parser=app.parse_ingestion_event_payload)
+    start = time.perf_counter()
+    await app.on_ingestion_endpoint(event)
+    return app.api.alarm_at - start, time.perf_counter() - start
+
+
+async def main():
+    spool.SPOOL_DIR = tempfile.mkdtemp()
+    print(f"one Duress record at the back of each upload, {API_LATENCY_S * 1000:.0f} ms per API call\n")
+    print(f"{'records':>8}  {'in order':>10}  {'priority':>10}  {'whole upload':>12}")
+    lanes = application.PRIORITY_REASONS
+    for size in BATCH_SIZES:
+        body = make_body(size)
+        application.PRIORITY_REASONS = frozenset()
+        in_order, _ = await run(body)
+        application.PRIORITY_REASONS = lanes
+        priority, total = await run(body)
+        print(f"{size:>8}  {in_order * 1000:>7.0f} ms  {priority * 1000:>7.0f} ms  {total * 1000:>9.0f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
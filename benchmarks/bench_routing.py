@@ -0,0 +1,63 @@
+"""Benchmark invocation URL routing.
+
+Run with ``uv run python benchmarks/bench_routing.py``. Compares the previous
+per-request ``urlsplit``/``parse_qs`` scan for an ICCID with the compiled
+router, uncached (every URL new) and warm (a fleet's fixed connector URLs).
+"""
+import re
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from integration.routing import Router
+
+ICCID_RE = re.compile(r"^89\d{16,20}$")
+TEMPLATES = ("/ingest/{tenant}/{iccid}", "?iccid=&model=")
+
+
+def legacy_extract_iccid(invocation_url):
+    """ICCID extraction as it was before the router."""
+    if not invocation_url:
+        return None
+    parts = urlsplit(invocation_url)
+    query = parse_qs(parts.query)
+    for key, values in query.items():
+        if key.lower() == "iccid":
+            for value in values:
+                if ICCID_RE.match(value.strip()):
+                    return value.strip()
+    candidates = parts.path.split("/")
+    candidates += [v for values in query.values() for v in values]
+    for candidate in candidates:
+        candidate = candidate.strip()
+        if ICCID_RE.match(candidate):
+            return candidate
+    return None
+
+
+def fleet_urls(devices: int) -> list[str]:
+    return [
+        f"https://connector.example.com/api/ingest/acme/{8961000000000000000 + n}?model=oem"
+        for n in range(devices)
+    ]
+
+
+def bench(label: str, func, urls: list[str], repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for url in urls:
+            func(url)
+    elapsed = time.perf_counter() - start
+    calls = repeat * len(urls)
+    print(f"{label:<28} {elapsed / calls * 1e6:8.2f} us/request")
+
+
+def main():
+    urls = fleet_urls(2000)
+    bench("legacy scan", legacy_extract_iccid, urls, 20)
+    bench("router, uncached", Router(TEMPLATES, cache_size=0).route, urls, 20)
+    router = Router(TEMPLATES)
+    bench("router, warm cache", router.route, urls, 20)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark OEM payload decoding.
+
+Run with ``uv run python benchmarks/bench_schema.py``. Compares the typed
+msgspec decode (validate and decode in one pass, then parse each record)
+with the previous ``json.loads`` plus dict-walking parse, across batch sizes.
+"""
+import json
+import time
+
+from dm_common.decoders.oem import decode_payload, get_uplink_reason, parse_dm_record
+
+
+def make_body(n: int) -> bytes:
+    return json.dumps({
+        "SerNo": 1001,
+        "IMEI": "352000000000001",
+        "ICCID": "8961000000000000001",
+        "ProdId": 97,
+        "FW": "97.2.1.11",
+        "Records": [
+            {
+                "SeqNo": i,
+                "Reason": 11,
+                "DateUTC": f"2024-01-01 {i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}",
+                "Fields": [
+                    {"GpsUTC": "2024-01-01 00:00:00", "Lat": -33.8688 + i * 1e-5, "Long": 151.2093,
+                     "Alt": 50, "Spd": 1500, "SpdAcc": 2, "Head": 90, "PDOP": 12, "PosAcc": 5,
+                     "GpsStat": 7, "FType": 0},
+                    {"DIn": 1, "DOut": 0, "DevStat": 0, "FType": 2},
+                    {"AnalogueData": {"1": 4100, "2": 1350, "3": 2500, "4": 20, "5": 12340}, "FType": 6},
+                    {"Odo": 1234567, "RH": 72000, "FType": 27},
+                ],
+            }
+            for i in range(n)
+        ],
+    }).encode()
+
+
+def legacy_parse(record: dict) -> dict:
+    """The dict-walking parser, as it was before the typed schema."""
+    result = {
+        "uplink_reason": get_uplink_reason(record.get("Reason", 0)),
+        "uplink_reason_code": record.get("Reason"),
+        "device_time_utc": record.get("DateUTC"),
+        "sequence_number": record.get("SeqNo"),
+    }
+    for field in record.get("Fields", []):
+        ftype = field.get("FType")
+        if ftype == 0:
+            lat, lon = field.get("Lat", 0), field.get("Long", 0)
+            if lat != 0 and lon != 0:
+                result["position"] = {"lat": lat, "long": lon, "alt": field.get("Alt", 0)}
+                result["speed_kmh"] = field.get("Spd", 0) * 0.036
+                result["heading"] = field.get("Head", 0)
+                result["gps_accuracy_m"] = field.get("PosAcc", 99)
+                result["pdop"] = field.get("PDOP")
+            else:
+                result["gps_accuracy_m"] = 99
+        elif ftype == 2:
+            din = field.get("DIn", 0)
+            result["ignition_on"] = bool(din & 0b001)
+            result["digital_input_2"] = bool(din & 0b010)
+            result["digital_input_3"] = bool(din & 0b100)
+        elif ftype == 6:
+            analogue = field.get("AnalogueData", {})
+            if "1" in analogue:
+                result["battery_voltage"] = analogue["1"] / 1000
+            if "2" in analogue:
+                result["system_voltage"] = analogue["2"] / 100
+            if "3" in analogue:
+                result["device_temp_c"] = analogue["3"] / 100
+            if "4" in analogue:
+                result["signal_strength_percent"] = round(analogue["4"] * (100 / 31))
+            if "5" in analogue:
+                result["analog_input_v"] = analogue["5"] / 1000
+        elif ftype == 27:
+            if "Odo" in field:
+                result["odometer_km"] = field["Odo"] / 100
+            if "RH" in field:
+                result["run_hours"] = field["RH"] / 3600
+        elif ftype == 9:
+            result["trip_distance_m"] = field.get("Dist")
+            result["trip_idle_time_s"] = field.get("IdleTime")
+    return result
+
+
+def legacy(body: bytes):
+    data = json.loads(body)
+    return [legacy_parse(r) for r in data.get("Records", [])]
+
+
+def typed(body: bytes):
+    return [parse_dm_record(r) for r in decode_payload(body).Records]
+
+
+def timeit(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    print(f"{'records':>8} {'legacy ms':>10} {'typed ms':>9} {'speedup':>8}")
+    for n in (1, 10, 100, 1_000):
+        body = make_body(n)
+        repeat = max(20, 20_000 // n)
+        legacy_ms = timeit(lambda: legacy(body), repeat)
+        typed_ms = timeit(lambda: typed(body), repeat)
+        print(f"{n:>8} {legacy_ms:>10.3f} {typed_ms:>9.3f} {legacy_ms / typed_ms:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""Benchmark the long-running server against the per-invocation handler path.
+
+Run with ``uv run python benchmarks/bench_server.py``. Everything talks to
+the in-memory Doover API (``server.fake_api``) over local HTTP, with
+``API_LATENCY_S`` added per call.
+
+* per-invocation - what Lambda does for each POST and for each event the
+  processor is invoked with: a fresh app and HTTP session, a tag values
+  fetch, the deployment config, then the handler
+* warm host - one ``AppHost`` handling the same uploads, processors in-process
+* server - ``python -m server`` with 1 and N worker processes, posting the
+  uploads over HTTP from this process
+
+The fake API runs in a single event loop, so at high worker counts it can
+become the bottleneck rather than the server.
+"""
+import asyncio
+import base64
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+from pydoover.models import ChannelID, IngestionEndpointEvent, Message, MessageCreateEvent
+from pydoover.tags.manager import TagsManagerProcessor
+
+from dm_common.writes import close_shared_session
+from dm_common import spool
+from integration import archive
+from integration.application import DigitalMatterIntegration
+from processor.application import DigitalMatterProcessor
+from server.fake_api import FakeDataApi
+from server.host import AppHost, ServerSettings
+
+API_LATENCY_S = 0.002
+DEVICES = 20
+UPLOADS = 200
+RECORDS_PER_UPLOAD = 5
+CONCURRENCY = 20
+INTEGRATION_AGENT = 1
+INGESTION_DEFAULTS = {
+    "dv_proc_ingestion": {"cidr_ranges": []},
+    "dv_proc_extended_permissions": {"devices": [], "groups": [], "apps_installed": []},
+}
+
+
+def make_body(serial: int, upload: int) -> bytes:
+    return json.dumps({
+        "SerNo": serial,
+        "Records": [
+            {
+                "SeqNo": upload * RECORDS_PER_UPLOAD + i,
+                "Reason": 11,
+                "DateUTC": f"2024-01-01 {upload // 60 % 24:02d}:{upload % 60:02d}:{i:02d}",
+                "Fields": [
+                    {"FType": 0, "Lat": -33.8688 + upload * 1e-4, "Long": 151.2093, "Alt": 50, "Spd": 1500},
+                    {"FType": 2, "DIn": 1},
+                    {"FType": 6, "AnalogueData": {"1": 4100, "2": 1350, "3": 2500, "4": 20}},
+                ],
+            }
+            for i in range(RECORDS_PER_UPLOAD)
+        ],
+    }).encode()
+
+
+def settings_dict(api_url: str) -> dict:
+    return {
+        "api_url": api_url,
+        "token": "bench",
+        "integration": {"agent_id": INTEGRATION_AGENT},
+        "agents": {
+            str(100 + s): {"app": "digital_matter_processor", "config": {"dv_serial_number": str(s)}}
+            for s in range(1, DEVICES + 1)
+        },
+    }
+
+
+def seed(fake: FakeDataApi):
+    fake.aggregates[(INTEGRATION_AGENT, "tag_values")] = {
+        "digital_matter_processor_1": {"serial_number_lookup": {str(s): 100 + s for s in range(1, DEVICES + 1)}},
+    }
+
+
+async def start_fake_api() -> tuple[FakeDataApi, web.AppRunner, str]:
+    fake = FakeDataApi(API_LATENCY_S)
+    seed(fake)
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return fake, runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+async def run_bounded(jobs):
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def run(job):
+        async with semaphore:
+            await job()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(j) for j in jobs))
+    return time.perf_counter() - start
+
+
+class InvocationPath:
+    """Cold setup per invocation, with processor events run as Doover would."""
+
+    def __init__(self, settings: ServerSettings):
+        self.settings = settings
+        self.events = []
+
+    async def _client(self, agent_id, app_key):
+        from pydoover.processor.data_client import ProcessorDataClient
+
+        api = ProcessorDataClient(self.settings.api_url)
+        api.set_token(self.settings.token)
+        api.agent_id = agent_id
+        api.app_key = app_key
+        api.lookup_ip = False
+        await api.setup()  # a fresh session per invocation
+        return api
+
+    async def ingest(self, body: bytes):
+        app = DigitalMatterIntegration()
+        api = await self._client(INTEGRATION_AGENT, self.settings.integration_app_key)
+        outer = self
+
+        class Recording:
+            def __getattr__(self, name):
+                return getattr(api, name)
+
+            async def create_message(self, channel_name, data, **kwargs):
+                message = await api.create_message(channel_name, data, **kwargs)
+                if channel_name == "on_dm_event":
+                    outer.events.append((kwargs["agent_id"], data))
+                return message
+
+        try:
+            app.api = Recording()
+            app.agent_id, app.app_key = INTEGRATION_AGENT, api.app_key
+            aggregate = await api.fetch_channel_aggregate("tag_values")
+            app.tag_manager = TagsManagerProcessor(app.app_key, api, app.agent_id, aggregate.data or {})
+            app.config._inject_deployment_config(INGESTION_DEFAULTS)
+            event = IngestionEndpointEvent(
+                0, INTEGRATION_AGENT, 0, base64.b64encode(body).decode(),
+                parser=app.parse_ingestion_event_payload,
+            )
+            await app.on_ingestion_endpoint(event)
+        finally:
+            await api.close()
+
+    async def process(self, agent_id: int, data: dict):
+        spec = self.settings.agents[agent_id]
+        app = DigitalMatterProcessor()
+        api = app.api = await self._client(agent_id, spec.app_key)
+        try:
+            api._invoking_channel_name = "on_dm_event"
+            app.agent_id, app.app_key = agent_id, spec.app_key
+            app.config._inject_deployment_config(spec.config)
+            aggregate = await api.fetch_channel_aggregate("tag_values")
+            app.tag_manager = TagsManagerProcessor(spec.app_key, api, agent_id, aggregate.data or {})
+            app.tags = app.tags_cls(spec.app_key, app.tag_manager, app.config)
+            app.connection_config = None
+            await app.tags.setup()
+            channel = ChannelID(agent_id, "on_dm_event")
+            await app.on_message_create(MessageCreateEvent(channel, Message(0, 0, channel, data, [])))
+            await app.tag_manager.commit_tags()
+        finally:
+            await api.close()
+
+
+async def bench_invocations(bodies) -> float:
+    archive._seen.clear()  # a fresh API, so nothing has been processed yet
+    fake, runner, url = await start_fake_api()
+    path = InvocationPath(ServerSettings.from_dict(settings_dict(url)))
+    try:
+        elapsed = await run_bounded([lambda b=b: path.ingest(b) for b in bodies])
+        events, path.events = path.events, []
+        elapsed += await run_bounded([lambda e=e: path.process(*e) for e in events])
+    finally:
+        await runner.cleanup()
+    return elapsed
+
+
+async def bench_host(bodies) -> float:
+    archive._seen.clear()
+    fake, runner, url = await start_fake_api()
+    host = AppHost(ServerSettings.from_dict(settings_dict(url)))
+    await host.start(schedule=False)
+    try:
+        await host.handle_oem(make_body(1, 0))  # warm the processor for that device
+        await host.settle()
+
+        async def one(body):
+            await host.handle_oem(body)
+
+        start = time.perf_counter()
+        await run_bounded([lambda b=b: one(b) for b in bodies])
+        await host.settle()
+        return time.perf_counter() - start
+    finally:
+        await host.close()
+        await runner.cleanup()
+        await close_shared_session()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def bench_server(bodies, workers: int) -> float:
+    fake, runner, url = await start_fake_api()
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(settings_dict(url), f)
+    port = free_port()
+    src = os.path.join(os.path.dirname(__file__), "..", "src")
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "server", "--settings", f.name, "--port", str(port), "--workers", str(workers),
+        env={**os.environ, "PYTHONPATH": src},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        async with aiohttp.ClientSession() as session:
+            base = f"http://127.0.0.1:{port}"
+            for _ in range(200):
+                try:
+                    async with session.get(base + "/health") as resp:
+                        if resp.status == 200:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.1)
+            for serial in range(1, DEVICES + 1):  # warm every worker's processors
+                async with session.post(base + "/ingest", data=make_body(serial, 0)):
+                    pass
+
+            async def one(body):
+                async with session.post(base + "/ingest", data=body) as resp:
+                    assert resp.status == 200
+
+            start = time.perf_counter()
+            await run_bounded([lambda b=b: one(b) for b in bodies])
+            # processor events finish after the response; wait for the API to go quiet
+            last = -1
+            while fake.requests != last:
+                last = fake.requests
+                await asyncio.sleep(0.2)
+            return time.perf_counter() - start - 0.2
+    finally:
+        # the server flushes to the fake API on shutdown, so keep this loop running
+        proc.terminate()
+        await proc.wait()
+        os.unlink(f.name)
+        await runner.cleanup()
+
+
+async def main():
+    spool.SPOOL_DIR = tempfile.mkdtemp()
+    bodies = [make_body(u % DEVICES + 1, u + 1) for u in range(UPLOADS)]
+    records = UPLOADS * RECORDS_PER_UPLOAD
+    print(
+        f"{UPLOADS} uploads x {RECORDS_PER_UPLOAD} records over {DEVICES} devices, "
+        f"{CONCURRENCY} in flight, {API_LATENCY_S * 1000:.0f} ms per API call\n"
+    )
+
+    def report(name, elapsed):
+        print(f"{name:<22} {elapsed:6.2f} s  {UPLOADS / elapsed:8,.0f} uploads/s  {records / elapsed:8,.0f} records/s")
+
+    report("per-invocation", await bench_invocations(bodies))
+    report("warm host", await bench_host(bodies))
+    workers = os.cpu_count() or 1
+    for n in sorted({1, workers}):
+        report(f"server, {n} worker(s)", await bench_server(bodies, n))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
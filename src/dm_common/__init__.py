@@ -0,0 +1,5 @@
+"""Shared building blocks for the Digital Matter integration and processors.
+
+Everything in here is imported by more than one Lambda, so modules should be
+cheap to import and pull in heavy dependencies lazily.
+"""
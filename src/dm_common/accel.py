@@ -0,0 +1,143 @@
+"""Accelerometer trace decoding and analysis.
+
+Accident (23), Accident Data (24) and High-G Event (46) uplinks carry a burst
+of high-rate accelerometer samples. The OEM Server posts these as an
+accelerometer trace field::
+
+    {"FType": 15, "Rate": 400, "Scale": 4, "Samples": [[x, y, z], ...]}
+
+where ``Rate`` is the sample rate in Hz, ``Scale`` is milli-g per count and
+each sample is the raw signed axis reading. Axes follow the device's
+configured mounting: +X forward, +Y left, +Z up.
+
+Traces are kept as integer counts (:class:`AccelTrace`) so they can be stored
+losslessly and compactly, and analysed in one vectorised pass by
+:func:`analyse`. NumPy is only imported by this module, so records without a
+trace never load it.
+"""
+from __future__ import annotations
+
+import gzip
+from dataclasses import dataclass
+
+import numpy as np
+
+STANDARD_GRAVITY = 9.80665
+
+# Classification thresholds (g, on the gravity-removed signal)
+EVENT_THRESHOLD_G = 0.3
+IMPACT_THRESHOLD_G = 2.5
+SEVERE_IMPACT_THRESHOLD_G = 6.0
+
+DEFAULT_RATE_HZ = 100
+DEFAULT_SCALE_MG = 1
+
+
+@dataclass
+class AccelTrace:
+    counts: np.ndarray  # (n, 3) int16 raw axis counts
+    rate_hz: float
+    scale_mg: float
+
+    @property
+    def g(self) -> np.ndarray:
+        """Samples in g as an (n, 3) float array."""
+        return self.counts.astype(np.float32) * np.float32(self.scale_mg / 1000)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def to_bytes(self) -> bytes:
+        """Gzipped little-endian int16 samples, interleaved x, y, z."""
+        return gzip.compress(self.counts.astype("<i2").tobytes(), compresslevel=6)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, rate_hz: float, scale_mg: float) -> AccelTrace:
+        counts = np.frombuffer(gzip.decompress(data), dtype="<i2").reshape(-1, 3)
+        return cls(counts, rate_hz, scale_mg)
+
+
+def decode_trace(
+    samples: list, rate_hz: float | None = None, scale_mg: float | None = None
+) -> AccelTrace:
+    """Decode the ``Samples``, ``Rate`` and ``Scale`` of a trace field."""
+    counts = np.asarray(samples, dtype=np.int16).reshape(-1, 3)
+    return AccelTrace(
+        counts,
+        rate_hz=float(rate_hz or DEFAULT_RATE_HZ),
+        scale_mg=float(scale_mg or DEFAULT_SCALE_MG),
+    )
+
+
+def concat(traces: list[AccelTrace]) -> AccelTrace:
+    """Join consecutive trace fields from the same record into one trace."""
+    if len(traces) == 1:
+        return traces[0]
+    return AccelTrace(
+        np.concatenate([t.counts for t in traces]),
+        traces[0].rate_hz,
+        traces[0].scale_mg,
+    )
+
+
+def _longest_run_around(mask: np.ndarray, index: int) -> int:
+    """Length of the run of True values in ``mask`` containing ``index``."""
+    if not mask[index]:
+        return 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    run = np.searchsorted(starts, index, side="right") - 1
+    return int(ends[run] - starts[run])
+
+
+def analyse(trace: AccelTrace, baseline_s: float = 0.1) -> dict:
+    """Summarise a trace: peak g, delta-v, impact duration and event class.
+
+    The first ``baseline_s`` seconds (the pre-trigger portion of the trace)
+    are taken as the at-rest reading, so gravity and mounting bias are
+    removed before anything is measured.
+    """
+    g = trace.g
+    n = len(g)
+    dt = 1.0 / trace.rate_hz
+
+    baseline = max(1, min(n, int(round(baseline_s * trace.rate_hz))))
+    dyn = g - g[:baseline].mean(axis=0)
+
+    magnitude = np.sqrt(np.einsum("ij,ij->i", dyn, dyn))
+    peak = int(np.argmax(magnitude))
+    peak_g = float(magnitude[peak])
+
+    # Horizontal velocity change, integrated from the start of the trace.
+    velocity = np.cumsum(dyn[:, :2], axis=0) * (STANDARD_GRAVITY * dt)
+    speed_change = np.sqrt(np.einsum("ij,ij->i", velocity, velocity))
+    delta_v_kmh = float(speed_change.max()) * 3.6
+
+    impact_samples = _longest_run_around(magnitude >= EVENT_THRESHOLD_G, peak)
+
+    return {
+        "classification": _classify(dyn[peak], peak_g),
+        "peak_g": round(peak_g, 3),
+        "peak_at_ms": round(peak * dt * 1000, 1),
+        "delta_v_kmh": round(delta_v_kmh, 2),
+        "impact_duration_ms": round(impact_samples * dt * 1000, 1),
+        "samples": n,
+        "sample_rate_hz": trace.rate_hz,
+        "duration_ms": round(n * dt * 1000, 1),
+    }
+
+
+def _classify(peak_vector: np.ndarray, peak_g: float) -> str:
+    if peak_g < EVENT_THRESHOLD_G:
+        return "none"
+    if peak_g >= SEVERE_IMPACT_THRESHOLD_G:
+        return "severe_impact"
+    if peak_g >= IMPACT_THRESHOLD_G:
+        return "impact"
+
+    axis = int(np.argmax(np.abs(peak_vector)))
+    if axis == 0:
+        return "harsh_acceleration" if peak_vector[0] > 0 else "harsh_brake"
+    if axis == 1:
+        return "harsh_cornering"
+    return "vertical_shock"
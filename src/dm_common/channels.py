@@ -0,0 +1,8 @@
+"""Channels that one of the connector's apps publishes and another consumes.
+
+Kept here so neither side has to import the other's application module.
+"""
+
+# Uplinks the G62 integration already decoded, as {"dev_eui", "device_id",
+# "application_id", "records": [decoded, ...]}, for the G62 processor.
+DECODED_UPLINK_CHANNEL = "on_g62_event"
@@ -0,0 +1,118 @@
+"""Decoder registry for Digital Matter device families.
+
+Each device family registers a decoder by model name, along with the LoRaWAN
+ports (and frame lengths on each port) it understands. The decoder module is
+only imported the first time a frame for that model is decoded, so a Lambda
+that only ever sees G62 uplinks never pays to import the Oyster3 decoder.
+
+Decoders for LoRaWAN families share the signature ``decode(payload, port)``
+and return a flat dict (or None for frames they don't recognise). The OEM
+Server JSON family decodes one record dict at a time, so it is registered
+without a frame table and called as ``decode(record)``.
+
+To add a family, write a decoder module and register it below (or call
+:func:`register` from your own code), then add a golden vector file under
+``tests/vectors`` so the conformance tests pick it up.
+"""
+from __future__ import annotations
+
+import importlib
+import logging
+from typing import Any, Callable
+
+log = logging.getLogger(__name__)
+
+
+class DecoderEntry:
+    """A registered decoder, resolved lazily from a ``"module:attr"`` target."""
+
+    def __init__(
+        self,
+        model: str,
+        target: str,
+        frames: dict[int, tuple[int, ...] | None] | None = None,
+    ):
+        self.model = model
+        self.target = target
+        # port -> accepted payload lengths (None = any length). None for the
+        # whole table means the decoder isn't port-based (e.g. OEM JSON).
+        self.frames = frames
+        self._func: Callable[..., Any] | None = None
+
+    def accepts(self, port: int | None, length: int | None) -> bool:
+        if self.frames is None:
+            return True
+        if port not in self.frames:
+            return False
+        lengths = self.frames[port]
+        return lengths is None or length in lengths
+
+    def load(self) -> Callable[..., Any]:
+        if self._func is None:
+            module_name, attr = self.target.split(":")
+            self._func = getattr(importlib.import_module(module_name), attr)
+        return self._func
+
+    def __repr__(self) -> str:
+        return f"DecoderEntry(model={self.model!r}, target={self.target!r})"
+
+
+_REGISTRY: dict[str, DecoderEntry] = {}
+
+
+def register(
+    model: str,
+    target: str,
+    frames: dict[int, tuple[int, ...] | None] | None = None,
+) -> DecoderEntry:
+    """Register (or replace) the decoder for a device model."""
+    entry = DecoderEntry(model.lower(), target, frames)
+    _REGISTRY[entry.model] = entry
+    return entry
+
+
+def get_entry(model: str) -> DecoderEntry | None:
+    return _REGISTRY.get(model.lower())
+
+
+def models() -> list[str]:
+    """Names of every registered device model."""
+    return list(_REGISTRY)
+
+
+def get_decoder(
+    model: str, port: int | None = None, length: int | None = None
+) -> Callable[..., Any] | None:
+    """Return the decoder for ``model`` if it accepts this port/length.
+
+    Frames the registry knows the decoder can't handle are rejected here,
+    before the decoder module is imported.
+    """
+    entry = get_entry(model)
+    if entry is None or not entry.accepts(port, length):
+        return None
+    return entry.load()
+
+
+def decode(model: str, payload: bytes, port: int) -> dict | None:
+    """Decode a LoRaWAN frame for ``model``. Returns None if it isn't understood."""
+    func = get_decoder(model, port, len(payload))
+    if func is None:
+        return None
+    return func(payload, port)
+
+
+register(
+    "oem",
+    "dm_common.decoders.oem:parse_dm_record",
+)
+register(
+    "g62",
+    "g62.decoder:decode",
+    frames={1: (17, 19), 2: (11,), 3: (6, 8), 4: (8,), 5: (3,)},
+)
+register(
+    "oyster3",
+    "dm_common.decoders.oyster3:decode",
+    frames={1: (11,), 2: (3,)},
+)
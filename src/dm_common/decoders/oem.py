@@ -0,0 +1,251 @@
+"""Digital Matter OEM Server (JSON) record decoder.
+
+The OEM Server HTTP connector posts one JSON body per device containing a
+list of ``Records``, each with a list of typed ``Fields`` (``FType``).
+
+The body is described by msgspec Structs, so :func:`decode_payload` validates
+types and decodes in a single pass; anything malformed raises
+``msgspec.ValidationError`` before a single record is acted on. Keys we don't
+use are skipped by the decoder rather than materialised.
+"""
+from __future__ import annotations
+
+from typing import Annotated
+
+import msgspec
+
+# Accelerometer trace field, see dm_common.accel
+FTYPE_ACCEL_TRACE = 15
+
+# Device readings are at most 32-bit; anything wildly outside that is corrupt
+# and would overflow the unit conversions below.
+Reading = Annotated[float, msgspec.Meta(ge=-1e12, le=1e12)]
+Positive = Annotated[float, msgspec.Meta(gt=0, le=1e12)]
+Latitude = Annotated[float, msgspec.Meta(ge=-90, le=90)]
+Longitude = Annotated[float, msgspec.Meta(ge=-180, le=180)]
+AxisCount = Annotated[int, msgspec.Meta(ge=-32768, le=32767)]
+
+
+class Field(msgspec.Struct):
+    """One typed field of a record. Which attributes apply depends on FType."""
+
+    FType: int
+    # FType 0: GPS
+    Lat: Latitude = 0.0
+    Long: Longitude = 0.0
+    Alt: Reading = 0
+    Spd: Reading = 0
+    Head: Reading = 0
+    PosAcc: Reading | None = 99
+    PDOP: Reading | None = None
+    # FType 2: digital inputs
+    DIn: int = 0
+    # FType 6: analogue data
+    AnalogueData: dict[str, Reading] = msgspec.field(default_factory=dict)
+    # FType 9: trip data
+    Dist: Reading | None = None
+    IdleTime: Reading | None = None
+    # FType 15: accelerometer trace
+    Rate: Positive | None = None
+    Scale: Positive | None = None
+    Samples: list[tuple[AxisCount, AxisCount, AxisCount]] | None = None
+    # FType 27: odometer / run hours
+    Odo: Reading | None = None
+    RH: Reading | None = None
+
+
+class Record(msgspec.Struct):
+    SeqNo: int | None = None
+    Reason: int | None = None
+    DateUTC: str | None = None
+    Fields: list[Field] = msgspec.field(default_factory=list)
+
+
+class Payload(msgspec.Struct):
+    SerNo: int | str
+    Records: list[Record] = msgspec.field(default_factory=list)
+
+
+_payload_decoder = msgspec.json.Decoder(Payload)
+
+
+def decode_payload(raw: bytes) -> Payload:
+    """Validate and decode an OEM Server POST body.
+
+    Raises ``msgspec.DecodeError`` (a ``ValidationError`` for well-formed
+    JSON of the wrong shape) if the body is malformed.
+    """
+    return _payload_decoder.decode(raw)
+
+# Digital Matter uplink reason codes
+UPLINK_REASONS = {
+    0: "Reserved",
+    1: "Start of trip",
+    2: "End of trip",
+    3: "Elapsed time",
+    4: "Speed change",
+    5: "Heading change",
+    6: "Distance travelled",
+    7: "Maximum Speed",
+    8: "Stationary",
+    9: "Ignition Changed",
+    10: "Output Changed",
+    11: "Heartbeat",
+    12: "Harsh Brake",
+    13: "Harsh Acceleration",
+    14: "Harsh Cornering",
+    15: "External Power Change",
+    16: "System Power Monitoring",
+    17: "Driver ID Tag Read",
+    18: "Over speed",
+    19: "Fuel sensor record",
+    20: "Towing Alert",
+    21: "Debug",
+    22: "SDI-12 sensor data",
+    23: "Accident",
+    24: "Accident Data",
+    25: "Sensor value elapsed time",
+    26: "Sensor value change",
+    27: "Sensor alarm",
+    28: "Rain Gauge Tipped",
+    29: "Tamper Alert",
+    30: "BLOB notification",
+    31: "Time and Attendance",
+    32: "Trip Restart",
+    33: "Tag Gained",
+    34: "Tag Update",
+    35: "Tag Lost",
+    36: "Recovery Mode On",
+    37: "Recovery Mode Off",
+    38: "Immobiliser On",
+    39: "Immobiliser Off",
+    40: "Garmin FMI Stop Response",
+    41: "Lone Worker Alarm",
+    42: "Device Counters",
+    43: "Connected Device Data",
+    44: "Entered Geo-Fence",
+    45: "Exited Geo-Fence",
+    46: "High-G Event",
+    47: "Third party data record",
+    48: "Duress",
+    49: "Cell Tower Connection",
+    50: "Bluetooth Tag Data",
+}
+
+
+# Alarm reasons (Towing Alert, Accident, Lone Worker Alarm, Duress) published
+# ahead of the rest of an upload.
+PRIORITY_REASONS = frozenset({20, 23, 41, 48})
+
+
+def get_uplink_reason(code: int) -> str:
+    """Translate uplink reason code to human readable string."""
+    return UPLINK_REASONS.get(code, f"Unknown ({code})")
+
+
+def parse_dm_record(record: Record | dict) -> dict:
+    """
+    Parse a single Digital Matter record into a normalized format.
+
+    Digital Matter sends records with various field types (FType):
+    - FType 0: GPS position data
+    - FType 2: Digital inputs
+    - FType 6: Analogue data (voltages, temperature, signal strength, external analog input)
+    - FType 27: Odometer and run hours
+    - FType 15: Accelerometer trace (accident / high-g uplinks)
+
+    Accepts a decoded :class:`Record` or the equivalent plain dict (which is
+    validated first). Accelerometer traces are returned under ``accel_trace`` as an
+    :class:`dm_common.accel.AccelTrace`, which is not JSON serialisable; the
+    caller is expected to pop it and store it out-of-band.
+    """
+    if isinstance(record, dict):
+        record = msgspec.convert(record, Record)
+
+    reason = record.Reason
+    result = {
+        "uplink_reason": get_uplink_reason(reason if reason is not None else 0),
+        "uplink_reason_code": reason,
+        "device_time_utc": record.DateUTC,
+        "sequence_number": record.SeqNo,
+    }
+
+    traces = []
+
+    for field in record.Fields:
+        ftype = field.FType
+
+        if ftype == 0:
+            # GPS position data
+            lat = field.Lat
+            lon = field.Long
+
+            if lat != 0 and lon != 0:
+                result["position"] = {
+                    "lat": lat,
+                    "long": lon,
+                    "alt": field.Alt,
+                }
+                # Speed is in cm/s, convert to km/h
+                result["speed_kmh"] = field.Spd * 0.036  # cm/s to km/h
+                result["heading"] = field.Head
+                result["gps_accuracy_m"] = field.PosAcc
+                result["pdop"] = field.PDOP
+            else:
+                result["gps_accuracy_m"] = 99
+
+        elif ftype == 2:
+            # Digital inputs
+            din = field.DIn
+            result["ignition_on"] = bool(din & 0b001)
+            result["digital_input_2"] = bool(din & 0b010)
+            result["digital_input_3"] = bool(din & 0b100)
+
+        elif ftype == 6:
+            # Analogue data
+            analogue = field.AnalogueData
+            # Field 1: Internal battery voltage (mV)
+            if "1" in analogue:
+                result["battery_voltage"] = analogue["1"] / 1000
+            # Field 2: External/system voltage (cV - centivolt)
+            if "2" in analogue:
+                result["system_voltage"] = analogue["2"] / 100
+            # Field 3: Device temperature (cC - centi-celsius)
+            if "3" in analogue:
+                result["device_temp_c"] = analogue["3"] / 100
+            # Field 4: Signal strength (0-31 scale)
+            if "4" in analogue:
+                result["signal_strength_percent"] = round(analogue["4"] * (100 / 31))
+            # Field 5: External analogue input (mV) - the physical analog input
+            # wire (e.g. G70 yellow wire, 0-40V). Mapped to "Analog 5" in the
+            # Digital Matter device config.
+            if "5" in analogue:
+                result["analog_input_v"] = analogue["5"] / 1000
+
+        elif ftype == 27:
+            # Odometer and run hours
+            # Odometer in m, convert to km
+            if field.Odo is not None:
+                result["odometer_km"] = field.Odo / 100
+            # Run hours in seconds, convert to hours
+            if field.RH is not None:
+                result["run_hours"] = field.RH / 3600
+
+        elif ftype == 9:
+            # Trip data
+            result["trip_distance_m"] = field.Dist
+            result["trip_idle_time_s"] = field.IdleTime
+
+        elif ftype == FTYPE_ACCEL_TRACE and field.Samples:
+            # Accelerometer trace. Imported here so NumPy is only loaded
+            # for the rare records that carry one.
+            from .. import accel
+
+            traces.append(accel.decode_trace(field.Samples, field.Rate, field.Scale))
+
+    if traces:
+        from .. import accel
+
+        result["accel_trace"] = accel.concat(traces)
+
+    return result
@@ -0,0 +1,42 @@
+"""Digital Matter Oyster3 LoRaWAN payload decoder.
+
+Covers the position (port 1) and downlink ack (port 2) frames. Output keys
+match the G62 decoder so both families share the same tag mapping.
+All multi-byte fields are little-endian.
+"""
+from __future__ import annotations
+
+
+def _i32(b: bytes, o: int) -> int:
+    v = b[o] | (b[o + 1] << 8) | (b[o + 2] << 16) | (b[o + 3] << 24)
+    return v - 0x100000000 if v & 0x80000000 else v
+
+
+def decode(payload: bytes, port: int) -> dict | None:
+    if port == 1 and len(payload) == 11:
+        return _decode_position(payload)
+    if port == 2 and len(payload) == 3:
+        return _decode_ack(payload)
+    return None
+
+
+def _decode_position(b: bytes) -> dict:
+    return {
+        "_type": "position",
+        "latitude": _i32(b, 0) / 1e7,
+        "longitude": _i32(b, 4) / 1e7,
+        "in_trip": bool(b[8] & 0x01),
+        "gps_current": not (b[8] & 0x02),
+        "heading_deg": (b[8] >> 2) * 5.625,
+        "speed_kmh": b[9],
+        "battery_v": b[10] * 0.025,
+    }
+
+
+def _decode_ack(b: bytes) -> dict:
+    return {
+        "_type": "downlink_ack",
+        "sequence": b[0] & 0x7F,
+        "accepted": bool(b[0] & 0x80),
+        "firmware_version": f"{b[1]}.{b[2]}",
+    }
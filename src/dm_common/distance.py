@@ -0,0 +1,254 @@
+"""GPS-derived distance, speed and odometer.
+
+Fixes are measured in batches: every fix a processor invocation applies (one
+per Digital Matter record, a whole batch for a G62 webhook, or a long track
+when replaying history) goes through one pass in :func:`measure`. A handful
+of fixes is measured with scalar ``math``; only batches of
+:data:`BATCH_MIN_FIXES` or more (track segments, history backfill) use a
+vectorised NumPy haversine. The last fix of each batch is carried in the device's
+:mod:`~dm_common.state` as the anchor the next batch is measured from, along
+with the running distance, so consecutive invocations join up into one
+odometer.
+
+Raw GPS wanders by a few metres even when a vehicle is parked, and summing
+that jitter inflates distance quickly. A fix is dropped if its reported
+accuracy or PDOP is poor, and a step between two fixes only counts if it is
+longer than their combined accuracy allows for (scaled by
+:data:`JITTER_FACTOR`), or if the device itself says it was moving. A step
+implying an impossible speed is a bad fix, not travel.
+
+The device's own odometer, when it reports one, is authoritative: the derived
+odometer is rebased onto each reading, so it only fills in between readings
+(or stands in for devices that have none).
+
+NumPy is imported lazily, on the first batch big enough to need it, so the
+per-event path doesn't pay its import time or memory.
+"""
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from . import logs
+from .state import DeviceState
+
+log = logs.get_logger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Fix quality. PDOP is as Digital Matter reports it, in tenths (i.e. 5.0).
+MAX_ACCURACY_M = 50.0
+MAX_PDOP = 50
+# Assumed for fixes that don't report an accuracy (e.g. G62 part 1 frames)
+DEFAULT_ACCURACY_M = 10.0
+
+# A step must be this many times the fixes' combined accuracy to count
+JITTER_FACTOR = 2.0
+# A reported speed at or above this means the step was real movement
+MOVING_KMH = 3.0
+MAX_SPEED_KMH = 300.0
+
+# Fewer points than this are measured without NumPy
+BATCH_MIN_FIXES = 32
+
+# DeviceState key: {"km": derived odometer, "fix": [t, lat, lng, accuracy_m]}
+STATE_KEY = "gps"
+
+
+@dataclass
+class Fix:
+    t: float  # seconds since the epoch
+    lat: float
+    lng: float
+    accuracy_m: float | None = None
+    pdop: float | None = None
+    speed_kmh: float | None = None  # as reported by the device
+
+
+@dataclass
+class Travel:
+    distance_km: float
+    speed_kmh: float | None  # implied by the last step; None without one
+    steps: int  # steps counted as travel
+    dropped: int  # fixes rejected for poor quality
+    anchor: Fix | None  # the last good fix, to measure the next batch from
+
+
+def epoch(timestamp: str | None) -> float | None:
+    """Seconds since the epoch for a device or receive time (naive is UTC)."""
+    try:
+        dt = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between coordinate arrays, in km."""
+    import numpy as np
+
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _haversine_step_km(a: Fix, b: Fix) -> float:
+    """:func:`haversine_km` for one pair of fixes, with ``math``."""
+    lat1, lat2 = math.radians(a.lat), math.radians(b.lat)
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(math.radians(b.lng - a.lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(h, 1.0)))
+
+
+def _known(value: float | None) -> bool:
+    return value is not None and not math.isnan(value)
+
+
+def _columns(fixes: list[Fix]):
+    """Fixes as a (6, n) float array, with None as nan."""
+    import numpy as np
+
+    rows = [(f.t, f.lat, f.lng, f.accuracy_m, f.pdop, f.speed_kmh) for f in fixes]
+    return np.array(rows, dtype=np.float64).T
+
+
+def measure(fixes: list[Fix], anchor: Fix | None = None) -> Travel:
+    """Distance travelled through ``fixes``, starting from ``anchor``."""
+    points = [anchor, *fixes] if anchor is not None else list(fixes)
+    if not points:
+        return Travel(0.0, None, 0, 0, None)
+    if len(points) < BATCH_MIN_FIXES:
+        travel, last = _measure_fixes(points, anchored=anchor is not None)
+    else:
+        travel, last = _measure(*_columns(points), anchored=anchor is not None)
+    travel.anchor = points[last] if last is not None else anchor
+    return travel
+
+
+def measure_track(t, lat, lng, accuracy_m=None, pdop=None, speed_kmh=None) -> Travel:
+    """:func:`measure` for a track already held as arrays, e.g. a replay."""
+    import numpy as np
+
+    t = np.asarray(t, dtype=np.float64)
+    unknown = np.full(len(t), np.nan)
+    columns = [
+        np.asarray(c, dtype=np.float64) if c is not None else unknown
+        for c in (lat, lng, accuracy_m, pdop, speed_kmh)
+    ]
+    travel, last = _measure(t, *columns, anchored=False)
+    if last is not None:
+        travel.anchor = Fix(*(float(c[last]) for c in (t, *columns)))
+    return travel
+
+
+def _measure_fixes(points: list[Fix], anchored: bool) -> tuple[Travel, int | None]:
+    """:func:`_measure` one step at a time, for a few fixes."""
+    kept = [
+        i for i, f in enumerate(points)
+        if (anchored and i == 0)
+        or not ((_known(f.accuracy_m) and f.accuracy_m > MAX_ACCURACY_M) or (_known(f.pdop) and f.pdop > MAX_PDOP))
+    ]
+    dropped = len(points) - len(kept)
+    if len(kept) < 2:
+        return Travel(0.0, None, 0, dropped, None), (kept[-1] if kept else None)
+
+    distance_km, steps, speed, counted = 0.0, 0, math.inf, False
+    for i, j in zip(kept, kept[1:]):
+        a, b = points[i], points[j]
+        step = _haversine_step_km(a, b)
+        dt = b.t - a.t
+        speed = step / (dt / 3600) if dt > 0 else math.inf
+        accuracy = (f.accuracy_m if _known(f.accuracy_m) else DEFAULT_ACCURACY_M for f in (a, b))
+        noise_km = JITTER_FACTOR * math.hypot(*accuracy) / 1000
+        moving = _known(b.speed_kmh) and b.speed_kmh >= MOVING_KMH
+        counted = speed <= MAX_SPEED_KMH and (step > noise_km or moving)
+        if counted:
+            distance_km += step
+            steps += 1
+
+    if counted:
+        last_speed = speed
+    else:
+        last_speed = 0.0 if math.isfinite(speed) else None
+    return Travel(distance_km, last_speed, steps, dropped, None), kept[-1]
+
+
+def _measure(t, lat, lng, accuracy, pdop, reported, anchored: bool) -> tuple[Travel, int | None]:
+    import numpy as np
+
+    # nan compares False, so an unreported accuracy or PDOP isn't a bad one
+    good = ~((accuracy > MAX_ACCURACY_M) | (pdop > MAX_PDOP))
+    if anchored:
+        good[0] = True
+    kept = np.flatnonzero(good)
+    dropped = len(t) - len(kept)
+    if len(kept) < 2:
+        return Travel(0.0, None, 0, dropped, None), (int(kept[-1]) if len(kept) else None)
+
+    t, lat, lng, reported = t[kept], lat[kept], lng[kept], reported[kept][1:]
+    accuracy = np.nan_to_num(accuracy[kept], nan=DEFAULT_ACCURACY_M)
+
+    step = haversine_km(lat[:-1], lng[:-1], lat[1:], lng[1:])
+    dt = np.diff(t)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.where(dt > 0, step / (dt / 3600), np.inf)
+    noise_km = JITTER_FACTOR * np.hypot(accuracy[:-1], accuracy[1:]) / 1000
+    counted = (speed <= MAX_SPEED_KMH) & ((step > noise_km) | (reported >= MOVING_KMH))
+
+    if counted[-1]:
+        last_speed = float(speed[-1])
+    else:
+        last_speed = 0.0 if np.isfinite(speed[-1]) else None
+    travel = Travel(float(step[counted].sum()), last_speed, int(counted.sum()), dropped, None)
+    return travel, int(kept[-1])
+
+
+class GpsOdometer:
+    """The derived odometer for one device, kept in its :class:`DeviceState`.
+
+    Add fixes (and device odometer readings) in the order they were taken,
+    then call :meth:`update` once to measure them and store the result.
+    """
+
+    def __init__(self, state: DeviceState):
+        self.state = state
+        saved = state.get(STATE_KEY) or {}
+        self.km: float | None = saved.get("km")
+        self.anchor = Fix(*saved["fix"]) if saved.get("fix") else None
+        self.speed_kmh: float | None = None
+        self._fixes: list[Fix] = []
+
+    def add(self, fix: Fix):
+        if self.anchor is not None and fix.t <= self.anchor.t:
+            return  # already measured past it
+        self._fixes.append(fix)
+
+    def reconcile(self, odometer_km: float):
+        """Rebase onto a reading from the device's own odometer."""
+        self._measure()
+        if self.km is not None and abs(self.km - odometer_km) >= 0.1:
+            log.info("gps odometer rebased", derived_km=round(self.km, 3), odometer_km=odometer_km)
+        self.km = odometer_km
+
+    def update(self) -> GpsOdometer:
+        self._measure()
+        if self.anchor is not None:
+            a = self.anchor
+            self.state[STATE_KEY] = {
+                "km": None if self.km is None else round(self.km, 4),
+                "fix": [a.t, a.lat, a.lng, a.accuracy_m],
+            }
+        return self
+
+    def _measure(self):
+        if not self._fixes:
+            return
+        travel = measure(self._fixes, self.anchor)
+        self._fixes = []
+        self.anchor = travel.anchor
+        if travel.speed_kmh is not None:
+            self.speed_kmh = travel.speed_kmh
+        if travel.distance_km or self.km is None:
+            self.km = (self.km or 0.0) + travel.distance_km
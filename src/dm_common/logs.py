@@ -0,0 +1,189 @@
+"""Structured, lazily formatted and sampled logging for the ingestion hot path.
+
+Log calls take an event name plus keyword fields::
+
+    log = logs.get_logger(__name__)
+    log.info("oem upload", serial=serial, records=len(records), bytes=size)
+
+Nothing is formatted unless a handler actually emits the record, and values
+are clipped to ``DM_LOG_MAX_CHARS`` when they are. Routine (INFO and DEBUG)
+records are sampled per logger; warnings and errors are always kept.
+
+Full payloads are never logged by default. Set ``DM_DEBUG_SERIAL`` to a
+serial number (or a comma separated list) to dump everything for just those
+devices via :meth:`StructLogger.payload`.
+
+Environment:
+
+``DM_LOG_SAMPLE``
+    Fraction of routine records to keep, either one rate (``0.1``) or per
+    logger name prefix (``integration=0.1,processor=1``); the longest
+    matching prefix wins and unmatched loggers keep everything.
+``DM_DEBUG_SERIAL``
+    Serial number(s) whose full payloads are logged, unsampled.
+``DM_LOG_MAX_CHARS``
+    Cap on each formatted field value (default 256).
+
+Malformed values fall back to the defaults with a warning, rather than
+failing the import of every handler.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import random
+from dataclasses import dataclass, field
+from typing import Any
+
+DEFAULT_MAX_CHARS = 256
+
+
+@dataclass
+class Settings:
+    sample_rates: dict[str, float] = field(default_factory=dict)
+    debug_serials: frozenset[str] = frozenset()
+    max_chars: int = DEFAULT_MAX_CHARS
+
+
+_settings = Settings()
+_loggers: dict[str, StructLogger] = {}
+
+
+def _parse_rates(spec: str | float | dict | None) -> dict[str, float]:
+    if spec is None or spec == "":
+        return {}
+    if isinstance(spec, dict):
+        return {k: float(v) for k, v in spec.items()}
+    if isinstance(spec, (int, float)):
+        return {"": float(spec)}
+    rates = {}
+    for part in spec.split(","):
+        name, sep, rate = part.strip().rpartition("=")
+        rates[name.strip() if sep else ""] = float(rate)
+    return rates
+
+
+def configure(
+    sample_rates: str | float | dict | None = None,
+    debug_serials: str | list | None = None,
+    max_chars: int | None = None,
+):
+    """Set sampling / debug options. Anything not given is read from the environment."""
+    global _settings
+    if sample_rates is None:
+        sample_rates = os.environ.get("DM_LOG_SAMPLE")
+    if debug_serials is None:
+        debug_serials = os.environ.get("DM_DEBUG_SERIAL", "")
+    if isinstance(debug_serials, str):
+        debug_serials = debug_serials.split(",")
+    if max_chars is None:
+        max_chars = os.environ.get("DM_LOG_MAX_CHARS", DEFAULT_MAX_CHARS)
+
+    try:
+        rates = _parse_rates(sample_rates)
+    except (TypeError, ValueError):
+        logging.getLogger(__name__).warning("invalid DM_LOG_SAMPLE %r; keeping every record", sample_rates)
+        rates = {}
+    try:
+        max_chars = int(max_chars)
+    except (TypeError, ValueError):
+        logging.getLogger(__name__).warning(
+            "invalid DM_LOG_MAX_CHARS %r; using %d", max_chars, DEFAULT_MAX_CHARS
+        )
+        max_chars = DEFAULT_MAX_CHARS
+
+    _settings = Settings(
+        sample_rates=rates,
+        debug_serials=frozenset(str(s).strip() for s in debug_serials if str(s).strip()),
+        max_chars=max_chars,
+    )
+    for logger in _loggers.values():
+        logger._rate = None
+
+
+def is_debug_serial(serial) -> bool:
+    return serial is not None and str(serial) in _settings.debug_serials
+
+
+def _clip(value: Any, limit: int) -> str:
+    text = value if isinstance(value, str) else repr(value)
+    if limit and len(text) > limit:
+        return f"{text[:limit]}...(+{len(text) - limit} chars)"
+    return text
+
+
+class _Event:
+    """A log message that is only formatted if a handler emits it."""
+
+    __slots__ = ("event", "fields", "limit")
+
+    def __init__(self, event: str, fields: dict, limit: int | None):
+        self.event = event
+        self.fields = fields
+        self.limit = limit
+
+    def __str__(self):
+        if not self.fields:
+            return self.event
+        limit = _settings.max_chars if self.limit is None else self.limit
+        parts = " ".join(f"{k}={_clip(v, limit)}" for k, v in self.fields.items())
+        return f"{self.event} {parts}"
+
+
+class StructLogger:
+    def __init__(self, name: str):
+        self.name = name
+        self.logger = logging.getLogger(name)
+        self._rate: float | None = None
+
+    @property
+    def rate(self) -> float:
+        if self._rate is None:
+            matches = [p for p in _settings.sample_rates if self.name.startswith(p)]
+            self._rate = _settings.sample_rates[max(matches, key=len)] if matches else 1.0
+        return self._rate
+
+    def _log(self, level: int, event: str, fields: dict, sampled=True, limit=None, **kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        if sampled and level < logging.WARNING:
+            rate = self.rate
+            if rate < 1.0 and random.random() >= rate:
+                return
+        # Fields travel only inside the message, which clips them when it's
+        # formatted; as a record extra, JSON formatters would emit them whole.
+        self.logger.log(level, _Event(event, fields, limit), **kwargs)
+
+    def debug(self, event: str, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+    def payload(self, serial, event: str, payload: Any, **fields):
+        """Log a full, unclipped payload, but only for ``DM_DEBUG_SERIAL`` devices."""
+        if is_debug_serial(serial):
+            self._log(
+                logging.INFO, event, {"serial": serial, **fields, "payload": payload},
+                sampled=False, limit=0,
+            )
+
+
+def get_logger(name: str) -> StructLogger:
+    try:
+        return _loggers[name]
+    except KeyError:
+        logger = _loggers[name] = StructLogger(name)
+        return logger
+
+
+configure()
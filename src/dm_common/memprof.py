@@ -0,0 +1,121 @@
+"""tracemalloc-based memory profiling for the handlers.
+
+Handlers open a session and mark their stages::
+
+    with memprof.session("integration.ingest"):
+        with memprof.stage("archive"):
+            ...
+
+Both are no-ops unless ``DM_MEMPROFILE`` is set (or a session is opened with
+``force=True``, as the budget tests do). When profiling, each session logs
+the peak traced allocation of every stage, measured from the start of the
+session, and the allocation sites that grew most during the heaviest stage.
+
+A session opened while another is active joins it, so a test can profile a
+whole handler and still see the handler's own stages.
+"""
+from __future__ import annotations
+
+import contextlib
+import os
+import tracemalloc
+from contextvars import ContextVar
+
+from . import logs
+
+log = logs.get_logger(__name__)
+
+TRACE_FRAMES = 1
+TOP_SITES = 10
+# Retake the top sites once a stage's peak is this much above the heaviest so far.
+SNAPSHOT_GROWTH = 1.25
+
+_current: ContextVar[Session | None] = ContextVar("memprof_session", default=None)
+
+
+def enabled() -> bool:
+    return os.environ.get("DM_MEMPROFILE", "").lower() in ("1", "true", "yes")
+
+
+class Session:
+    def __init__(self, name: str, top: int = TOP_SITES):
+        self.name = name
+        self.top = top
+        self.stages: dict[str, int] = {}
+        self.peak = 0
+        self.sites: list[tuple[str, int]] = []
+        self._owns_tracing = False
+        self._baseline = 0
+        self._baseline_snapshot = None
+        self._heaviest_peak = -1
+
+    def _sample_peak(self) -> int:
+        peak = tracemalloc.get_traced_memory()[1] - self._baseline
+        self.peak = max(self.peak, peak)
+        return peak
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        self._sample_peak()
+        tracemalloc.reset_peak()
+        try:
+            yield self
+        finally:
+            peak = self._sample_peak()
+            self.stages[name] = max(self.stages.get(name, 0), peak)
+            # snapshots are slow, so only retake them when the peak has
+            # clearly moved; a long burst otherwise snapshots every stage
+            if peak > self._heaviest_peak * SNAPSHOT_GROWTH:
+                self._heaviest_peak = peak
+                self._record_sites()
+
+    def _record_sites(self):
+        diff = tracemalloc.take_snapshot().compare_to(self._baseline_snapshot, "lineno")
+        self.sites = [
+            (f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", stat.size_diff)
+            for stat in diff
+            if stat.size_diff > 0 and stat.traceback[0].filename != tracemalloc.__file__
+        ][: self.top]
+
+    def report(self) -> dict:
+        return {
+            "handler": self.name,
+            "peak_bytes": self.peak,
+            "stages": dict(self.stages),
+            "top": self.sites,
+        }
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            self._owns_tracing = True
+        self._baseline_snapshot = tracemalloc.take_snapshot()
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        self._sample_peak()
+        _current.reset(self._token)
+        if self._owns_tracing:
+            tracemalloc.stop()
+        self._baseline_snapshot = None
+        log.info("memory profile", **self.report())
+
+
+def session(name: str, force: bool = False):
+    """Profile a handler if profiling is on; joins an already active session."""
+    active = _current.get()
+    if active is not None:
+        return contextlib.nullcontext(active)
+    if force or enabled():
+        return Session(name)
+    return contextlib.nullcontext(None)
+
+
+def stage(name: str):
+    active = _current.get()
+    if active is None:
+        return contextlib.nullcontext()
+    return active.stage(name)
@@ -0,0 +1,366 @@
+"""Write-ahead spool for publishes the Doover API couldn't take.
+
+When ``create_message`` fails or times out during ingestion, the message is
+appended to a spool on local disk (Lambda's ``/tmp`` survives between warm
+invocations) and the upload is still acknowledged, so the OEM Server doesn't
+retry the whole payload and republish records that already went through.
+
+The spool is a directory of append-only JSON-lines segments. Replayed lines
+are recorded in a sidecar ``.ack`` file (also append-only); a segment is
+deleted once every line in it is acked. Later warm invocations, or a
+scheduled invocation, drain it in concurrent batches, backing off
+exponentially while the API keeps failing.
+
+Once anything is spooled for an agent's channel, new publishes to that
+channel are spooled behind it rather than sent directly, so messages on a
+channel keep their order; other channels are still sent straight away.
+
+A publish the API rejects outright (a 4xx other than 401, 408 or 429, e.g.
+forwarding to an agent that was deleted) is never going to succeed, so it
+goes to a dead-letter file in the spool directory instead of being retried.
+So does an entry whose replay has failed :data:`MAX_REPLAY_ATTEMPTS` times,
+so one bad message can't hold its channel (and the drain) up for good.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import os
+import time
+from pathlib import Path
+
+from pydoover.models import File
+from pydoover.models.data.exceptions import HTTPError
+
+from . import logs
+
+log = logs.get_logger(__name__)
+
+SPOOL_DIR = os.environ.get("DM_SPOOL_DIR", "/tmp/dm_spool")
+
+# Total spool size. Past this, publishes fail as they did before the spool.
+MAX_SPOOL_BYTES = 64 * 1024 * 1024
+SEGMENT_BYTES = 1024 * 1024
+
+# A publish slower than this is treated as a failure and spooled.
+PUBLISH_TIMEOUT_S = 5.0
+
+DRAIN_BATCH_SIZE = 50
+DRAIN_CONCURRENCY = 8
+# Time a drain may spend before leaving the rest for the next invocation.
+DRAIN_BUDGET_S = 10.0
+
+BACKOFF_BASE_S = 1.0
+BACKOFF_MAX_S = 300.0
+
+# Replays of one entry before it's dead-lettered
+MAX_REPLAY_ATTEMPTS = 10
+# Dead letters kept; past this, they're only logged
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+MAX_DEAD_LETTER_BYTES = 4 * 1024 * 1024
+# Statuses worth retrying: the token, a timeout, or rate limiting
+RETRYABLE_STATUSES = {401, 408, 429}
+
+# Drain backoff per spool directory, kept for the life of the container.
+_backoff: dict[str, tuple[int, float]] = {}
+# Failed replays per (spool directory, segment, line), likewise.
+_attempts: dict[tuple[str, str, int], int] = {}
+
+
+def is_permanent(error: Exception) -> bool:
+    """Whether a publish failure will fail the same way every time."""
+    return (
+        isinstance(error, HTTPError)
+        and 400 <= error.status < 500
+        and error.status not in RETRYABLE_STATUSES
+    )
+
+
+class SpoolFull(Exception):
+    pass
+
+
+def _encode_files(files: list[File] | None) -> list[dict] | None:
+    if not files:
+        return None
+    return [
+        {
+            "filename": f.filename,
+            "content_type": f.content_type,
+            "data": base64.b64encode(f.data).decode(),
+        }
+        for f in files
+    ]
+
+
+def _decode_files(files: list[dict] | None) -> list[File] | None:
+    if not files:
+        return None
+    decoded = []
+    for f in files:
+        data = base64.b64decode(f["data"])
+        decoded.append(File(f["filename"], f["content_type"], len(data), data))
+    return decoded
+
+
+class Spool:
+    def __init__(self, directory: str | None = None, max_bytes: int | None = None):
+        self.directory = Path(directory or SPOOL_DIR)
+        self.max_bytes = MAX_SPOOL_BYTES if max_bytes is None else max_bytes
+
+    def _segments(self) -> list[Path]:
+        try:
+            return sorted(self.directory.glob("seg-*.jsonl"))
+        except FileNotFoundError:
+            return []
+
+    def has_pending(self) -> bool:
+        return bool(self._segments())
+
+    def size(self) -> int:
+        total = 0
+        for path in self.directory.glob("seg-*") if self.directory.exists() else []:
+            try:
+                total += path.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def pending(self) -> int:
+        """Number of spooled messages not yet replayed."""
+        return sum(len(lines) - len(acked) for _, lines, acked in self._read_segments())
+
+    def pending_groups(self) -> set[tuple]:
+        """The (agent_id, channel) pairs with messages waiting to be replayed."""
+        groups = set()
+        for _, lines, acked in self._read_segments():
+            for n, line in enumerate(lines):
+                if n not in acked:
+                    entry = json.loads(line)
+                    groups.add((entry.get("agent_id"), entry["channel"]))
+        return groups
+
+    def dead_letter(self, entry: dict, error: Exception):
+        """Set aside a message that can't be published."""
+        log.error(
+            "publish dead-lettered",
+            channel=entry["channel"],
+            agent_id=entry.get("agent_id"),
+            error=error,
+        )
+        path = self.directory / DEAD_LETTER_FILE
+        line = json.dumps({**entry, "error": str(error), "failed_at": time.time()}, separators=(",", ":"))
+        try:
+            if path.exists() and path.stat().st_size + len(line) > MAX_DEAD_LETTER_BYTES:
+                log.warning("dead-letter file full; dropping", channel=entry["channel"])
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(path, "a") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            log.warning("dead letter not written", error=e)
+
+    def dead_letters(self) -> list[dict]:
+        path = self.directory / DEAD_LETTER_FILE
+        if not path.exists():
+            return []
+        return [json.loads(line) for line in path.read_text().splitlines()]
+
+    @staticmethod
+    def _entry(channel: str, data: dict, agent_id: int | None = None, files=None) -> dict:
+        return {
+            "channel": channel,
+            "data": data,
+            "agent_id": agent_id,
+            "files": _encode_files(files),
+            "spooled_at": time.time(),
+        }
+
+    def append(self, channel: str, data: dict, agent_id: int | None = None, files=None):
+        """Spool one ``create_message``. Raises :class:`SpoolFull` past ``max_bytes``."""
+        line = json.dumps(
+            self._entry(channel, data, agent_id, files), separators=(",", ":")
+        ).encode() + b"\n"
+
+        if self.size() + len(line) > self.max_bytes:
+            raise SpoolFull(f"spool {self.directory} is full ({self.max_bytes} bytes)")
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        segments = self._segments()
+        segment = segments[-1] if segments else None
+        if segment is None or segment.stat().st_size + len(line) > SEGMENT_BYTES:
+            index = int(segment.stem.split("-")[1]) + 1 if segment else 0
+            segment = self.directory / f"seg-{index:08d}.jsonl"
+        with open(segment, "ab") as f:
+            f.write(line)
+
+    def _read_segments(self):
+        for segment in self._segments():
+            try:
+                lines = segment.read_bytes().splitlines()
+            except FileNotFoundError:
+                continue
+            ack_path = segment.with_suffix(".ack")
+            acked = set()
+            if ack_path.exists():
+                acked = {int(n) for n in ack_path.read_text().split()}
+            yield segment, lines, acked
+
+    # -- draining ---------------------------------------------------------
+
+    def _due(self) -> bool:
+        failures, next_at = _backoff.get(str(self.directory), (0, 0.0))
+        return time.monotonic() >= next_at
+
+    def _record_result(self, ok: bool):
+        key = str(self.directory)
+        if ok:
+            _backoff.pop(key, None)
+            return
+        failures = _backoff.get(key, (0, 0.0))[0] + 1
+        delay = min(BACKOFF_BASE_S * 2 ** (failures - 1), BACKOFF_MAX_S)
+        _backoff[key] = (failures, time.monotonic() + delay)
+
+    def note_failure(self):
+        """Back off draining after a direct publish failed."""
+        self._record_result(False)
+
+    async def drain(
+        self,
+        api,
+        batch_size: int = DRAIN_BATCH_SIZE,
+        concurrency: int = DRAIN_CONCURRENCY,
+        budget_s: float = DRAIN_BUDGET_S,
+        force: bool = False,
+    ) -> int:
+        """Replay spooled messages. Returns the number sent.
+
+        Skipped while backing off unless ``force`` is set. Stops at the first
+        batch with a failure, or when ``budget_s`` runs out. Entries that fail
+        for good are dead-lettered and acked, not counted as sent.
+        """
+        if not force and not self._due():
+            return 0
+
+        deadline = time.monotonic() + budget_s
+        semaphore = asyncio.Semaphore(concurrency)
+        sent = 0
+
+        async def send(entry) -> bool:
+            kwargs = {}
+            if entry.get("agent_id") is not None:
+                kwargs["agent_id"] = entry["agent_id"]
+            files = _decode_files(entry.get("files"))
+            if files:
+                kwargs["files"] = files
+            async with semaphore:
+                await asyncio.wait_for(
+                    api.create_message(entry["channel"], entry["data"], **kwargs),
+                    PUBLISH_TIMEOUT_S,
+                )
+            return True
+
+        async def send_in_order(segment, items) -> tuple[list[int], int]:
+            # one (agent, channel) at a time, stopping at its first failure;
+            # returns the lines to ack and how many of them were sent
+            done, dead = [], 0
+            for n, entry in items:
+                try:
+                    await send(entry)
+                except Exception as e:
+                    key = (str(self.directory), segment.name, n)
+                    _attempts[key] = _attempts.get(key, 0) + 1
+                    if not is_permanent(e) and _attempts[key] < MAX_REPLAY_ATTEMPTS:
+                        log.warning("spool replay failed", channel=entry["channel"], error=e)
+                        break
+                    _attempts.pop(key, None)
+                    self.dead_letter(entry, e)
+                    dead += 1
+                done.append(n)
+            return done, dead
+
+        for segment, lines, acked in self._read_segments():
+            todo = [(n, line) for n, line in enumerate(lines) if n not in acked]
+            while todo:
+                batch, todo = todo[:batch_size], todo[batch_size:]
+                groups: dict[tuple, list] = {}
+                for n, line in batch:
+                    entry = json.loads(line)
+                    groups.setdefault((entry.get("agent_id"), entry["channel"]), []).append((n, entry))
+
+                results = await asyncio.gather(*(send_in_order(segment, items) for items in groups.values()))
+                done = [n for result, _ in results for n in result]
+                if done:
+                    with open(segment.with_suffix(".ack"), "a") as f:
+                        f.write("".join(f"{n}\n" for n in done))
+                    acked.update(done)
+                    sent += len(done) - sum(dead for _, dead in results)
+
+                if len(done) < len(batch):
+                    self._record_result(False)
+                    log.warning("spool drain backing off", sent=sent, pending=self.pending())
+                    return sent
+                if time.monotonic() > deadline:
+                    log.info("spool drain budget spent", sent=sent)
+                    return sent
+
+            # only remove it if nothing was appended while we were replaying
+            if len(acked) >= len(lines) and len(segment.read_bytes().splitlines()) == len(lines):
+                segment.unlink(missing_ok=True)
+                segment.with_suffix(".ack").unlink(missing_ok=True)
+
+        self._record_result(True)
+        if sent:
+            log.info("spool drained", sent=sent)
+        return sent
+
+
+class SpooledPublisher:
+    """``create_message`` that falls back to the spool instead of raising.
+
+    After the first failure in an invocation, everything else is spooled
+    without trying the API again, so a degraded API costs one timeout rather
+    than one per record. A rejected publish is dead-lettered and doesn't
+    degrade anything.
+    """
+
+    def __init__(self, api, spool: Spool | None = None, timeout_s: float = PUBLISH_TIMEOUT_S):
+        self.api = api
+        self.spool = spool or Spool()
+        self.timeout_s = timeout_s
+        # spool behind any backlog so each channel stays in order
+        self.held = self.spool.pending_groups() if self.spool.has_pending() else set()
+        self.degraded = False
+        self.failed = False
+        self.spooled = 0
+
+    async def create_message(self, channel: str, data: dict, agent_id: int | None = None, files=None):
+        group = (agent_id, channel)
+        if not self.degraded and group not in self.held:
+            kwargs = {"agent_id": agent_id} if agent_id is not None else {}
+            if files:
+                kwargs["files"] = files
+            try:
+                return await asyncio.wait_for(
+                    self.api.create_message(channel, data, **kwargs), self.timeout_s
+                )
+            except Exception as e:
+                if is_permanent(e):
+                    self.spool.dead_letter(Spool._entry(channel, data, agent_id, files), e)
+                    return None
+                log.warning("publish failed; spooling", channel=channel, error=e)
+                self.degraded = self.failed = True
+                self.spool.note_failure()
+
+        self.held.add(group)
+
+        # raises SpoolFull when there's no room, failing the upload as before
+        self.spool.append(channel, data, agent_id=agent_id, files=files)
+        self.spooled += 1
+        return None
+
+    async def drain(self, **kwargs) -> int:
+        if self.failed and not kwargs.get("force"):
+            return 0  # the API just failed us; leave it to the backoff
+        return await self.spool.drain(self.api, **kwargs)
@@ -0,0 +1,185 @@
+"""Compact per-device state, persisted between processor invocations.
+
+One versioned blob per agent, in the ``dm_state`` channel aggregate::
+
+    {"v": 1, "rev": 17, "data": {"t": "2024-01-01 00:05:00", "seq": 812}}
+
+A processor loads it once per invocation, reads and assigns keys in memory,
+and saves once at the end; nothing is written unless a key changed. A warm
+container keeps the last state it loaded or saved for each agent and serves
+the next load from that for :data:`CACHE_TTL_S`, so a steady stream of
+events costs no reads.
+
+Doover has no conditional writes, so concurrency is handled optimistically
+rather than with a lock. A save PATCHes only the keys changed since the load
+(plus ``rev``), so writers touching different keys can't clobber each other.
+A save writes first, whether or not the state came from the warm cache, and
+then checks the blob the API returns against what it expected. If it differs,
+another invocation wrote since this one's load: the stored blob is adopted,
+the invocation's changes are applied to it again (by the caller's
+``reapply``, or by replaying the same assignments), and the save is retried,
+up to :data:`SAVE_ATTEMPTS` times. A key both invocations changed can't be
+told apart this way; the later write wins it, and ``reapply`` only keeps the
+rest consistent.
+
+Values should be JSON-able and replaced by assignment, not mutated in place;
+an in-place change isn't seen as a change.
+"""
+from __future__ import annotations
+
+import time
+from typing import Awaitable, Callable
+
+from . import logs
+
+log = logs.get_logger(__name__)
+
+STATE_CHANNEL = "dm_state"
+STATE_VERSION = 1
+CACHE_TTL_S = 300.0
+SAVE_ATTEMPTS = 3
+
+# (agent_id, channel) -> (cached at, rev, data)
+_cache: dict[tuple, tuple[float, int, dict]] = {}
+
+
+class DeviceState:
+    """An agent's state as loaded for one invocation."""
+
+    def __init__(self, data: dict | None = None, rev: int = 0, version: int = STATE_VERSION):
+        self._data = dict(data or {})
+        self.rev = rev
+        # a blob written by a newer release is read but never overwritten
+        self.read_only = version > STATE_VERSION
+        self.conflicted = False
+        self._changed: set[str] = set()
+        self._removed: set[str] = set()
+
+    def get(self, key: str, default=None):
+        return self._data.get(key, default)
+
+    def __getitem__(self, key: str):
+        return self._data[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+
+    def __setitem__(self, key: str, value):
+        if key in self._data and self._data[key] == value:
+            return
+        self._data[key] = value
+        self._changed.add(key)
+        self._removed.discard(key)
+
+    def pop(self, key: str, default=None):
+        if key not in self._data:
+            return default
+        self._changed.discard(key)
+        self._removed.add(key)
+        return self._data.pop(key)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._changed or self._removed)
+
+    def to_dict(self) -> dict:
+        return dict(self._data)
+
+    def _reset(self, data: dict, rev: int):
+        """Start again from a stored blob, dropping uncommitted changes."""
+        self._data = dict(data)
+        self.rev = rev
+        self._changed.clear()
+        self._removed.clear()
+
+
+def _blob(aggregate) -> dict:
+    return (aggregate.data if aggregate is not None else None) or {}
+
+
+class StateStore:
+    def __init__(self, api, channel: str = STATE_CHANNEL):
+        self.api = api
+        self.channel = channel
+
+    @property
+    def _key(self) -> tuple:
+        return getattr(self.api, "agent_id", None), self.channel
+
+    def _remember(self, state: DeviceState):
+        _cache[self._key] = (time.monotonic(), state.rev, state.to_dict())
+
+    async def load(self) -> DeviceState:
+        cached = _cache.get(self._key)
+        if cached is not None and time.monotonic() - cached[0] < CACHE_TTL_S:
+            return DeviceState(cached[2], cached[1])
+
+        blob = _blob(await self.api.fetch_channel_aggregate(self.channel))
+        version = blob.get("v", STATE_VERSION)
+        state = DeviceState(blob.get("data"), blob.get("rev", 0), version)
+        if state.read_only:
+            log.warning("state written by a newer version; not saving", version=version)
+        else:
+            self._remember(state)
+        return state
+
+    async def save(
+        self, state: DeviceState, reapply: Callable[[DeviceState], Awaitable[None]] | None = None
+    ) -> bool:
+        """Write what changed, if anything. Returns False if it couldn't be.
+
+        On a conflict ``reapply`` is awaited with the state reset to what's
+        stored, to make this invocation's changes again; without one, the
+        same assignments are replayed.
+        """
+        for _ in range(SAVE_ATTEMPTS):
+            if not state.dirty:
+                return True
+            if state.read_only:
+                return False
+
+            update = {
+                "v": STATE_VERSION,
+                "rev": state.rev + 1,
+                "data": {key: state._data[key] for key in state._changed},
+            }
+            replace = [f"data.{key}" for key in state._removed]
+            try:
+                result = await self.api.update_channel_aggregate(
+                    self.channel, update, replace_keys=replace or None
+                )
+            except Exception:
+                # whether it landed is unknown, so the next load reads it back
+                _cache.pop(self._key, None)
+                raise
+
+            blob = _blob(result)
+            if blob and (blob.get("rev") != state.rev + 1 or blob.get("data") != state.to_dict()):
+                # another invocation wrote since the load (or the warm copy is stale)
+                await self._rebase(state, blob, reapply)
+                continue
+            state._reset(state._data, state.rev + 1)
+            self._remember(state)
+            return True
+
+        log.warning("state still conflicting; giving up", channel=self.channel, attempts=SAVE_ATTEMPTS)
+        _cache.pop(self._key, None)
+        return False
+
+    async def _rebase(self, state: DeviceState, blob: dict, reapply):
+        log.warning("state changed concurrently; reapplying", channel=self.channel, rev=blob.get("rev"))
+        changes = {key: state._data[key] for key in state._changed}
+        removed = set(state._removed)
+        state.conflicted = True
+        state._reset(blob.get("data") or {}, blob.get("rev", 0))
+        state.read_only = blob.get("v", STATE_VERSION) > STATE_VERSION
+        if state.read_only:
+            return
+        self._remember(state)
+        if reapply is not None:
+            await reapply(state)
+            return
+        for key, value in changes.items():
+            state[key] = value
+        for key in removed:
+            state.pop(key)
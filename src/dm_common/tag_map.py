@@ -0,0 +1,35 @@
+"""Apply decoded device fields to processor tags.
+
+Every processor does the same thing with a decoded record: for each field it
+knows about, set the matching tag. This keeps that in one place, driven by a
+``{decoded_key: tag_name}`` mapping declared next to each processor.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable
+
+from pydoover.tags import Tags
+
+
+async def apply_tags(
+    tags: Tags,
+    decoded: dict[str, Any],
+    mapping: dict[str, str],
+    transforms: dict[str, Callable[[Any], Any]] | None = None,
+) -> list[str]:
+    """Set ``tags.<tag_name>`` for every mapped key present in ``decoded``.
+
+    ``transforms`` optionally maps a decoded key to a callable applied to the
+    value before it's written (e.g. adding a configured offset). Returns the
+    decoded keys that were applied.
+    """
+    applied = []
+    for key, tag_name in mapping.items():
+        if key not in decoded:
+            continue
+        value = decoded[key]
+        if transforms and key in transforms:
+            value = transforms[key](value)
+        await getattr(tags, tag_name).set(value)
+        applied.append(key)
+    return applied
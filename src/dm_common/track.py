@@ -0,0 +1,177 @@
+"""Compact delta-encoded location tracks.
+
+A track segment packs a run of fixes into one message instead of one
+``location`` message per fix. Each fix is stored as the difference from the
+previous one: seconds elapsed, then latitude / longitude (and optionally
+altitude) as integer steps of the configured precision, all zigzag varint
+encoded. Neighbouring fixes are close together, so most deltas fit in one or
+two bytes.
+
+Wire layout (before base64url)::
+
+    version u8 | flags u8 | precision digits u8 | t0 zigzag | count varint
+    then per fix: dt zigzag | dlat zigzag | dlng zigzag [| dalt zigzag]
+
+Fixes keep the order they're given in, and ``dt`` is signed, so a fix that
+arrived out of order keeps its own time. Version 1 segments (unsigned ``t0``
+and ``dt``) still decode.
+
+This module also owns the canonical location point shape, ``{"lat", "lng"}``
+(plus ``"alt"`` when known), used on the ``location`` channel by every
+processor.
+"""
+from __future__ import annotations
+
+import base64
+from datetime import datetime, timezone
+from typing import Iterable
+
+ENCODING = "dm-track-v1"
+VERSION = 2
+FLAG_ALT = 0x01
+
+DEFAULT_PRECISION_DIGITS = 6  # 1e-6 degrees, ~0.11 m
+
+
+def location_point(lat: float, lng: float, alt: float | None = None) -> dict:
+    """The canonical ``location`` channel payload."""
+    point = {"lat": lat, "lng": lng}
+    if alt is not None:
+        point["alt"] = alt
+    return point
+
+
+def parse_time(value: str | int | float | datetime | None) -> int | None:
+    """Unix seconds from a DateUTC string, datetime or number.
+
+    Returns None for a string that isn't an ISO 8601 date.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _unzigzag(n: int) -> int:
+    return (n >> 1) ^ -(n & 1)
+
+
+def _put_varint(out: bytearray, n: int):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(buf: bytes, pos: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode(
+    fixes: Iterable[dict],
+    precision_digits: int = DEFAULT_PRECISION_DIGITS,
+) -> dict:
+    """Encode fixes into a track segment message.
+
+    Each fix is a dict with ``lat``, ``lng``, ``timestamp`` (anything
+    :func:`parse_time` accepts) and optionally ``alt``. Fixes without a
+    timestamp are given the previous fix's time. ``start`` and ``end`` are
+    the earliest and latest times in the segment.
+    """
+    fixes = list(fixes)
+    if not fixes:
+        raise ValueError("cannot encode an empty track")
+
+    scale = 10 ** precision_digits
+    has_alt = any(f.get("alt") is not None for f in fixes)
+    times = [parse_time(f.get("timestamp")) for f in fixes]
+    t0 = next((t for t in times if t is not None), 0)
+
+    out = bytearray((VERSION, FLAG_ALT if has_alt else 0, precision_digits))
+    _put_varint(out, _zigzag(t0))
+    _put_varint(out, len(fixes))
+
+    prev_t, prev_lat, prev_lng, prev_alt = t0, 0, 0, 0
+    start = end = t0
+    for fix, t in zip(fixes, times):
+        t = prev_t if t is None else t
+        start, end = min(start, t), max(end, t)
+        lat = round(fix["lat"] * scale)
+        lng = round(fix["lng"] * scale)
+        _put_varint(out, _zigzag(t - prev_t))
+        _put_varint(out, _zigzag(lat - prev_lat))
+        _put_varint(out, _zigzag(lng - prev_lng))
+        if has_alt:
+            alt = round(fix.get("alt") or 0)
+            _put_varint(out, _zigzag(alt - prev_alt))
+            prev_alt = alt
+        prev_t, prev_lat, prev_lng = t, lat, lng
+
+    return {
+        "encoding": ENCODING,
+        "precision": 10 ** -precision_digits,
+        "start": start,
+        "end": end,
+        "count": len(fixes),
+        "data": base64.urlsafe_b64encode(bytes(out)).rstrip(b"=").decode(),
+    }
+
+
+def decode(segment: dict) -> list[dict]:
+    """Decode a track segment message back into fixes.
+
+    Returns ``[{"lat", "lng", "timestamp"[, "alt"]}, ...]`` with timestamps
+    as unix seconds.
+    """
+    if segment.get("encoding") != ENCODING:
+        raise ValueError(f"unsupported track encoding {segment.get('encoding')!r}")
+
+    data = segment["data"]
+    buf = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    version, flags, digits = buf[0], buf[1], buf[2]
+    if version not in (1, VERSION):
+        raise ValueError(f"unsupported track version {version}")
+    # version 1 only went forward in time
+    signed = _unzigzag if version >= 2 else (lambda n: n)
+    scale = 10 ** digits
+    has_alt = bool(flags & FLAG_ALT)
+
+    t, pos = _get_varint(buf, 3)
+    t = signed(t)
+    count, pos = _get_varint(buf, pos)
+
+    fixes = []
+    lat = lng = alt = 0
+    for _ in range(count):
+        dt, pos = _get_varint(buf, pos)
+        dlat, pos = _get_varint(buf, pos)
+        dlng, pos = _get_varint(buf, pos)
+        t += signed(dt)
+        lat += _unzigzag(dlat)
+        lng += _unzigzag(dlng)
+        fix = {"lat": lat / scale, "lng": lng / scale, "timestamp": t}
+        if has_alt:
+            dalt, pos = _get_varint(buf, pos)
+            alt += _unzigzag(dalt)
+            fix["alt"] = alt
+        fixes.append(fix)
+    return fixes
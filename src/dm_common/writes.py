@@ -0,0 +1,173 @@
+"""Per-invocation coalescing of processor API writes.
+
+A processor handler queues its side effects on a :class:`WriteCoalescer`
+instead of awaiting each API call in turn::
+
+    async with WriteCoalescer(self.api) as writes:
+        writes.update_channel_aggregate("location", point, replace_data=True)
+        writes.create_message("location", point)
+        writes.defer("ping", self.ping_connection)
+
+On exit the queued writes are flushed concurrently. Aggregate updates to the
+same ``(agent, channel)`` are merged into one PATCH (a ``replace_data``
+update supersedes whatever was queued before it), deferred calls queued under
+the same key collapse to the last one, and writes to one channel are still
+sent in the order they were queued.
+
+Tag writes don't go through here: pydoover already buffers them and commits
+them in a single aggregate update when the invocation ends.
+
+:class:`PooledDataClient` shares one aiohttp session, and so one keep-alive
+connection pool, across warm invocations of the same container.
+"""
+from __future__ import annotations
+
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable
+
+import aiohttp
+from pydoover.processor.data_client import ProcessorDataClient
+
+from . import logs
+
+log = logs.get_logger(__name__)
+
+# Writes in flight at once when flushing.
+DEFAULT_CONCURRENCY = 8
+
+_session: aiohttp.ClientSession | None = None
+_session_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _merge(target: dict, update: dict):
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+class _AggregateUpdate:
+    __slots__ = ("channel", "agent_id", "data", "replace_data")
+
+    def __init__(self, channel, agent_id, data, replace_data):
+        self.channel = channel
+        self.agent_id = agent_id
+        self.data = copy.deepcopy(data)
+        self.replace_data = replace_data
+
+    def __call__(self, api):
+        kwargs = {"agent_id": self.agent_id} if self.agent_id is not None else {}
+        if self.replace_data:
+            kwargs["replace_data"] = True
+        return api.update_channel_aggregate(self.channel, self.data, **kwargs)
+
+
+class WriteCoalescer:
+    def __init__(self, api, concurrency: int = DEFAULT_CONCURRENCY):
+        self.api = api
+        self.concurrency = concurrency
+        # (agent_id, channel) or deferred key -> queued operations, in order
+        self._groups: dict[Any, list] = {}
+        self._aggregates: dict[tuple, _AggregateUpdate] = {}
+
+    def __len__(self):
+        return sum(len(ops) for ops in self._groups.values())
+
+    def create_message(self, channel: str, data: dict, agent_id: int | None = None, **kwargs):
+        if agent_id is not None:
+            kwargs["agent_id"] = agent_id
+        self._groups.setdefault((agent_id, channel), []).append(
+            lambda api: api.create_message(channel, data, **kwargs)
+        )
+
+    def update_channel_aggregate(
+        self,
+        channel: str,
+        data: dict,
+        replace_data: bool = False,
+        agent_id: int | None = None,
+    ):
+        key = (agent_id, channel)
+        pending = self._aggregates.get(key)
+        if pending is not None and not replace_data:
+            _merge(pending.data, data)
+            return
+        if pending is not None:
+            # a full replace makes anything queued before it moot
+            pending.data = copy.deepcopy(data)
+            pending.replace_data = True
+            return
+        update = self._aggregates[key] = _AggregateUpdate(channel, agent_id, data, replace_data)
+        self._groups.setdefault(key, []).append(update)
+
+    def defer(self, key: str, func: Callable[[], Awaitable]):
+        """Queue an arbitrary call; only the last one queued under ``key`` runs."""
+        self._groups[("deferred", key)] = [lambda api: func()]
+
+    async def flush(self):
+        """Send everything queued. Raises the first failure once all writes are attempted."""
+        groups, self._groups, self._aggregates = self._groups, {}, {}
+        if not groups:
+            return
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(ops):
+            for op in ops:
+                async with semaphore:
+                    await op(self.api)
+
+        results = await asyncio.gather(*(run(ops) for ops in groups.values()), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        for key, result in zip(groups, results):
+            if isinstance(result, BaseException):
+                log.error("coalesced write failed", target=key, error=result)
+        if errors:
+            raise errors[0]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.flush()
+            return
+        # a failed handler's partial writes are dropped, not half-published
+        if self._groups:
+            log.warning("handler failed; discarding queued writes", writes=len(self), error=exc)
+        self._groups, self._aggregates = {}, {}
+
+
+async def shared_session(headers: dict | None = None) -> aiohttp.ClientSession:
+    """The container-wide aiohttp session for the running event loop."""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session = aiohttp.ClientSession(
+            headers=headers,
+            connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=60),
+        )
+        _session_loop = loop
+    return _session
+
+
+class PooledDataClient(ProcessorDataClient):
+    """A ProcessorDataClient whose HTTP session outlives the invocation."""
+
+    async def setup(self):
+        self._session = await shared_session({"User-Agent": self._user_agent})
+
+    async def close(self):
+        # leave the shared session open for the next warm invocation
+        self._session = None
+        await super().close()
+
+
+async def close_shared_session():
+    """Close the container-wide session, for processes that host apps long-term."""
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = _session_loop = None
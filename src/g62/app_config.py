@@ -1,13 +1,52 @@
 from pathlib import Path
 
 from pydoover import config
-from pydoover.processor import ManySubscriptionConfig
+from pydoover.processor import ManySubscriptionConfig, SerialNumberConfig
 
 
 class G62ProcessorConfig(config.Schema):
-    subscription = ManySubscriptionConfig(default=["on_tts_event"], hidden=True)
+    subscription = ManySubscriptionConfig(default=["on_tts_event", "on_g62_event", "dm_downlink"], hidden=True)
     position = config.ApplicationPosition()
 
+    serial_number = SerialNumberConfig(
+        "DevEUI",
+        description="The device's LoRaWAN DevEUI. Needed when uplinks come through the G62 Integration.",
+        default="",
+    )
+
+    device_model = config.Enum(
+        "Device Model",
+        choices=["g62", "oyster3"],
+        default="g62",
+        description="Which Digital Matter LoRaWAN payload format this device sends.",
+        advanced=True,
+    )
+
+    tts_api_url = config.String(
+        "TTS API URL",
+        default="",
+        description="The Things Stack cluster downlinks are queued through, e.g. https://au1.cloud.thethings.network. Leave empty to hold downlinks.",
+        advanced=True,
+    )
+    tts_webhook_id = config.String(
+        "TTS Webhook ID",
+        default="doover",
+        description="ID of the TTS webhook that forwards this device's uplinks.",
+        advanced=True,
+    )
+    tts_api_key = config.String(
+        "TTS API Key",
+        default="",
+        description="TTS API key with rights to queue downlinks for the application.",
+        advanced=True,
+    )
+    downlink_max_payload = config.Integer(
+        "Downlink Max Payload",
+        default=51,
+        description="Largest downlink payload in bytes at the device's data rate; parameter changes are packed into frames of this size.",
+        advanced=True,
+    )
+
     hide_ui = config.Boolean(
         "Hide Default UI",
         description="Whether to hide the default UI. Useful if you have a custom UI application.",
@@ -25,8 +25,17 @@ class G62Tags(Tags):
     # Counters
     runtime_s = Tag("integer", default=None)
     odometer_km = Tag("number", default=None)
+    # derived from GPS fixes, rebased onto odometer_km when the device reports it
+    gps_odometer_km = Tag("number", default=None)
+    gps_speed_kmh = Tag("number", default=None)
 
     # Downlink ack
     downlink_ack_seq = Tag("integer", default=None)
     downlink_ack_accepted = Tag("boolean", default=None)
     firmware_version = Tag("string", default=None)
+
+    # Downlink queue
+    downlink_pending = Tag("integer", default=0)
+    downlink_inflight = Tag("integer", default=0)
+    downlink_failed = Tag("integer", default=0)
+    downlink_last_seq = Tag("integer", default=None)
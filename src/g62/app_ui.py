@@ -46,6 +46,11 @@ class G62UI(ui.UI, hidden="$config.app().hide_ui"):
         "Odometer", value=G62Tags.odometer_km, units="km", precision=1
     )
 
+    # GPS-derived odometer
+    gps_odometer_km = ui.NumericVariable(
+        "GPS Odometer", value=G62Tags.gps_odometer_km, units="km", precision=1
+    )
+
     # External (system) voltage
     external_v = ui.NumericVariable(
         "System Voltage",
@@ -1,15 +1,63 @@
 import base64
-import logging
+from functools import partial
 
 from pydoover.processor import Application
 from pydoover.models import MessageCreateEvent
 
+from dm_common import decoders, logs, memprof
+from dm_common.channels import DECODED_UPLINK_CHANNEL
+from dm_common.distance import epoch
+from dm_common.state import DeviceState, StateStore
+from dm_common.tag_map import apply_tags
+from dm_common.track import location_point
+from dm_common.writes import PooledDataClient, WriteCoalescer, shared_session
+
 from .app_config import G62ProcessorConfig
 from .app_tags import G62Tags
 from .app_ui import G62UI
-from . import decoder
+from .downlink import DOWNLINK_CHANNEL, DownlinkScheduler, TtsNetworkServer, parse_parameters
+
+log = logs.get_logger(__name__)
+
+# decoded field -> G62Tags attribute. Shared by every LoRaWAN family this
+# processor can decode, since their decoders emit the same key names.
+TAG_MAP = {
+    "trip_type": "trip_type",
+    "ext_power_good": "ext_power_good",
+    "gps_current": "gps_current",
+    "ignition": "ignition",
+    "digital_input_1": "digital_input_1",
+    "digital_input_2": "digital_input_2",
+    "digital_output": "digital_output",
+    "heading_deg": "heading_deg",
+    "speed_kmh": "speed_kmh",
+    "gps_accuracy_m": "gps_accuracy_m",
+    "battery_v": "battery_v",
+    "external_v": "external_v",
+    "analog_input_v": "analog_input_v",
+    "temperature_c": "temperature_c",
+    "runtime_s": "runtime_s",
+    "odometer_km": "odometer_km",
+}
+
+ACK_TAG_MAP = {
+    "sequence": "downlink_ack_seq",
+    "accepted": "downlink_ack_accepted",
+    "firmware_version": "firmware_version",
+}
+
+# Uplinks remembered per device (in its state) to recognise TTS retries
+SEEN_UPLINKS = 64
+
+# Parameter changes to send the device, as {"parameters": {id: value}}.
+DOWNLINK_COMMAND_CHANNEL = "dm_downlink"
 
-log = logging.getLogger(__name__)
+
+def _uplink_key(record: dict) -> tuple | None:
+    """What a retried uplink repeats: its receive time and frame counter."""
+    if not record.get("received_at"):
+        return None
+    return record["received_at"], record.get("f_cnt")
 
 
 class G62Processor(Application):
@@ -21,13 +69,26 @@ class G62Processor(Application):
     tags: G62Tags
     ui: G62UI
 
+    def __init__(self):
+        super().__init__()
+        self.api = PooledDataClient(self._api_endpoint)
+
     async def on_message_create(self, event: MessageCreateEvent):
+        if event.channel.name == DOWNLINK_COMMAND_CHANNEL:
+            await self.on_downlink_command(event.message.data)
+            return
+        if event.channel.name == DECODED_UPLINK_CHANNEL:
+            with memprof.session("g62.uplink"):
+                await self._handle_decoded(event.message.data)
+            return
         if event.channel.name != "on_tts_event":
             return
 
         uplink = event.message.data.get("uplink_message")
         if not uplink:
             return
+        device_ids = event.message.data.get("end_device_ids") or {}
+        dev_eui = device_ids.get("dev_eui")
 
         port = uplink.get("f_port")
         frm = uplink.get("frm_payload")
@@ -37,47 +98,222 @@ class G62Processor(Application):
         try:
             payload = base64.b64decode(frm)
         except Exception:
-            log.exception("Failed to base64-decode frm_payload: %r", frm)
+            log.exception("frm_payload not base64", dev_eui=dev_eui, frm_payload=frm)
             return
 
-        decoded = decoder.decode(payload, port)
+        with memprof.session("g62.uplink"):
+            await self._handle_uplink(
+                payload, port, device_ids, uplink.get("received_at"), uplink.get("f_cnt")
+            )
+
+    async def _handle_uplink(
+        self,
+        payload: bytes,
+        port: int,
+        device_ids: dict,
+        received_at: str | None = None,
+        f_cnt: int | None = None,
+    ):
+        dev_eui = device_ids.get("dev_eui")
+        model = self.config.device_model.value
+        with memprof.stage("decode"):
+            decoded = decoders.decode(model, payload, port)
         if not decoded:
-            log.warning("G62 port=%s len=%s did not match any known message", port, len(payload))
+            log.warning(
+                "unknown message", dev_eui=dev_eui, model=model, port=port, bytes=len(payload)
+            )
             return
 
-        log.info("G62 decoded: %s", decoded)
-        await self.apply_decoded(decoded)
+        log.info("uplink decoded", dev_eui=dev_eui, model=model, type=decoded.get("_type"))
+        log.payload(dev_eui, "uplink payload", decoded)
+        if received_at:
+            decoded["received_at"] = received_at
+        decoded["f_cnt"] = f_cnt
+        await self._apply_uplinks([decoded], device_ids)
 
-        if "latitude" in decoded and "longitude" in decoded:
-            await self.api.create_message(
-                "location",
-                {"lat": decoded["latitude"], "lng": decoded["longitude"]},
-            )
+    async def _handle_decoded(self, data: dict):
+        """Apply a batch of uplinks the G62 integration decoded, in order."""
+        records = data.get("records") or []
+        if not records:
+            return
+        log.info("decoded uplinks", dev_eui=data.get("dev_eui"), records=len(records))
 
-    async def apply_decoded(self, d: dict):
-        mapping = {
-            "trip_type": self.tags.trip_type,
-            "ext_power_good": self.tags.ext_power_good,
-            "gps_current": self.tags.gps_current,
-            "ignition": self.tags.ignition,
-            "digital_input_1": self.tags.digital_input_1,
-            "digital_input_2": self.tags.digital_input_2,
-            "digital_output": self.tags.digital_output,
-            "heading_deg": self.tags.heading_deg,
-            "speed_kmh": self.tags.speed_kmh,
-            "gps_accuracy_m": self.tags.gps_accuracy_m,
-            "battery_v": self.tags.battery_v,
-            "external_v": self.tags.external_v,
-            "analog_input_v": self.tags.analog_input_v,
-            "temperature_c": self.tags.temperature_c,
-            "runtime_s": self.tags.runtime_s,
-            "odometer_km": self.tags.odometer_km,
+        device_ids = {
+            "dev_eui": data.get("dev_eui"),
+            "device_id": data.get("device_id"),
+            "application_ids": {"application_id": data.get("application_id")},
         }
-        for key, tag in mapping.items():
-            if key in d:
-                await tag.set(d[key])
-
-        if d.get("_type") == "downlink_ack":
-            await self.tags.downlink_ack_seq.set(d["sequence"])
-            await self.tags.downlink_ack_accepted.set(d["accepted"])
-            await self.tags.firmware_version.set(d["firmware_version"])
+        await self._apply_uplinks(records, device_ids)
+
+    async def _apply_uplinks(self, records: list[dict], device_ids: dict):
+        store = StateStore(self.api)
+        state = None
+        if any(r.get("received_at") for r in records):
+            # only uplinks with a receive time can be recognised as replays
+            with memprof.stage("state"):
+                state = await store.load()
+            records = self._unseen(records, state)
+            if not records:
+                log.info("uplinks already applied; skipping", dev_eui=device_ids.get("dev_eui"))
+                return
+
+        async with WriteCoalescer(self.api) as writes:
+            accuracy = self.tags.gps_accuracy_m.value
+            with memprof.stage("apply"):
+                for decoded in records:
+                    await self.apply_decoded(decoded, writes)
+            if state is not None:
+                advance = partial(self._advance_state, records, accuracy)
+                with memprof.stage("distance"):
+                    await advance(state)
+            with memprof.stage("downlinks"):
+                await self._service_downlinks(writes, records, device_ids)
+            if state is not None:
+                writes.defer("state", partial(self._save_state, store, state, advance))
+            with memprof.stage("flush"):
+                await writes.flush()
+
+    @staticmethod
+    def _unseen(records: list[dict], state: DeviceState) -> list[dict]:
+        """Drop uplinks already applied, and mark older ones as history.
+
+        TTS retries a webhook it thinks failed, and a retried uplink keeps its
+        ``received_at`` and frame counter, so an uplink is a repeat only if
+        that key is among the recently applied. One received before the
+        latest applied uplink is new but late: it's applied as history only,
+        like a superseded Digital Matter record.
+        """
+        seen = {tuple(key) for key in state.get("seen") or ()}
+        last = epoch(state.get("t"))
+        unseen = []
+        for r in records:
+            key = _uplink_key(r)
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            received = epoch(r.get("received_at"))
+            if last is not None and received is not None and received < last:
+                r = {**r, "superseded": True}
+            unseen.append(r)
+        return unseen
+
+    async def _advance_state(self, records: list[dict], accuracy: float | None, state: DeviceState):
+        """Record the batch as applied and measure it.
+
+        Also run again on the stored state if another invocation saved first,
+        so it must be safe to repeat.
+        """
+        keys = [list(key) for r in records if (key := _uplink_key(r)) is not None]
+        if keys:
+            seen = state.get("seen") or []
+            state["seen"] = [*seen, *(k for k in keys if k not in seen)][-SEEN_UPLINKS:]
+            # TTS trims trailing zeros from the fraction, so compare as times
+            times = [t for t in (state.get("t"), *(k[0] for k in keys)) if epoch(t) is not None]
+            if times:
+                state["t"] = max(times, key=epoch)
+        current = [r for r in records if not r.get("superseded")]
+        await self._update_distance(current, state, accuracy)
+
+    async def _save_state(self, store: StateStore, state: DeviceState, advance):
+        if not await store.save(state, advance):
+            log.warning("device state not saved; the next uplink reloads it", rev=state.rev)
+
+    async def _update_distance(self, records: list[dict], state: DeviceState, accuracy: float | None):
+        """Measure the batch's fixes in one pass and update the GPS odometer.
+
+        Part 1 frames carry a position but no accuracy, so each fix takes the
+        accuracy last reported before it.
+        """
+        if not any("latitude" in r or r.get("odometer_km") is not None for r in records):
+            return
+
+        from dm_common import distance
+
+        odometer = distance.GpsOdometer(state)
+        for r in records:
+            accuracy = r.get("gps_accuracy_m", accuracy)
+            t = distance.epoch(r.get("received_at"))
+            if "latitude" in r and "longitude" in r and t is not None:
+                odometer.add(distance.Fix(t, r["latitude"], r["longitude"], accuracy, None, r.get("speed_kmh")))
+            if r.get("odometer_km") is not None:
+                odometer.reconcile(r["odometer_km"])
+        odometer.update()
+
+        if odometer.km is not None:
+            await self.tags.gps_odometer_km.set(round(odometer.km, 3))
+        if odometer.speed_kmh is not None:
+            await self.tags.gps_speed_kmh.set(round(odometer.speed_kmh, 1))
+
+    async def on_downlink_command(self, data: dict):
+        try:
+            parameters = parse_parameters(data.get("parameters") or {})
+        except (TypeError, ValueError) as e:
+            log.warning("invalid downlink command", error=e, command=data)
+            return
+        if not parameters:
+            return
+
+        async with WriteCoalescer(self.api) as writes:
+            await self._service_downlinks(writes, enqueue=parameters)
+
+    async def _service_downlinks(
+        self,
+        writes: WriteCoalescer,
+        uplinks: list[dict] = (),
+        device_ids: dict | None = None,
+        enqueue: dict[int, int] | None = None,
+    ):
+        """Queue, ack and send downlinks, then store the queue and its tags.
+
+        Most uplinks aren't acks and find the queue empty (per its tags), so
+        they don't read the queue at all.
+        """
+        acks = [d for d in uplinks if d.get("_type") == "downlink_ack"]
+        queued = (self.tags.downlink_pending.value or 0) + (self.tags.downlink_inflight.value or 0)
+        if not (acks or queued or enqueue):
+            return
+
+        aggregate = await self.api.fetch_channel_aggregate(DOWNLINK_CHANNEL)
+        scheduler = DownlinkScheduler(aggregate.data, self.config.downlink_max_payload.value)
+        if device_ids and device_ids.get("device_id"):
+            scheduler.state["device"] = {
+                "application_id": (device_ids.get("application_ids") or {}).get("application_id"),
+                "device_id": device_ids["device_id"],
+            }
+        for ack in acks:
+            scheduler.ack(ack["sequence"], ack["accepted"])
+        if enqueue:
+            scheduler.enqueue(enqueue)
+
+        sent = await scheduler.service(await self._network_server())
+        if sent:
+            log.info("downlinks sent", frames=sent, inflight=scheduler.inflight)
+
+        writes.update_channel_aggregate(DOWNLINK_CHANNEL, scheduler.state, replace_data=True)
+        await self.tags.downlink_pending.set(scheduler.pending)
+        await self.tags.downlink_inflight.set(scheduler.inflight)
+        await self.tags.downlink_failed.set(scheduler.state["failed"])
+        if scheduler.state["inflight"]:
+            await self.tags.downlink_last_seq.set(scheduler.state["inflight"][-1]["seq"])
+
+    async def _network_server(self) -> TtsNetworkServer | None:
+        if not self.config.tts_api_url.value or not self.config.tts_api_key.value:
+            return None
+        return TtsNetworkServer(
+            self.config.tts_api_url.value,
+            self.config.tts_webhook_id.value,
+            self.config.tts_api_key.value,
+            await shared_session(),
+        )
+
+    async def apply_decoded(self, d: dict, writes: WriteCoalescer):
+        # a late uplink only adds to the history; it mustn't roll the tags back
+        if not d.get("superseded"):
+            await apply_tags(self.tags, d, TAG_MAP)
+
+            if d.get("_type") == "downlink_ack":
+                await apply_tags(self.tags, d, ACK_TAG_MAP)
+
+        if "latitude" in d and "longitude" in d:
+            writes.create_message("location", location_point(d["latitude"], d["longitude"]))
@@ -0,0 +1,265 @@
+"""Downlink scheduling for G62 parameter changes.
+
+LoRaWAN downlinks are scarce: a Class A device only listens after it
+uplinks, and the network duty-cycles what it sends. So parameter changes are
+not sent one per downlink. They are queued per device, and every change
+waiting to go out is packed into as few frames as the payload size allows.
+
+Frames go out on :data:`DOWNLINK_PORT`. A frame is a sequence byte (7 bits,
+the same number the device echoes in its port 5 ack) followed by one
+``(parameter id: u8, value: u32 little-endian)`` entry per parameter.
+
+A frame stays in flight until an ack with its sequence number arrives. If
+no ack arrives it is resent with exponential backoff. The resend also carries
+any changes queued since, under a new sequence number. Sends are counted per
+parameter, so a change that joins a resend gets its own :data:`MAX_ATTEMPTS`
+sends; a parameter is given up on once it has used them.
+
+Queue state is kept in the ``dm_downlink_queue`` channel aggregate on the
+device agent and summarised in the processor's ``downlink_*`` tags.
+"""
+from __future__ import annotations
+
+import base64
+import struct
+import time
+
+from dm_common import logs
+
+log = logs.get_logger(__name__)
+
+DOWNLINK_CHANNEL = "dm_downlink_queue"
+DOWNLINK_PORT = 1
+
+SEQUENCE_MASK = 0x7F
+ENTRY_BYTES = 5
+
+# Smallest LoRaWAN payload a device may be limited to (AU915/US915 DR0 is 11).
+MIN_PAYLOAD_BYTES = 1 + ENTRY_BYTES
+DEFAULT_MAX_PAYLOAD = 51
+
+RETRY_BASE_S = 600.0
+RETRY_MAX_S = 6 * 3600.0
+MAX_ATTEMPTS = 4
+
+
+def encode_frame(sequence: int, parameters: dict[int, int]) -> bytes:
+    frame = bytearray([sequence & SEQUENCE_MASK])
+    for param_id, value in sorted(parameters.items()):
+        frame += struct.pack("<BI", param_id, value)
+    return bytes(frame)
+
+
+def decode_frame(frame: bytes) -> tuple[int, dict[int, int]]:
+    """Inverse of :func:`encode_frame`."""
+    parameters = {}
+    for offset in range(1, len(frame), ENTRY_BYTES):
+        param_id, value = struct.unpack_from("<BI", frame, offset)
+        parameters[param_id] = value
+    return frame[0] & SEQUENCE_MASK, parameters
+
+
+def parse_parameters(raw: dict) -> dict[int, int]:
+    """Validate a ``{parameter id: value}`` command; keys may be strings (JSON)."""
+    parameters = {}
+    for key, value in raw.items():
+        param_id = int(key)
+        if not 0 <= param_id <= 0xFF:
+            raise ValueError(f"parameter id {key!r} is not a u8")
+        if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= 0xFFFFFFFF:
+            raise ValueError(f"parameter {param_id} value {value!r} is not a u32")
+        parameters[param_id] = value
+    return parameters
+
+
+class DownlinkScheduler:
+    """Per-device downlink queue over a JSON-able ``state`` dict.
+
+    ``state`` is what's kept in the channel aggregate::
+
+        {
+            "next_seq": 3,
+            "pending": {"12": 300},                      # param id -> value, not yet sent
+            "inflight": [{"seq": 2, "params": {...}, "attempts": 1,
+                          "tries": {"12": 1},            # sends per param
+                          "sent_at": ..., "retry_at": ...}],
+            "failed": 0,                                 # frames rejected or given up on
+            "device": {"application_id": ..., "device_id": ...},
+        }
+    """
+
+    def __init__(self, state: dict | None = None, max_payload: int = DEFAULT_MAX_PAYLOAD):
+        state = state or {}
+        self.state = {
+            "next_seq": state.get("next_seq", 0),
+            "pending": dict(state.get("pending") or {}),
+            "inflight": [
+                {**f, "params": dict(f["params"]), "tries": _tries(f)} for f in state.get("inflight") or []
+            ],
+            "failed": state.get("failed", 0),
+            "device": dict(state.get("device") or {}),
+        }
+        self.per_frame = (max(max_payload, MIN_PAYLOAD_BYTES) - 1) // ENTRY_BYTES
+
+    @property
+    def pending(self) -> int:
+        return len(self.state["pending"])
+
+    @property
+    def inflight(self) -> int:
+        return len(self.state["inflight"])
+
+    @property
+    def idle(self) -> bool:
+        return not self.state["pending"] and not self.state["inflight"]
+
+    def enqueue(self, parameters: dict[int, int]):
+        """Queue parameter changes; a later value for a parameter replaces an earlier one."""
+        self.state["pending"].update({str(k): v for k, v in parameters.items()})
+
+    def ack(self, sequence: int, accepted: bool) -> bool:
+        """Match a port 5 ack to its frame. Returns False for an unknown sequence."""
+        for frame in self.state["inflight"]:
+            if frame["seq"] == sequence:
+                self.state["inflight"].remove(frame)
+                if not accepted:
+                    self.state["failed"] += 1
+                    log.warning("downlink rejected", seq=sequence, params=frame["params"])
+                return True
+        log.info("ack for unknown downlink", seq=sequence)
+        return False
+
+    def _next_sequence(self) -> int:
+        in_use = {f["seq"] for f in self.state["inflight"]}
+        seq = self.state["next_seq"] & SEQUENCE_MASK
+        while seq in in_use:
+            seq = (seq + 1) & SEQUENCE_MASK
+        self.state["next_seq"] = (seq + 1) & SEQUENCE_MASK
+        return seq
+
+    def _due(self, now: float) -> list[dict]:
+        due = []
+        for frame in list(self.state["inflight"]):
+            if frame["retry_at"] > now:
+                continue
+            self.state["inflight"].remove(frame)
+            tries = frame["tries"]
+            exhausted = [key for key in frame["params"] if tries[key] >= MAX_ATTEMPTS]
+            if exhausted:
+                self.state["failed"] += 1
+                log.warning("downlink unacked; giving up", seq=frame["seq"], params=exhausted)
+                for key in exhausted:
+                    del frame["params"][key]
+            if frame["params"]:
+                due.append(frame)
+        return due
+
+    def plan(self, now: float | None = None) -> list[dict]:
+        """Take the frames to send now: due resends merged with pending changes.
+
+        Changes queued since a frame was first sent win over its values, and
+        a parameter still in flight in an older frame is dropped from it so a
+        resend of that frame can't undo the newer value.
+        """
+        now = time.time() if now is None else now
+        due = self._due(now)
+        if not due and not self.state["pending"]:
+            return []
+
+        # oldest first, so newer values overwrite older ones; a new value
+        # starts its own count of sends
+        merged: dict[str, int] = {}
+        tries: dict[str, int] = {}
+        for frame in sorted(due, key=lambda f: f["sent_at"]):
+            merged.update(frame["params"])
+            tries.update({key: frame["tries"][key] for key in frame["params"]})
+        merged.update(self.state["pending"])
+        tries.update(dict.fromkeys(self.state["pending"], 0))
+        self.state["pending"] = {}
+
+        for frame in list(self.state["inflight"]):
+            for key in merged:
+                frame["params"].pop(key, None)
+                frame["tries"].pop(key, None)
+            if not frame["params"]:
+                self.state["inflight"].remove(frame)
+
+        # parameters with as many sends behind them share frames, so a frame's
+        # backoff suits everything in it
+        keys = sorted(merged, key=lambda k: (tries[k], int(k)))
+        frames = []
+        for i in range(0, len(keys), self.per_frame):
+            chunk = keys[i : i + self.per_frame]
+            frames.append({
+                "seq": self._next_sequence(),
+                "params": {key: merged[key] for key in chunk},
+                "attempts": max(tries[key] for key in chunk),
+                "tries": {key: tries[key] for key in chunk},
+            })
+        return frames
+
+    def sent(self, frame: dict, now: float | None = None):
+        now = time.time() if now is None else now
+        frame["attempts"] += 1
+        for key in frame["params"]:
+            frame["tries"][key] += 1
+        frame["sent_at"] = now
+        frame["retry_at"] = now + min(RETRY_BASE_S * 2 ** (frame["attempts"] - 1), RETRY_MAX_S)
+        self.state["inflight"].append(frame)
+
+    def unsent(self, frame: dict):
+        """Put a frame the network server didn't take back in the queue."""
+        for key, value in frame["params"].items():
+            self.state["pending"].setdefault(key, value)
+
+    async def service(self, network, now: float | None = None) -> int:
+        """Send whatever is due through ``network``. Returns the number of frames sent."""
+        device = self.state["device"]
+        if network is None or not device.get("device_id"):
+            return 0
+        sent = 0
+        frames = self.plan(now)
+        for n, frame in enumerate(frames):
+            payload = encode_frame(frame["seq"], {int(k): v for k, v in frame["params"].items()})
+            try:
+                await network.push(device["application_id"], device["device_id"], DOWNLINK_PORT, payload)
+            except Exception as e:
+                log.warning("downlink push failed", seq=frame["seq"], error=e)
+                for remaining in frames[n:]:
+                    self.unsent(remaining)
+                break
+            self.sent(frame, now)
+            sent += 1
+        return sent
+
+
+def _tries(frame: dict) -> dict[str, int]:
+    """A stored frame's sends per parameter (frames stored before these were
+    counted share the frame's count)."""
+    tries = frame.get("tries") or {}
+    return {key: tries.get(key, frame.get("attempts", 0)) for key in frame["params"]}
+
+
+class TtsNetworkServer:
+    """Queues downlinks through The Things Stack's webhook downlink API."""
+
+    def __init__(self, base_url: str, webhook_id: str, api_key: str, session):
+        self.base_url = base_url.rstrip("/")
+        self.webhook_id = webhook_id
+        self.api_key = api_key
+        self.session = session
+
+    async def push(self, application_id: str, device_id: str, port: int, payload: bytes):
+        url = (
+            f"{self.base_url}/api/v3/as/applications/{application_id}"
+            f"/webhooks/{self.webhook_id}/devices/{device_id}/down/push"
+        )
+        body = {
+            "downlinks": [
+                {"f_port": port, "frm_payload": base64.b64encode(payload).decode(), "priority": "NORMAL"}
+            ]
+        }
+        async with self.session.post(
+            url, json=body, headers={"Authorization": f"Bearer {self.api_key}"}
+        ) as resp:
+            resp.raise_for_status()
@@ -0,0 +1,14 @@
+from typing import Any
+
+from pydoover.processor import run_app
+
+from .application import G62Integration
+
+
+def handler(event: dict[str, Any], context):
+    """Lambda handler entry point."""
+    run_app(
+        G62Integration(),
+        event,
+        context,
+    )
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from pydoover import config
+from pydoover.processor import IngestionEndpointConfig, ExtendedPermissionsConfig, ScheduleConfig
+
+
+class G62IntegrationConfig(config.Schema):
+    integration = IngestionEndpointConfig()
+    permissions = ExtendedPermissionsConfig()
+
+    device_model = config.Enum(
+        "Device Model",
+        choices=["g62", "oyster3"],
+        default="g62",
+        description="Which Digital Matter LoRaWAN payload format the devices on this webhook send.",
+        advanced=True,
+    )
+    processor_app_key = config.String(
+        "Processor App Key",
+        description=(
+            "App key of the G62 processor install whose serial_number_lookup "
+            "maps DevEUIs to agents. Leave empty to use the default install."
+        ),
+        default="",
+        advanced=True,
+    )
+    background_schedule = ScheduleConfig(
+        "Background Schedule",
+        description="Replays publishes spooled during a Doover API outage.",
+        default="disabled",
+        advanced=True,
+    )
+
+
+def export():
+    G62IntegrationConfig.export(
+        Path(__file__).parents[2] / "doover_config.json",
+        "g62_integration"
+    )
@@ -0,0 +1,140 @@
+import asyncio
+import base64
+
+import msgspec
+from pydoover.processor import Application
+from pydoover.models import IngestionEndpointEvent, ScheduleEvent
+
+from dm_common import decoders, logs, memprof
+from dm_common.channels import DECODED_UPLINK_CHANNEL
+from dm_common.spool import SpooledPublisher
+
+from .app_config import G62IntegrationConfig
+from .devices import dev_eui_index, normalise_dev_eui
+from .webhook import Uplink, decode_uplinks
+
+log = logs.get_logger(__name__)
+
+
+class G62Integration(Application):
+    config: G62IntegrationConfig
+    config_cls = G62IntegrationConfig
+
+    async def setup(self):
+        log.info("G62 integration initialized")
+
+    def parse_ingestion_event_payload(self, payload: str) -> list[Uplink] | None:
+        """
+        Parse a The Things Stack uplink webhook.
+
+        Only the device IDs, port, payload and receive time are decoded; the
+        gateway metadata that makes up most of the body is skipped.
+        """
+        try:
+            raw = base64.b64decode(payload)
+        except Exception as e:
+            log.error("payload not base64", error=e, bytes=len(payload or ""))
+            return None
+
+        try:
+            with memprof.session("g62_integration.parse"), memprof.stage("decode"):
+                return decode_uplinks(raw)
+        except msgspec.DecodeError as e:
+            log.error("payload rejected", error=e, bytes=len(raw))
+            return None
+
+    async def on_ingestion_endpoint(self, event: IngestionEndpointEvent):
+        """
+        Handle uplinks from a TTS webhook.
+
+        Each uplink is decoded here and forwarded to its device agent. A
+        device's uplinks in one body go out as one message on
+        ``on_g62_event``.
+        """
+        uplinks = event.payload
+        if not uplinks:
+            log.warning("Received empty payload")
+            return
+
+        with memprof.session("g62_integration.ingest"):
+            publisher = SpooledPublisher(self.api)
+            await self._forward(uplinks, publisher)
+            with memprof.stage("drain"):
+                await publisher.drain()
+
+    async def on_schedule(self, event: ScheduleEvent):
+        """Drain the publish spool."""
+        await SpooledPublisher(self.api).drain(force=True)
+
+    def _device_mapping(self) -> dict | None:
+        """The DevEUI -> agent ID mapping published by the G62 processors."""
+        app_key = self.config.processor_app_key.value
+        if app_key:
+            return self.tag_manager.get_tag("serial_number_lookup", app_key=app_key)
+        for app_key in ("g62_processor_1", "g62_processor-1"):
+            try:
+                return self.tag_manager.get_tag(
+                    "serial_number_lookup", app_key=app_key, raise_key_error=True
+                )
+            except KeyError:
+                continue
+        return None
+
+    async def _forward(self, uplinks: list[Uplink], publisher: SpooledPublisher):
+        device_mapping = self._device_mapping()
+        if device_mapping is None:
+            log.warning("serial_number_lookup tag not found; skipping", uplinks=len(uplinks))
+            return
+
+        with memprof.stage("lookup"):
+            index = dev_eui_index(device_mapping)
+
+        model = self.config.device_model.value
+        batches: dict[object, dict] = {}
+        with memprof.stage("decode"):
+            for uplink in uplinks:
+                message = uplink.uplink_message
+                if message is None or message.f_port is None or not message.frm_payload:
+                    continue
+                ids = uplink.end_device_ids
+                dev_eui = normalise_dev_eui(ids.dev_eui or "")
+                agent_id = index.get(dev_eui)
+                if agent_id is None:
+                    log.info("dev_eui not mapped to an agent", dev_eui=dev_eui, mapped=len(index))
+                    continue
+
+                decoded = decoders.decode(model, message.frm_payload, message.f_port)
+                if not decoded:
+                    log.warning(
+                        "unknown message",
+                        dev_eui=dev_eui,
+                        model=model,
+                        port=message.f_port,
+                        bytes=len(message.frm_payload),
+                    )
+                    continue
+                decoded["received_at"] = message.received_at or uplink.received_at
+                decoded["f_cnt"] = message.f_cnt
+                log.payload(dev_eui, "uplink decoded", decoded)
+
+                batch = batches.get(agent_id)
+                if batch is None:
+                    batch = batches[agent_id] = {
+                        "dev_eui": dev_eui,
+                        "device_id": ids.device_id,
+                        "application_id": ids.application_ids.application_id if ids.application_ids else None,
+                        "records": [],
+                    }
+                batch["records"].append(decoded)
+
+        log.info(
+            "tts uplinks",
+            uplinks=len(uplinks),
+            forwarded=sum(len(b["records"]) for b in batches.values()),
+            agents=len(batches),
+        )
+        with memprof.stage("publish"):
+            await asyncio.gather(*(
+                publisher.create_message(DECODED_UPLINK_CHANNEL, batch, agent_id=agent_id)
+                for agent_id, batch in batches.items()
+            ))
@@ -0,0 +1,33 @@
+"""DevEUI -> agent ID resolution.
+
+Each G62 processor install's DevEUI (its ``dv_serial_number`` config) is
+collected into the processor's ``serial_number_lookup`` tag, as Digital
+Matter serial numbers are for the OEM integration. Users enter DevEUIs in
+whatever case and separators they copied them with, while TTS always sends
+16 upper-case hex digits, so lookups go through a normalised index.
+
+The index is built once per distinct lookup table and kept for the life of
+the container; warm invocations whose table hasn't changed reuse it.
+"""
+from __future__ import annotations
+
+import re
+
+_NOT_HEX = re.compile(r"[^0-9A-F]")
+
+_cached_source: dict | None = None
+_cached_index: dict[str, object] = {}
+
+
+def normalise_dev_eui(dev_eui) -> str:
+    """``70-b3-d5-...`` / ``70b3d5...`` -> ``70B3D5...``."""
+    return _NOT_HEX.sub("", str(dev_eui).upper())
+
+
+def dev_eui_index(mapping: dict) -> dict[str, object]:
+    """The normalised DevEUI -> agent ID index for a ``serial_number_lookup`` table."""
+    global _cached_source, _cached_index
+    if mapping != _cached_source:
+        _cached_index = {normalise_dev_eui(k): v for k, v in mapping.items()}
+        _cached_source = dict(mapping)
+    return _cached_index
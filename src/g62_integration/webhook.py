@@ -0,0 +1,49 @@
+"""Just enough of a The Things Stack uplink webhook body.
+
+A TTS uplink message is mostly gateway metadata (``rx_metadata``,
+``settings``, ``network_ids``, location, ...). The structs here name only the
+fields the G62 integration uses, so msgspec skips the rest without building
+it, and ``frm_payload`` arrives already base64-decoded.
+
+The body may be one uplink (as TTS webhooks send them) or a JSON array of
+uplinks, e.g. when replaying from TTS Storage.
+"""
+from __future__ import annotations
+
+import msgspec
+
+
+class ApplicationIds(msgspec.Struct):
+    application_id: str | None = None
+
+
+class EndDeviceIds(msgspec.Struct):
+    device_id: str | None = None
+    dev_eui: str | None = None
+    application_ids: ApplicationIds | None = None
+
+
+class UplinkMessage(msgspec.Struct):
+    f_port: int | None = None
+    f_cnt: int | None = None
+    frm_payload: bytes | None = None
+    received_at: str | None = None
+
+
+class Uplink(msgspec.Struct):
+    end_device_ids: EndDeviceIds = msgspec.field(default_factory=EndDeviceIds)
+    # absent for join accepts, downlink events and the like
+    uplink_message: UplinkMessage | None = None
+    received_at: str | None = None
+
+
+_decoder = msgspec.json.Decoder(Uplink | list[Uplink])
+
+
+def decode_uplinks(raw: bytes) -> list[Uplink]:
+    """Decode a webhook body into its uplinks.
+
+    Raises ``msgspec.DecodeError`` if the body is malformed.
+    """
+    body = _decoder.decode(raw)
+    return body if isinstance(body, list) else [body]
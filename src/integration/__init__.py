@@ -7,8 +7,11 @@ from .application import DigitalMatterIntegration
 
 def handler(event: dict[str, Any], context):
     """Lambda handler entry point."""
+    app = DigitalMatterIntegration()
+    # the queue consumer budgets against the invocation's remaining time
+    app.lambda_context = context
     run_app(
-        DigitalMatterIntegration(),
+        app,
         event,
         context,
     )
@@ -1,13 +1,75 @@
 from pathlib import Path
 
 from pydoover import config
-from pydoover.processor import IngestionEndpointConfig, ExtendedPermissionsConfig
+from pydoover.processor import IngestionEndpointConfig, ExtendedPermissionsConfig, ScheduleConfig
 
 
 class DigitalMatterIntegrationConfig(config.Schema):
     integration = IngestionEndpointConfig()
     permissions = ExtendedPermissionsConfig()
 
+    compact_tracks = config.Boolean(
+        "Compact Location Tracks",
+        description=(
+            "Forward the fixes in each OEM Server upload to the device as one "
+            "delta-encoded location_track message instead of one location "
+            "message per fix. Recommended for dense tracking fleets."
+        ),
+        default=False,
+    )
+    track_precision_digits = config.Integer(
+        "Track Precision (decimal places)",
+        description="Decimal places of latitude/longitude kept in compact tracks (6 = ~0.1 m).",
+        default=6,
+        minimum=3,
+        maximum=8,
+        advanced=True,
+    )
+    connector_url_templates = config.String(
+        "Connector URL Templates",
+        description=(
+            "How the OEM Server connector URLs carry routing parameters, "
+            "comma separated, e.g. /ingest/{tenant}/{iccid} or "
+            "?iccid=&model=&app_key=. Recognised parameters are iccid, tenant, "
+            "model (record decoder) and app_key (processor install whose "
+            "serial_number_lookup to use). Leave empty to read them from "
+            "same-named query parameters."
+        ),
+        default="",
+        advanced=True,
+    )
+    archive_dictionaries = config.String(
+        "Archive Dictionaries",
+        description=(
+            "Trained zstd dictionaries for the raw payload archive, comma "
+            "separated as tenant=<base64 dictionary>. Uploads routed to a "
+            "listed tenant are archived with its dictionary; others use plain "
+            "zstd. Needs the optional zstandard package."
+        ),
+        default="",
+        advanced=True,
+    )
+    fast_ack_queue = config.String(
+        "Fast Ack Queue",
+        description=(
+            "Queue URL (SQS, or file:// for local runs). When set, uploads are "
+            "validated and queued and the OEM Server is answered immediately; "
+            "the Background Schedule processes the queue. Leave empty to "
+            "process uploads inline."
+        ),
+        default="",
+        advanced=True,
+    )
+    background_schedule = ScheduleConfig(
+        "Background Schedule",
+        description=(
+            "Consumes the fast-ack queue, and replays publishes spooled during "
+            "a Doover API outage. Required for fast-ack mode."
+        ),
+        default="disabled",
+        advanced=True,
+    )
+
 
 def export():
     DigitalMatterIntegrationConfig.export(
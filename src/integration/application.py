@@ -1,282 +1,453 @@
+import asyncio
 import base64
-import json
-import logging
-import re
-from urllib.parse import urlsplit, parse_qs
+import functools
+import time
 
+import msgspec
 from pydoover.processor import Application
-from pydoover.models import IngestionEndpointEvent
+from pydoover.models import File, IngestionEndpointEvent, ScheduleEvent
+
+from dm_common import decoders, logs, memprof, track
+from dm_common.decoders.oem import (  # noqa: F401 - re-exported
+    PRIORITY_REASONS,
+    UPLINK_REASONS,
+    Payload,
+    decode_payload,
+    get_uplink_reason,
+    parse_dm_record,
+)
+from dm_common.spool import SpooledPublisher
 
 from .app_config import DigitalMatterIntegrationConfig
-
-log = logging.getLogger(__name__)
-
-ICCID_RE = re.compile(r"^89\d{16,20}$")
-
-
-def extract_iccid(invocation_url: str | None) -> str | None:
-    """Pull the SIM ICCID out of the connector invocation URL, if present.
-
-    Tolerant of however the connector is configured to template it: an
-    ``?iccid=...`` query parameter (any case) is preferred, otherwise we scan
-    the path segments and query values for anything that looks like an ICCID
-    (e.g. a URL templated as ``.../ingest/[ICCID]``). Returns None if no valid
-    ICCID is found, i.e. the device has no SIM populated against it.
-    """
-    if not invocation_url:
-        return None
-
-    parts = urlsplit(invocation_url)
-
-    query = parse_qs(parts.query)
-    for key, values in query.items():
-        if key.lower() == "iccid":
-            for value in values:
-                if ICCID_RE.match(value.strip()):
-                    return value.strip()
-
-    candidates = parts.path.split("/")
-    candidates += [v for values in query.values() for v in values]
-    for candidate in candidates:
-        candidate = candidate.strip()
-        if ICCID_RE.match(candidate):
-            return candidate
-
-    return None
-
-# Digital Matter uplink reason codes
-UPLINK_REASONS = {
-    0: "Reserved",
-    1: "Start of trip",
-    2: "End of trip",
-    3: "Elapsed time",
-    4: "Speed change",
-    5: "Heading change",
-    6: "Distance travelled",
-    7: "Maximum Speed",
-    8: "Stationary",
-    9: "Ignition Changed",
-    10: "Output Changed",
-    11: "Heartbeat",
-    12: "Harsh Brake",
-    13: "Harsh Acceleration",
-    14: "Harsh Cornering",
-    15: "External Power Change",
-    16: "System Power Monitoring",
-    17: "Driver ID Tag Read",
-    18: "Over speed",
-    19: "Fuel sensor record",
-    20: "Towing Alert",
-    21: "Debug",
-    22: "SDI-12 sensor data",
-    23: "Accident",
-    24: "Accident Data",
-    25: "Sensor value elapsed time",
-    26: "Sensor value change",
-    27: "Sensor alarm",
-    28: "Rain Gauge Tipped",
-    29: "Tamper Alert",
-    30: "BLOB notification",
-    31: "Time and Attendance",
-    32: "Trip Restart",
-    33: "Tag Gained",
-    34: "Tag Update",
-    35: "Tag Lost",
-    36: "Recovery Mode On",
-    37: "Recovery Mode Off",
-    38: "Immobiliser On",
-    39: "Immobiliser Off",
-    40: "Garmin FMI Stop Response",
-    41: "Lone Worker Alarm",
-    42: "Device Counters",
-    43: "Connected Device Data",
-    44: "Entered Geo-Fence",
-    45: "Exited Geo-Fence",
-    46: "High-G Event",
-    47: "Third party data record",
-    48: "Duress",
-    49: "Cell Tower Connection",
-    50: "Bluetooth Tag Data",
-}
-
-
-def get_uplink_reason(code: int) -> str:
-    """Translate uplink reason code to human readable string."""
-    return UPLINK_REASONS.get(code, f"Unknown ({code})")
-
-
-def parse_dm_record(record: dict) -> dict:
-    """
-    Parse a single Digital Matter record into a normalized format.
-
-    Digital Matter sends records with various field types (FType):
-    - FType 0: GPS position data
-    - FType 2: Digital inputs
-    - FType 6: Analogue data (voltages, temperature, signal strength, external analog input)
-    - FType 27: Odometer and run hours
-    """
-    result = {
-        "uplink_reason": get_uplink_reason(record.get("Reason", 0)),
-        "uplink_reason_code": record.get("Reason"),
-        "device_time_utc": record.get("DateUTC"),
-        "sequence_number": record.get("SeqNo"),
-    }
-
-    fields = record.get("Fields", [])
-
-    for field in fields:
-        ftype = field.get("FType")
-
-        if ftype == 0:
-            # GPS position data
-            lat = field.get("Lat", 0)
-            lon = field.get("Long", 0)
-
-            if lat != 0 and lon != 0:
-                result["position"] = {
-                    "lat": lat,
-                    "long": lon,
-                    "alt": field.get("Alt", 0),
-                }
-                # Speed is in cm/s, convert to km/h
-                speed_cms = field.get("Spd", 0)
-                result["speed_kmh"] = speed_cms * 0.036  # cm/s to km/h
-                result["heading"] = field.get("Head", 0)
-                result["gps_accuracy_m"] = field.get("PosAcc", 99)
-                result["pdop"] = field.get("PDOP")
-            else:
-                result["gps_accuracy_m"] = 99
-
-        elif ftype == 2:
-            # Digital inputs
-            din = field.get("DIn", 0)
-            result["ignition_on"] = bool(din & 0b001)
-            result["digital_input_2"] = bool(din & 0b010)
-            result["digital_input_3"] = bool(din & 0b100)
-
-        elif ftype == 6:
-            # Analogue data
-            analogue = field.get("AnalogueData", {})
-            # Field 1: Internal battery voltage (mV)
-            if "1" in analogue:
-                result["battery_voltage"] = analogue["1"] / 1000
-            # Field 2: External/system voltage (cV - centivolt)
-            if "2" in analogue:
-                result["system_voltage"] = analogue["2"] / 100
-            # Field 3: Device temperature (cC - centi-celsius)
-            if "3" in analogue:
-                result["device_temp_c"] = analogue["3"] / 100
-            # Field 4: Signal strength (0-31 scale)
-            if "4" in analogue:
-                result["signal_strength_percent"] = round(analogue["4"] * (100 / 31))
-            # Field 5: External analogue input (mV) - the physical analog input
-            # wire (e.g. G70 yellow wire, 0-40V). Mapped to "Analog 5" in the
-            # Digital Matter device config.
-            if "5" in analogue:
-                result["analog_input_v"] = analogue["5"] / 1000
-
-        elif ftype == 27:
-            # Odometer and run hours
-            # Odometer in m, convert to km
-            if "Odo" in field:
-                result["odometer_km"] = field["Odo"] / 100
-            # Run hours in seconds, convert to hours
-            if "RH" in field:
-                result["run_hours"] = field["RH"] / 3600
-
-        elif ftype == 9:
-            # Trip data
-            result["trip_distance_m"] = field.get("Dist")
-            result["trip_idle_time_s"] = field.get("IdleTime")
-
-    return result
+from . import routing, upload_queue
+from .archive import RawArchive, parse_dictionaries
+from .fleet import FleetStatus
+from .routing import ICCID_RE, Route, extract_iccid  # noqa: F401 - re-exported
+from .upload_queue import QueuedUpload, UploadQueue
+
+log = logs.get_logger(__name__)
+
+# Raw accelerometer traces are attached to messages on this channel rather
+# than inlined into dm_events / on_dm_event.
+ACCEL_TRACE_CHANNEL = "dm_accel_traces"
+
+# Compact delta-encoded location tracks are forwarded to device agents here.
+TRACK_CHANNEL = "location_track"
+
+# Fast-ack consumer: uploads received per batch, processed at once, and the
+# time a scheduled run may spend before leaving the rest for the next one.
+# The budget stays well inside the Lambda timeout (300 s), and inside the
+# invocation's remaining time less a reserve for the batch in progress and
+# the spool drain and fleet flush that follow it.
+CONSUMER_BATCH_SIZE = 100
+CONSUMER_CONCURRENCY = 32
+CONSUMER_BUDGET_S = 240.0
+CONSUMER_RESERVE_S = 45.0
+
+
+@functools.lru_cache(maxsize=64)
+def _record_decoder(model: str | None):
+    """The OEM record decoder for a routed device model (default ``oem``)."""
+    if model:
+        entry = decoders.get_entry(model)
+        if entry is not None and entry.frames is None:
+            return entry.load()
+        log.warning("no record decoder for routed model; using oem", model=model)
+    return parse_dm_record
 
 
 class DigitalMatterIntegration(Application):
     config: DigitalMatterIntegrationConfig
     config_cls = DigitalMatterIntegrationConfig
 
+    def __init__(self):
+        super().__init__()
+        # The body exactly as the OEM Server sent it, kept for archival.
+        self._raw_payload: bytes | None = None
+        # The Lambda context, when run by the handler
+        self.lambda_context = None
+
     async def setup(self):
         log.info("Digital Matter integration initialized")
 
-    def parse_ingestion_event_payload(self, payload: str) -> dict | None:
+    def parse_ingestion_event_payload(self, payload: str) -> Payload | None:
         """
         Parse the incoming payload from Digital Matter OEM Server.
 
         The OEM Server sends JSON payloads via HTTP POST containing device
-        serial number and one or more records with telemetry data.
+        serial number and one or more records with telemetry data. The body is
+        validated against the OEM schema as it's decoded; a malformed body is
+        rejected here, before any API call is made.
         """
         try:
             raw = base64.b64decode(payload)
-            data = json.loads(raw)
-            log.info(f"Parsed Digital Matter payload: {data}")
-            return data
         except Exception as e:
-            log.error(f"Failed to parse payload: {e}", exc_info=True)
+            log.error("payload not base64", error=e, bytes=len(payload or ""))
+            return None
+
+        try:
+            with memprof.session("integration.parse"), memprof.stage("decode"):
+                data = decode_payload(raw)
+        except msgspec.DecodeError as e:
+            log.error("payload rejected", error=e, bytes=len(raw))
             return None
 
+        self._raw_payload = raw
+        return data
+
     async def on_ingestion_endpoint(self, event: IngestionEndpointEvent):
         """
         Handle incoming data from Digital Matter OEM Server.
 
         The payload contains device serial number and telemetry records.
-        We parse the data and forward it to the appropriate device agent.
+        We parse the data and forward it to the appropriate device agent, or
+        in fast-ack mode just queue it for the consumer.
         """
         payload = event.payload
         if payload is None:
             log.warning("Received empty payload")
             return
 
-        log.info(f"Received Digital Matter event: {payload}")
-
-        iccid = extract_iccid(event.invocation_url)
-        if iccid:
-            log.info(f"Extracted SIM ICCID {iccid} from {event.invocation_url}")
-
         # Extract serial number - this identifies the device
-        serial_number = payload.get("SerNo")
-        if not serial_number:
+        if not payload.SerNo:
             log.warning("No serial number in payload")
             return
 
-        # Look up the agent ID for this serial number
-        try:
-            device_mapping = self.tag_manager.get_tag(
-                "serial_number_lookup",
-                app_key="digital_matter_processor_1",
-                raise_key_error=True,
-            )
-        except KeyError:
-            try:
-                device_mapping = self.tag_manager.get_tag(
-                    "serial_number_lookup",
-                    app_key="digital_matter_processor-1",
-                    raise_key_error=True,
-                )
-            except KeyError:
+        queue = self._upload_queue()
+        if queue is not None and self._raw_payload is not None:
+            upload = QueuedUpload(self._raw_payload, event.invocation_url)
+            if queue.accepts(upload):
+                # alarms can't wait for the consumer's next run
+                upload.priority_published = await self._publish_priority(payload, upload)
+                await queue.send(upload)
                 log.info(
-                    f"Serial numbers not found. Tags: {self.tag_manager._tag_values}. Skipping..."
+                    "oem upload queued",
+                    serial=payload.SerNo,
+                    records=len(payload.Records),
+                    bytes=len(self._raw_payload),
+                    priority_published=upload.priority_published,
                 )
                 return
+            log.warning("upload too large to queue; processing inline", serial=payload.SerNo)
+
+        with memprof.session("integration.ingest"):
+            publisher = SpooledPublisher(self.api)
+            await self._process_upload(payload, self._raw_payload, event.invocation_url, publisher)
+
+            if publisher.spooled:
+                log.warning("publishes spooled", serial=payload.SerNo, spooled=publisher.spooled)
+            # catch up on anything spooled, unless the API just failed us
+            with memprof.stage("drain"):
+                await publisher.drain()
+            await FleetStatus(self.api).flush()
+
+    async def on_schedule(self, event: ScheduleEvent):
+        """Consume queued uploads (fast-ack mode) and drain the publish spool."""
+        if self._upload_queue() is not None:
+            await self.consume_uploads()
+        await SpooledPublisher(self.api).drain(force=True)
+        await FleetStatus(self.api).flush(force=True)
+
+    def _upload_queue(self) -> UploadQueue | None:
+        url = self.config.fast_ack_queue.value
+        return upload_queue.from_url(url) if url else None
+
+    def _route(self, invocation_url: str | None) -> Route:
+        return routing.router_for(self.config.connector_url_templates.value).route(invocation_url)
+
+    def _archive(self, route: Route) -> RawArchive:
+        dictionaries = parse_dictionaries(self.config.archive_dictionaries.value)
+        return RawArchive(self.api, dictionary=dictionaries.get(route.tenant))
+
+    def _device_mapping(self, app_key: str | None = None) -> dict | None:
+        """The serial number -> agent ID mapping published by the processors.
+
+        Read from the routed processor ``app_key`` if the connector URL names
+        one, otherwise from whichever default processor install has it.
+        """
+        if app_key:
+            return self.tag_manager.get_tag("serial_number_lookup", app_key=app_key)
+        for default_key in ("digital_matter_processor_1", "digital_matter_processor-1"):
+            try:
+                return self.tag_manager.get_tag(
+                    "serial_number_lookup", app_key=default_key, raise_key_error=True
+                )
+            except KeyError:
+                continue
+        return None
 
-        agent_id = device_mapping.get(str(serial_number))
+    def _consumer_budget(self) -> float:
+        remaining = getattr(self.lambda_context, "get_remaining_time_in_millis", None)
+        if remaining is None:
+            return CONSUMER_BUDGET_S
+        return max(0.0, min(CONSUMER_BUDGET_S, remaining() / 1000 - CONSUMER_RESERVE_S))
+
+    async def consume_uploads(
+        self,
+        queue: UploadQueue | None = None,
+        batch_size: int = CONSUMER_BATCH_SIZE,
+        concurrency: int = CONSUMER_CONCURRENCY,
+        budget_s: float | None = None,
+    ) -> int:
+        """Process queued uploads in batches until the queue is empty or
+        ``budget_s`` is spent (by default, what :meth:`_consumer_budget`
+        allows). Returns the number of uploads processed.
+
+        Each serial's uploads in a batch are processed in the order they were
+        enqueued. Uploads are acked once processed; one that fails is left on
+        the queue to be delivered again.
+        """
+        queue = queue or self._upload_queue()
+        deadline = time.monotonic() + (self._consumer_budget() if budget_s is None else budget_s)
+        publisher = SpooledPublisher(self.api)
+        semaphore = asyncio.Semaphore(concurrency)
+        processed = 0
+
+        async def process(uploads: list[tuple[QueuedUpload, Payload]]) -> list[QueuedUpload]:
+            # one serial's uploads in order, stopping at the first failure
+            done = []
+            async with semaphore:
+                for upload, payload in uploads:
+                    try:
+                        await self._process_upload(
+                            payload, upload.body, upload.invocation_url, publisher, upload.priority_published
+                        )
+                    except Exception as e:
+                        log.exception("queued upload failed", serial=payload.SerNo, error=e)
+                        break
+                    done.append(upload)
+            return done
+
+        while time.monotonic() < deadline:
+            batch = await queue.receive(batch_size)
+            if not batch:
+                break
+
+            done = []
+            by_serial: dict[str, list] = {}
+            for upload in batch:
+                try:
+                    payload = decode_payload(upload.body)
+                except msgspec.DecodeError as e:
+                    log.error("queued upload rejected", error=e, bytes=len(upload.body))
+                    done.append(upload)  # never going to succeed; drop it
+                    continue
+                by_serial.setdefault(str(payload.SerNo), []).append((upload, payload))
+
+            # SQS doesn't receive in send order; put each serial's back in it
+            groups = [sorted(u, key=lambda item: item[0].enqueued_at) for u in by_serial.values()]
+            for result in await asyncio.gather(*(process(u) for u in groups)):
+                done.extend(result)
+            await queue.ack(done)
+            processed += len(done)
+            log.info(
+                "upload batch consumed",
+                uploads=len(batch),
+                failed=len(batch) - len(done),
+                oldest_s=round(time.time() - min(u.enqueued_at for u in batch), 3),
+            )
 
+        if publisher.spooled:
+            log.warning("publishes spooled", spooled=publisher.spooled)
+        await FleetStatus(self.api).flush()
+        return processed
+
+    async def _process_upload(
+        self,
+        payload: Payload,
+        raw: bytes | None,
+        invocation_url: str | None,
+        publisher: SpooledPublisher,
+        priority_published: bool = False,
+    ):
+        """Archive, decode and publish one upload.
+
+        ``priority_published`` says the upload's alarms were already published
+        when it was queued (see :meth:`_publish_priority`); they still mark
+        the records they overtook as superseded, but aren't sent again.
+        """
+        serial_number = payload.SerNo
+        records = payload.Records
+        route = self._route(invocation_url)
         log.info(
-            f"Serial: {serial_number}, Agent ID: {agent_id}, Mapping: {device_mapping}"
+            "oem upload",
+            serial=serial_number,
+            records=len(records),
+            bytes=len(raw) if raw is not None else None,
+            tenant=route.tenant,
         )
+        log.payload(serial_number, "oem payload", raw.decode(errors="replace") if raw else payload)
+
+        iccid = route.iccid
+        if iccid:
+            log.debug("sim iccid", serial=serial_number, iccid=iccid)
+
+        # Look up the agent ID for this serial number
+        device_mapping = self._device_mapping(route.app_key)
+        with memprof.stage("lookup"):
+            agent_id = device_mapping.get(str(serial_number)) if device_mapping is not None else None
+        decode_record = _record_decoder(route.model)
+
+        archive = self._archive(route)
+        if raw is not None:
+            with memprof.stage("dedupe"):
+                duplicate = await archive.is_duplicate(serial_number, raw)
+            if duplicate:
+                log.info("upload already processed (retry); skipping", serial=serial_number)
+                return
+
+        # Alarms go out before the archive and the rest of the batch
+        urgent = {}
+        if device_mapping is not None:
+            with memprof.stage("priority"):
+                urgent = self._urgent_records(records, decode_record)
+                if urgent and not priority_published:
+                    log.info("publishing alarms first", serial=serial_number, alarms=len(urgent), records=len(records))
+                    await self._publish_records(
+                        list(urgent.values()), serial_number, agent_id, iccid, None, publisher
+                    )
+
+        if raw is not None:
+            try:
+                with memprof.stage("archive"):
+                    await archive.store(serial_number, raw, records)
+            except Exception as e:
+                # best effort: not indexed, so a later retry of the same body
+                # will store it
+                log.warning("raw payload not archived", serial=serial_number, error=e)
+
+        if device_mapping is None:
+            log.warning(
+                "serial_number_lookup tag not found; skipping",
+                serial=serial_number,
+                app_key=route.app_key,
+            )
+            return
+
+        if agent_id is None:
+            log.info("serial not mapped to an agent", serial=serial_number, mapped=len(device_mapping))
+
+        with memprof.stage("parse"):
+            last_urgent = max(urgent, default=-1)
+            bulk = []
+            for i, record in enumerate(records):
+                if i in urgent:
+                    continue
+                parsed = decode_record(record)
+                if i < last_urgent:
+                    # older than an alarm the device has already been sent
+                    parsed["superseded"] = True
+                bulk.append(parsed)
+
+            segment = None
+            if agent_id and self.config.compact_tracks.value:
+                segment = self._build_track(bulk)
+
+        with memprof.stage("publish"):
+            await self._publish_records(bulk, serial_number, agent_id, iccid, segment, publisher)
+        FleetStatus(self.api).note(serial_number, [*urgent.values(), *bulk], agent_id)
+
+        # only now does a retry of this body count as a duplicate
+        try:
+            await archive.commit()
+        except Exception as e:
+            log.warning("raw payload not indexed", serial=serial_number, error=e)
 
-        # Parse and process each record
-        records = payload.get("Records", [])
-        for record in records:
-            parsed = parse_dm_record(record)
+    @staticmethod
+    def _urgent_records(records, decode_record) -> dict[int, dict]:
+        """An upload's alarm records, decoded, by their index in the upload."""
+        return {i: decode_record(r) for i, r in enumerate(records) if r.Reason in PRIORITY_REASONS}
+
+    async def _publish_priority(self, payload: Payload, upload: QueuedUpload) -> bool:
+        """Publish a queued upload's alarms straight away, as the inline path
+        would. Returns whether they went out (or were spooled), in which case
+        the consumer won't publish them again.
+        """
+        if not any(r.Reason in PRIORITY_REASONS for r in payload.Records):
+            return False
+        route = self._route(upload.invocation_url)
+        device_mapping = self._device_mapping(route.app_key)
+        if device_mapping is None:
+            return False
+
+        serial_number = payload.SerNo
+        try:
+            with memprof.session("integration.priority"):
+                if await self._archive(route).is_duplicate(serial_number, upload.body):
+                    return False  # the consumer will skip the whole upload
+                urgent = self._urgent_records(payload.Records, _record_decoder(route.model))
+                agent_id = device_mapping.get(str(serial_number))
+                log.info("publishing alarms before queueing", serial=serial_number, alarms=len(urgent))
+                await self._publish_records(
+                    list(urgent.values()), serial_number, agent_id, route.iccid, None, SpooledPublisher(self.api)
+                )
+        except Exception as e:
+            log.warning("alarms not published; leaving them to the consumer", serial=serial_number, error=e)
+            return False
+        return True
+
+    async def _publish_records(self, parsed_records, serial_number, agent_id, iccid, segment, publisher):
+        # Process each record
+        for parsed in parsed_records:
             parsed["serial_number"] = serial_number
             if iccid:
                 parsed["sim_iccid"] = iccid
 
+            trace = parsed.pop("accel_trace", None)
+            if trace is not None:
+                parsed["accel_summary"] = await self._store_accel_trace(publisher, parsed, trace)
+
+            if segment is not None and "position" in parsed:
+                # the device gets this fix via location_track instead
+                parsed["track_published"] = True
+
             # Store the raw event on this integration's agent
-            await self.api.create_message("dm_events", parsed)
+            await publisher.create_message("dm_events", parsed)
 
             # Forward to the device agent if we have a mapping
             if agent_id:
-                log.info(f"Forwarding to agent {agent_id}: {parsed}")
-                await self.api.create_message("on_dm_event", parsed, agent_id=agent_id)
+                log.payload(serial_number, "forwarding record", parsed, agent_id=agent_id)
+                await publisher.create_message("on_dm_event", parsed, agent_id=agent_id)
+
+        if segment is not None:
+            await publisher.create_message(TRACK_CHANNEL, segment, agent_id=agent_id)
+
+    def _build_track(self, parsed_records: list[dict]) -> dict | None:
+        """Encode the positioned records as one track segment, if worthwhile."""
+        fixes = [
+            {
+                "lat": p["position"]["lat"],
+                "lng": p["position"]["long"],
+                "alt": p["position"].get("alt"),
+                "timestamp": p.get("device_time_utc"),
+            }
+            for p in parsed_records
+            if "position" in p
+        ]
+        if len(fixes) < 2:
+            return None
+        return track.encode(fixes, self.config.track_precision_digits.value)
+
+    async def _store_accel_trace(self, publisher: SpooledPublisher, parsed: dict, trace) -> dict:
+        """Analyse an accelerometer trace and archive the raw samples.
+
+        The samples are attached as a compressed binary file to a message on
+        ``dm_accel_traces``; only the compact summary travels with the record.
+        """
+        from dm_common import accel
+
+        summary = accel.analyse(trace)
+        data = trace.to_bytes()
+        await publisher.create_message(
+            ACCEL_TRACE_CHANNEL,
+            {
+                "serial_number": parsed["serial_number"],
+                "device_time_utc": parsed.get("device_time_utc"),
+                "sequence_number": parsed.get("sequence_number"),
+                "encoding": "int16le-xyz+gzip",
+                "scale_mg": trace.scale_mg,
+                **summary,
+            },
+            files=[File("accel_trace.bin.gz", "application/gzip", len(data), data)],
+        )
+        return summary
@@ -0,0 +1,215 @@
+"""Compressed, content-addressed archive of raw OEM Server payloads.
+
+Every POST body is stored exactly as the device sent it (after the base64
+transport wrapping is removed), so anything ``parse_dm_record`` doesn't
+understand today can be replayed losslessly later.
+
+Payloads are keyed by a hash of their content, so a connector retrying the
+same POST is archived once, and the integration doesn't publish its records
+again. The blob is attached to a message on the ``dm_raw`` channel. Each
+serial has its own index, in the ``dm_raw_index_<serial>`` channel aggregate,
+of ``{hash: [first DateUTC, last DateUTC, message id]}`` for range lookups
+without scanning messages; reading it costs the same however large the fleet.
+
+A payload only enters the index (and so only counts as a retry) once
+:meth:`RawArchive.commit` is called after its records are published, so an
+upload that failed part way is processed again when it's redelivered.
+
+Compression uses zstd when the optional ``zstandard`` package is installed
+(the ``archive`` extra), with the routed tenant's trained dictionary if the
+integration config has one, and falls back to gzip.
+"""
+from __future__ import annotations
+
+import base64
+import functools
+import gzip
+import hashlib
+from collections import OrderedDict
+from typing import Any
+
+from pydoover.models import File
+
+from dm_common import logs
+from dm_common.decoders.oem import Record
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+log = logs.get_logger(__name__)
+
+ARCHIVE_CHANNEL = "dm_raw"
+
+# Number of archived payloads kept in the aggregate index per serial number.
+INDEX_ENTRIES_PER_SERIAL = 500
+
+# Hashes archived by this container, so warm invocations can drop retries
+# without reading the index back.
+_SEEN_CACHE_SIZE = 4096
+_seen: OrderedDict[str, None] = OrderedDict()
+
+
+def content_hash(raw: bytes) -> str:
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def compress(raw: bytes, dictionary: bytes | None = None) -> tuple[str, bytes]:
+    """Compress ``raw``, returning ``(codec, blob)``."""
+    if zstandard is not None:
+        if dictionary:
+            zdict = zstandard.ZstdCompressionDict(dictionary)
+            compressor = zstandard.ZstdCompressor(level=10, dict_data=zdict)
+            return f"zstd-dict:{zdict.dict_id()}", compressor.compress(raw)
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(raw)
+    return "gzip", gzip.compress(raw, compresslevel=9)
+
+
+def decompress(codec: str, blob: bytes, dictionary: bytes | None = None) -> bytes:
+    if codec == "gzip":
+        return gzip.decompress(blob)
+    if zstandard is None:
+        raise RuntimeError(f"zstandard is required to read {codec} archives")
+    if codec.startswith("zstd-dict:"):
+        if not dictionary:
+            raise ValueError(f"{codec} archive needs its training dictionary")
+        zdict = zstandard.ZstdCompressionDict(dictionary)
+        return zstandard.ZstdDecompressor(dict_data=zdict).decompress(blob)
+    return zstandard.ZstdDecompressor().decompress(blob)
+
+
+def train_dictionary(samples: list[bytes], size: int = 16 * 1024) -> bytes:
+    """Train a zstd dictionary from a tenant's archived payloads."""
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to train a dictionary")
+    return zstandard.train_dictionary(size, samples).as_bytes()
+
+
+@functools.lru_cache(maxsize=8)
+def parse_dictionaries(spec: str) -> dict[str, bytes]:
+    """Per-tenant dictionaries from ``tenant=<base64>, ...`` config.
+
+    Malformed entries are logged and skipped, leaving that tenant on plain zstd.
+    """
+    dictionaries = {}
+    for entry in filter(None, (e.strip() for e in spec.split(","))):
+        tenant, sep, encoded = entry.partition("=")
+        try:
+            if not sep or not tenant.strip():
+                raise ValueError("expected tenant=<base64>")
+            dictionaries[tenant.strip()] = base64.b64decode(encoded.strip(), validate=True)
+        except ValueError as e:  # includes binascii.Error
+            log.warning("skipping archive dictionary", entry=entry[:40], error=e)
+    return dictionaries
+
+
+def index_channel(serial_number) -> str:
+    return f"{ARCHIVE_CHANNEL}_index_{serial_number}"
+
+
+def _date_range(records: list[Record]) -> tuple[str | None, str | None]:
+    dates = [r.DateUTC for r in records if r.DateUTC]
+    if not dates:
+        return None, None
+    return min(dates), max(dates)
+
+
+def _remember(digest: str):
+    _seen[digest] = None
+    _seen.move_to_end(digest)
+    while len(_seen) > _SEEN_CACHE_SIZE:
+        _seen.popitem(last=False)
+
+
+class RawArchive:
+    def __init__(self, api, dictionary: bytes | None = None):
+        self.api = api
+        self.dictionary = dictionary
+        # serial -> index, as loaded (and added to) by this instance
+        self._indexes: dict[str, dict[str, Any]] = {}
+        # (serial, hash) stored but not yet committed to the index
+        self._uncommitted: list[tuple[str, str]] = []
+
+    async def _load_index(self, serial: str) -> dict[str, Any]:
+        if serial not in self._indexes:
+            channel = index_channel(serial)
+            try:
+                aggregate = await self.api.fetch_channel_aggregate(channel)
+                self._indexes[serial] = dict(aggregate.data or {})
+            except Exception as e:
+                log.warning("could not fetch archive index", channel=channel, error=e)
+                self._indexes[serial] = {}
+        return self._indexes[serial]
+
+    async def is_duplicate(self, serial_number, raw: bytes) -> bool:
+        """Whether ``raw`` was already archived and published, i.e. is a retry."""
+        digest = content_hash(raw)
+        if digest in _seen:
+            return True
+        if digest in await self._load_index(str(serial_number)):
+            _remember(digest)
+            return True
+        return False
+
+    async def store(self, serial_number, raw: bytes, records: list[Record]) -> bool:
+        """Archive ``raw`` unless it's already been stored. Returns True if stored.
+
+        The index isn't written until :meth:`commit`.
+        """
+        if await self.is_duplicate(serial_number, raw):
+            log.info("raw payload already archived (retry)", serial=serial_number)
+            return False
+
+        digest = content_hash(raw)
+        serial = str(serial_number)
+
+        codec, blob = compress(raw, self.dictionary)
+        first, last = _date_range(records)
+        message = await self.api.create_message(
+            ARCHIVE_CHANNEL,
+            {
+                "hash": digest,
+                "serial_number": serial,
+                "codec": codec,
+                "from": first,
+                "to": last,
+                "records": len(records),
+                "size": len(raw),
+                "compressed_size": len(blob),
+            },
+            files=[File(f"{digest}.{codec.split(':')[0]}", "application/octet-stream", len(blob), blob)],
+        )
+
+        self._indexes[serial][digest] = [first, last, getattr(message, "id", None)]
+        self._uncommitted.append((serial, digest))
+        return True
+
+    async def commit(self):
+        """Index what :meth:`store` archived, once its records are published."""
+        uncommitted, self._uncommitted = self._uncommitted, []
+        for serial, digest in uncommitted:
+            entries = self._indexes[serial]
+            if len(entries) > INDEX_ENTRIES_PER_SERIAL:
+                # oldest payloads (by first record time) drop out of the index
+                keep = sorted(entries.items(), key=lambda kv: kv[1][0] or "")
+                self._indexes[serial] = entries = dict(keep[-INDEX_ENTRIES_PER_SERIAL:])
+                await self.api.update_channel_aggregate(index_channel(serial), entries, replace_data=True)
+            else:
+                await self.api.update_channel_aggregate(index_channel(serial), {digest: entries[digest]})
+            _remember(digest)
+
+    async def lookup(self, serial_number, start: str | None = None, end: str | None = None) -> list[str]:
+        """Hashes of archived payloads for a serial overlapping ``[start, end]``.
+
+        Bounds are ``DateUTC`` strings, compared lexically (they're ISO 8601).
+        """
+        index = await self._load_index(str(serial_number))
+        found = []
+        for digest, (first, last, _) in index.items():
+            if start is not None and (last or "") < start:
+                continue
+            if end is not None and (first or "") > end:
+                continue
+            found.append(digest)
+        return sorted(found, key=lambda d: index[d][0] or "")
@@ -0,0 +1,121 @@
+"""Fleet status kept incrementally on the integration agent.
+
+The integration sees every record for every serial, so it keeps a compact
+status entry per serial in the ``dm_fleet`` channel aggregate::
+
+    {"devices": {"1001": {"agent": 42, "seen": "2024-01-01 00:00:00",
+                          "rx": 1704067200, "pos": [-37.8, 144.9],
+                          "batt": 4.1, "ign": true, "reason": 11}}}
+
+A fleet dashboard is then one aggregate read, however many devices there are.
+
+Entries are built from each upload's newest record (by ``DateUTC``). A field
+an upload doesn't carry keeps its previous value. Changed entries are held
+for the life of the container and flushed as one partial aggregate update
+once :data:`DEBOUNCE_S` has passed since the last flush, or once
+:data:`MAX_PENDING` serials are waiting. Scheduled runs flush whatever is
+left. If a container is reclaimed before flushing, the next upload from each
+affected serial brings its entry up to date again.
+
+Several containers flush into the same aggregate, so each flush reads it
+first. A pending entry older (by ``seen``) than the stored one, e.g. from a
+redelivered upload, only fills the fields the stored entry lacks.
+"""
+from __future__ import annotations
+
+import time
+
+from dm_common import logs
+
+log = logs.get_logger(__name__)
+
+FLEET_CHANNEL = "dm_fleet"
+
+DEBOUNCE_S = 30.0
+MAX_PENDING = 500
+
+POSITION_DIGITS = 5
+
+# serial -> entry changes not yet flushed, kept across warm invocations. They
+# live only in this container: one reclaimed before its next flush loses
+# them, and the Background Schedule that would flush idle containers is
+# disabled by default.
+_pending: dict[str, dict] = {}
+_last_flush = 0.0
+
+
+def _entry(agent_id, records: list[dict]) -> dict:
+    entry = {"agent": agent_id, "rx": int(time.time())}
+    # oldest first, so the newest record's values win
+    for record in sorted(records, key=lambda r: r.get("device_time_utc") or ""):
+        if record.get("device_time_utc"):
+            entry["seen"] = record["device_time_utc"]
+        if record.get("uplink_reason_code") is not None:
+            entry["reason"] = record["uplink_reason_code"]
+        if "position" in record:
+            entry["pos"] = [
+                round(record["position"]["lat"], POSITION_DIGITS),
+                round(record["position"]["long"], POSITION_DIGITS),
+            ]
+        if record.get("battery_voltage") is not None:
+            entry["batt"] = round(record["battery_voltage"], 2)
+        if record.get("ignition_on") is not None:
+            entry["ign"] = record["ignition_on"]
+    return entry
+
+
+def _fresher(pending: dict, stored: dict | None) -> dict:
+    """The part of a pending entry that should overwrite the stored one."""
+    if stored and stored.get("seen", "") > pending.get("seen", ""):
+        return {k: v for k, v in pending.items() if k not in stored}
+    return pending
+
+
+class FleetStatus:
+    def __init__(self, api):
+        self.api = api
+
+    def note(self, serial_number, records: list[dict], agent_id: int | None = None):
+        """Fold an upload's parsed records into the serial's pending entry."""
+        if not records:
+            return
+        serial = str(serial_number)
+        entry = _entry(agent_id, records)
+        pending = _pending.get(serial)
+        if pending is not None and pending.get("seen", "") > entry.get("seen", ""):
+            # an older upload (e.g. a redelivery) only fills gaps
+            entry.update(pending)
+        _pending[serial] = {**(pending or {}), **entry}
+
+    def due(self) -> bool:
+        return bool(_pending) and (
+            len(_pending) >= MAX_PENDING or time.monotonic() - _last_flush >= DEBOUNCE_S
+        )
+
+    async def flush(self, force: bool = False) -> int:
+        """Write pending entries if due (or forced). Returns the number written.
+
+        Best effort: on failure the entries stay pending for the next flush.
+        """
+        global _last_flush
+        if not _pending or not (force or self.due()):
+            return 0
+
+        devices = dict(_pending)
+        _pending.clear()
+        try:
+            aggregate = await self.api.fetch_channel_aggregate(FLEET_CHANNEL)
+            stored = (aggregate.data or {}).get("devices") or {}
+            changes = {s: _fresher(e, stored.get(s)) for s, e in devices.items()}
+            changes = {s: e for s, e in changes.items() if e}
+            if changes:
+                await self.api.update_channel_aggregate(FLEET_CHANNEL, {"devices": changes})
+        except Exception as e:
+            log.warning("fleet status not flushed", devices=len(devices), error=e)
+            for serial, entry in devices.items():
+                # keep anything noted while we were writing
+                _pending[serial] = {**entry, **_pending.get(serial, {})}
+            return 0
+        _last_flush = time.monotonic()
+        log.info("fleet status flushed", devices=len(changes), stale=len(devices) - len(changes))
+        return len(changes)
@@ -0,0 +1,159 @@
+"""Routing parameters carried in the OEM connector's invocation URL.
+
+Each device's connector is configured with a fixed URL, so everything the
+integration needs from it (SIM ICCID, and optionally the tenant, device
+model and processor app key) is worked out once per distinct URL and cached.
+
+Connector URLs are described by templates, e.g.::
+
+    /ingest/{tenant}/{iccid}
+    ?iccid=&model=
+    /t/{tenant}?sim={iccid}&app={app_key}
+
+Path placeholders match one path segment, and may be preceded by any base
+path. A query part names the query keys to read: ``key=`` reads ``key``
+into the parameter of the same name, and ``key={name}`` reads it into
+``name``. The query keys ``iccid``, ``tenant``, ``model`` and ``app_key``
+are always read, in any case, so a URL with no matching template still
+routes.
+
+If no template yields a valid ICCID, every path segment and query value is
+scanned for one, as connectors templated ``.../ingest/[ICCID]`` need.
+
+Placeholder names must be identifiers, used once per path. A template that
+breaks this is logged and skipped when the templates are loaded, and the
+rest still route.
+"""
+from __future__ import annotations
+
+import functools
+import re
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping
+from urllib.parse import parse_qsl, urlsplit
+
+from dm_common import logs
+
+log = logs.get_logger(__name__)
+
+ICCID_RE = re.compile(r"^89\d{16,20}$")
+
+ROUTE_PARAMS = ("iccid", "tenant", "model", "app_key")
+
+# Distinct connector URLs remembered per router; one per device at most.
+ROUTE_CACHE_SIZE = 4096
+
+_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+
+@dataclass(frozen=True)
+class Route:
+    iccid: str | None = None
+    tenant: str | None = None
+    model: str | None = None
+    app_key: str | None = None
+    params: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))
+
+
+NO_ROUTE = Route()
+
+
+class _Template:
+    __slots__ = ("template", "path", "query")
+
+    def __init__(self, template: str):
+        self.template = template
+        path, _, query = template.partition("?")
+        self.path = None
+        if path:
+            pattern, pos, names = [], 0, set()
+            for m in _PLACEHOLDER_RE.finditer(path):
+                name = m.group(1)
+                if not name.isidentifier() or name in names:
+                    raise ValueError(f"bad placeholder {{{name}}}")
+                names.add(name)
+                pattern.append(re.escape(path[pos : m.start()]))
+                pattern.append(f"(?P<{m.group(1)}>[^/]+)")
+                pos = m.end()
+            pattern.append(re.escape(path[pos:]))
+            self.path = re.compile("".join(pattern).rstrip("/") + "/?$")
+        # query key (lower case) -> parameter name
+        self.query = {}
+        for item in filter(None, query.split("&")):
+            key, _, value = item.partition("=")
+            m = _PLACEHOLDER_RE.fullmatch(value)
+            if m and not m.group(1).isidentifier():
+                raise ValueError(f"bad placeholder {value}")
+            self.query[key.lower()] = m.group(1) if m else key
+
+    def match(self, path: str, query: dict[str, str]) -> dict[str, str] | None:
+        params = {}
+        if self.path is not None:
+            m = self.path.search(path)
+            if m is None:
+                return None
+            params.update(m.groupdict())
+        for key, name in self.query.items():
+            if key in query:
+                params[name] = query[key]
+        return params
+
+
+class Router:
+    """Resolves invocation URLs to :class:`Route` s, one parse per distinct URL."""
+
+    def __init__(self, templates: tuple[str, ...] = (), cache_size: int = ROUTE_CACHE_SIZE):
+        self._templates = []
+        for template in templates:
+            try:
+                self._templates.append(_Template(template))
+            except ValueError as e:
+                log.warning("skipping connector URL template", template=template, error=e)
+        self.templates = tuple(t.template for t in self._templates)
+        self.route = functools.lru_cache(maxsize=cache_size)(self._route)
+
+    def _route(self, invocation_url: str | None) -> Route:
+        if not invocation_url:
+            return NO_ROUTE
+
+        parts = urlsplit(invocation_url)
+        pairs = [(k, v.strip()) for k, v in parse_qsl(parts.query)]
+        query = {}
+        for key, value in pairs:
+            query.setdefault(key.lower(), value)
+
+        params = {}
+        for template in self._templates:
+            matched = template.match(parts.path, query)
+            if matched is not None:
+                params = matched
+                break
+        for name in ROUTE_PARAMS:
+            if name in query:
+                params.setdefault(name, query[name])
+
+        iccid = params.get("iccid")
+        if not (iccid and ICCID_RE.match(iccid)):
+            candidates = [s.strip() for s in parts.path.split("/")] + [v for _, v in pairs]
+            iccid = next((c for c in candidates if ICCID_RE.match(c)), None)
+
+        return Route(
+            iccid=iccid,
+            tenant=params.get("tenant"),
+            model=params.get("model"),
+            app_key=params.get("app_key"),
+            params=MappingProxyType(params),
+        )
+
+
+@functools.lru_cache(maxsize=8)
+def router_for(templates: str = "") -> Router:
+    """The router for a whitespace- or comma-separated template list, kept
+    for the life of the container."""
+    return Router(tuple(t for t in re.split(r"[\s,]+", templates) if t))
+
+
+def extract_iccid(invocation_url: str | None) -> str | None:
+    """Pull the SIM ICCID out of the connector invocation URL, if present."""
+    return router_for().route(invocation_url).iccid
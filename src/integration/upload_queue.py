@@ -0,0 +1,245 @@
+"""Upload queues for fast-ack ingestion.
+
+With a queue configured, ``on_ingestion_endpoint`` only validates the OEM
+Server body and enqueues it, so the connector gets its response straight
+away. The integration's consumer (run from its schedule) pulls uploads off
+the queue in batches and does the archive, lookup and publishing.
+
+Queues are picked by URL:
+
+``https://sqs.<region>.amazonaws.com/<account>/<name>``
+    :class:`SqsQueue`, via ``boto3`` (present in the Lambda runtime).
+``file:///path/to/dir``
+    :class:`FileQueue`, one file per upload; for local runs.
+``memory://name``
+    :class:`MemoryQueue`, process-local; for tests and benchmarks.
+
+Delivery is at least once: an upload that isn't acked is delivered again.
+The raw archive drops repeat bodies by content hash.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import os
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from dm_common import logs
+
+try:
+    import boto3
+except ImportError:  # provided by the Lambda runtime
+    boto3 = None
+
+log = logs.get_logger(__name__)
+
+
+@dataclass
+class QueuedUpload:
+    body: bytes
+    invocation_url: str | None = None
+    enqueued_at: float = field(default_factory=time.time)
+    # implementation specific handle used to ack the message
+    receipt: object = None
+    # the upload's alarm records were published before it was queued
+    priority_published: bool = False
+
+    def encode(self) -> str:
+        return json.dumps({
+            "body": base64.b64encode(self.body).decode(),
+            "invocation_url": self.invocation_url,
+            "enqueued_at": self.enqueued_at,
+            "priority_published": self.priority_published,
+        })
+
+    @classmethod
+    def decode(cls, text: str | bytes, receipt=None) -> QueuedUpload:
+        data = json.loads(text)
+        return cls(
+            base64.b64decode(data["body"]),
+            data.get("invocation_url"),
+            data.get("enqueued_at", 0.0),
+            receipt,
+            data.get("priority_published", False),
+        )
+
+
+class UploadQueue:
+    """Interface for the fast-ack upload queue."""
+
+    # Largest upload the queue takes; bigger ones are processed inline.
+    max_body_bytes: int | None = None
+
+    def accepts(self, upload: QueuedUpload) -> bool:
+        return self.max_body_bytes is None or len(upload.encode()) <= self.max_body_bytes
+
+    async def send(self, upload: QueuedUpload):
+        raise NotImplementedError
+
+    async def receive(self, max_uploads: int = 10) -> list[QueuedUpload]:
+        raise NotImplementedError
+
+    async def ack(self, uploads: list[QueuedUpload]):
+        raise NotImplementedError
+
+
+class MemoryQueue(UploadQueue):
+    # queues by name, shared for the life of the process
+    _queues: dict[str, tuple[deque, dict]] = {}
+
+    def __init__(self, name: str = "default"):
+        self.items, self.inflight = self._queues.setdefault(name, (deque(), {}))
+
+    def __len__(self):
+        return len(self.items)
+
+    async def send(self, upload: QueuedUpload):
+        self.items.append(upload.encode())
+
+    async def receive(self, max_uploads: int = 10) -> list[QueuedUpload]:
+        batch = []
+        while self.items and len(batch) < max_uploads:
+            text = self.items.popleft()
+            receipt = uuid.uuid4().hex
+            self.inflight[receipt] = text
+            batch.append(QueuedUpload.decode(text, receipt=receipt))
+        return batch
+
+    async def ack(self, uploads: list[QueuedUpload]):
+        for upload in uploads:
+            self.inflight.pop(upload.receipt, None)
+
+    def release(self):
+        """Requeue everything received but not acked, as a visibility timeout would."""
+        self.items.extendleft(reversed(list(self.inflight.values())))
+        self.inflight.clear()
+
+
+class FileQueue(UploadQueue):
+    """A directory of upload files. Received files are moved aside until acked,
+    and become visible again if not acked within ``visibility_timeout_s``."""
+
+    def __init__(self, directory: str | os.PathLike, visibility_timeout_s: float = 300.0):
+        self.directory = Path(directory)
+        self.inflight = self.directory / "inflight"
+        self.visibility_timeout_s = visibility_timeout_s
+
+    def __len__(self):
+        return len(list(self.directory.glob("*.json"))) if self.directory.exists() else 0
+
+    async def send(self, upload: QueuedUpload):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.json"
+        tmp = self.directory / f".{name}"
+        tmp.write_text(upload.encode())
+        tmp.rename(self.directory / name)
+
+    async def receive(self, max_uploads: int = 10) -> list[QueuedUpload]:
+        if not self.directory.exists():
+            return []
+        self.inflight.mkdir(exist_ok=True)
+        expired = time.time() - self.visibility_timeout_s
+        for path in self.inflight.glob("*.json"):
+            if path.stat().st_mtime < expired:
+                path.rename(self.directory / path.name)
+
+        batch = []
+        for path in sorted(self.directory.glob("*.json")):
+            if len(batch) >= max_uploads:
+                break
+            claimed = self.inflight / path.name
+            try:
+                path.rename(claimed)
+                os.utime(claimed)
+            except FileNotFoundError:
+                continue  # another consumer got it
+            batch.append(QueuedUpload.decode(claimed.read_text(), receipt=claimed))
+        return batch
+
+    async def ack(self, uploads: list[QueuedUpload]):
+        for upload in uploads:
+            upload.receipt.unlink(missing_ok=True)
+
+
+class SqsQueue(UploadQueue):
+    # SQS message size limit
+    max_body_bytes = 256 * 1024
+    # deletes that fail on the SQS side are retried this many times in all
+    ack_attempts = 3
+
+    def __init__(self, url: str, client=None):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("boto3 is required for an SQS upload queue")
+            client = boto3.client("sqs")
+        self.url = url
+        self.client = client
+
+    async def send(self, upload: QueuedUpload):
+        await asyncio.to_thread(
+            self.client.send_message, QueueUrl=self.url, MessageBody=upload.encode()
+        )
+
+    async def receive(self, max_uploads: int = 10) -> list[QueuedUpload]:
+        batch = []
+        while len(batch) < max_uploads:
+            # SQS hands out at most 10 per request
+            response = await asyncio.to_thread(
+                self.client.receive_message,
+                QueueUrl=self.url,
+                MaxNumberOfMessages=min(max_uploads - len(batch), 10),
+                WaitTimeSeconds=0,
+            )
+            messages = response.get("Messages", [])
+            batch += [QueuedUpload.decode(m["Body"], receipt=m["ReceiptHandle"]) for m in messages]
+            if not messages:
+                break
+        return batch
+
+    async def ack(self, uploads: list[QueuedUpload]):
+        for start in range(0, len(uploads), 10):
+            await self._delete(uploads[start:start + 10])
+
+    async def _delete(self, uploads: list[QueuedUpload]):
+        """Delete up to 10 uploads, retrying entries SQS failed on its side.
+
+        An upload whose delete never succeeds is delivered again once its
+        visibility timeout passes.
+        """
+        for attempt in range(1, self.ack_attempts + 1):
+            entries = [{"Id": str(i), "ReceiptHandle": u.receipt} for i, u in enumerate(uploads)]
+            response = await asyncio.to_thread(
+                self.client.delete_message_batch, QueueUrl=self.url, Entries=entries
+            )
+            failed = (response or {}).get("Failed") or []
+            if not failed:
+                return
+            retry = [f for f in failed if not f.get("SenderFault")]
+            rejected = [f for f in failed if f.get("SenderFault")]
+            if rejected or attempt == self.ack_attempts:
+                log.error(
+                    "upload ack failed; will be redelivered",
+                    failed=len(rejected) + (len(retry) if attempt == self.ack_attempts else 0),
+                    codes=sorted({f.get("Code") for f in failed}),
+                    attempts=attempt,
+                )
+            uploads = [uploads[int(f["Id"])] for f in retry]
+            if not uploads:
+                return
+
+
+def from_url(url: str) -> UploadQueue:
+    parts = urlsplit(url)
+    if parts.scheme == "memory":
+        return MemoryQueue(parts.netloc or "default")
+    if parts.scheme == "file":
+        return FileQueue(parts.path)
+    if parts.scheme == "https" and parts.netloc.startswith("sqs."):
+        return SqsQueue(url)
+    raise ValueError(f"unsupported upload queue URL {url!r}")
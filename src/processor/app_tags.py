@@ -4,6 +4,9 @@ from pydoover.tags import Tag, Tags
 class DigitalMatterTags(Tags):
     run_hours = Tag("number", default=None)
     odometer_km = Tag("number", default=None)
+    # derived from GPS fixes, rebased onto odometer_km when the device reports it
+    gps_odometer_km = Tag("number", default=None)
+    gps_speed_kmh = Tag("number", default=None)
 
     speed = Tag("number", default=None)
     gps_accuracy = Tag("number", default=None)
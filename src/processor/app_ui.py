@@ -55,6 +55,14 @@ class DigitalMatterUI(ui.UI, hidden="$config.app().hide_ui"):
         precision=1,
     )
 
+    # GPS-derived odometer
+    gps_odometer = ui.NumericVariable(
+        "GPS Odometer",
+        value=DigitalMatterTags.gps_odometer_km,
+        units="km",
+        precision=1,
+    )
+
     # System voltage
     system_voltage = ui.NumericVariable(
         "System Voltage",
@@ -1,18 +1,40 @@
-import logging
 from datetime import datetime, timezone, timedelta
+from functools import partial
 
 from pydoover.processor import Application
 from pydoover.models import MessageCreateEvent, ConnectionStatus
 
+from dm_common import logs, memprof
+from dm_common.state import DeviceState, StateStore
+from dm_common.tag_map import apply_tags
+from dm_common.track import location_point
+from dm_common.writes import PooledDataClient, WriteCoalescer
+
 from .app_config import DigitalMatterProcessorConfig
 from .app_tags import DigitalMatterTags
 from .app_ui import DigitalMatterUI
 
 
-log = logging.getLogger(__name__)
+log = logs.get_logger(__name__)
 
 HARDWARE_CHANNEL = "dv-hardware"
 
+# parsed record field -> DigitalMatterTags attribute
+TAG_MAP = {
+    "speed_kmh": "speed",
+    "gps_accuracy_m": "gps_accuracy",
+    "ignition_on": "ignition_on",
+    "run_hours": "run_hours",
+    "odometer_km": "odometer_km",
+    "system_voltage": "system_voltage",
+    "battery_voltage": "battery_voltage",
+    "signal_strength_percent": "signal_strength",
+    "device_temp_c": "device_temp",
+    "analog_input_v": "analog_input_v",
+    "uplink_reason": "uplink_reason",
+    "device_time_utc": "device_time",
+}
+
 
 class DigitalMatterProcessor(Application):
     config_cls = DigitalMatterProcessorConfig
@@ -23,6 +45,10 @@ class DigitalMatterProcessor(Application):
     tags: DigitalMatterTags
     ui: DigitalMatterUI
 
+    def __init__(self):
+        super().__init__()
+        self.api = PooledDataClient(self._api_endpoint)
+
     async def on_message_create(self, event: MessageCreateEvent):
         """
         Handle incoming Digital Matter events forwarded from the integration.
@@ -34,67 +60,142 @@ class DigitalMatterProcessor(Application):
             return
 
         data = event.message.data
-        log.info(f"Processing Digital Matter event: {data}")
+        serial = data.get("serial_number")
+        log.info(
+            "dm event",
+            serial=serial,
+            reason=data.get("uplink_reason_code"),
+            seq=data.get("sequence_number"),
+        )
+        log.payload(serial, "dm event payload", data)
+
+        with memprof.session("processor.event"):
+            store = StateStore(self.api)
+            state = None
+            device_time = data.get("device_time_utc")
+            if device_time:
+                # only records with a device time can be ordered or deduplicated
+                with memprof.stage("state"):
+                    state = await store.load()
+                last, seq = state.get("t"), data.get("sequence_number")
+                if seq is not None and last == device_time and state.get("seq") == seq:
+                    log.info("duplicate event; skipping", serial=serial, seq=seq)
+                    return
+                if last and device_time < last:
+                    data = {**data, "superseded": True}
+
+            async with WriteCoalescer(self.api) as writes:
+                with memprof.stage("process"):
+                    await self._process_event(data, writes)
+                if state is not None:
+                    advance = partial(self._advance_state, data)
+                    with memprof.stage("distance"):
+                        await advance(state)
+                    writes.defer("state", partial(self._save_state, store, state, advance))
+                with memprof.stage("flush"):
+                    await writes.flush()
+
+    async def _advance_state(self, data: dict, state: DeviceState):
+        """Move the device's state on to this record, unless it's older.
+
+        Also run again on the stored state if another invocation saved first,
+        so it must be safe to repeat.
+        """
+        last = state.get("t")
+        if last and data["device_time_utc"] < last:
+            return
+        state["t"] = data["device_time_utc"]
+        state["seq"] = data.get("sequence_number")
+        if not data.get("superseded"):
+            await self._update_distance(data, state)
 
+    async def _save_state(self, store: StateStore, state: DeviceState, advance):
+        if not await store.save(state, advance):
+            log.warning("device state not saved; the next event reloads it", rev=state.rev)
+
+    async def _process_event(self, data: dict, writes: WriteCoalescer):
         if data.get("sim_iccid"):
-            await self._update_hardware_iccid(data["sim_iccid"])
+            await self._update_hardware_iccid(data["sim_iccid"], writes)
+
+        # A record older than one already applied (e.g. one the integration
+        # forwarded an alarm ahead of) only adds to the history; it mustn't
+        # roll the latest state back.
+        superseded = data.get("superseded", False)
 
         odometer_offset = self.config.odometer_offset_km.value
         run_hours_offset = self.config.run_hours_offset.value
 
         # Update tags with telemetry data (UI is bound to these via tag_ref)
-        if "speed_kmh" in data:
-            await self.tags.speed.set(data["speed_kmh"])
-
-        if "gps_accuracy_m" in data:
-            await self.tags.gps_accuracy.set(data["gps_accuracy_m"])
-
-        if "ignition_on" in data:
-            await self.tags.ignition_on.set(data["ignition_on"])
-
-        if "run_hours" in data:
-            await self.tags.run_hours.set(data["run_hours"] + run_hours_offset)
-
-        if "odometer_km" in data:
-            await self.tags.odometer_km.set(data["odometer_km"] + odometer_offset)
-
-        if "system_voltage" in data:
-            await self.tags.system_voltage.set(data["system_voltage"])
-
-        if "battery_voltage" in data:
-            await self.tags.battery_voltage.set(data["battery_voltage"])
-
-        if "signal_strength_percent" in data:
-            await self.tags.signal_strength.set(data["signal_strength_percent"])
-
-        if "device_temp_c" in data:
-            await self.tags.device_temp.set(data["device_temp_c"])
-
-        if "analog_input_v" in data:
-            await self.tags.analog_input_v.set(data["analog_input_v"])
-
-        if "uplink_reason" in data:
-            await self.tags.uplink_reason.set(data["uplink_reason"])
-
-        if "device_time_utc" in data:
-            await self.tags.device_time.set(data["device_time_utc"])
+        if not superseded:
+            await apply_tags(
+                self.tags,
+                data,
+                TAG_MAP,
+                transforms={
+                    "run_hours": lambda v: v + run_hours_offset,
+                    "odometer_km": lambda v: v + odometer_offset,
+                },
+            )
 
         # Publish location to the location channel if we have a valid position
         position = data.get("position")
         if position is not None:
-            await self.api.update_channel_aggregate("location", position, replace_data=True)
-            await self.api.create_message("location", position)
+            point = location_point(position["lat"], position["long"], position.get("alt"))
+            if not superseded:
+                writes.update_channel_aggregate("location", point, replace_data=True)
+            # When the integration sent this fix as part of a compact
+            # location_track segment, only the latest-position aggregate
+            # needs updating here.
+            if not data.get("track_published"):
+                writes.create_message("location", point)
 
         # Update connection status
         # Digital Matter devices typically report periodically (e.g., every 10-30 minutes)
         # Set offline threshold to 1 hour from now
-        await self.ping_connection(
-            online_at=datetime.now(timezone.utc),
-            connection_status=ConnectionStatus.periodic_unknown,
-            offline_at=datetime.now(timezone.utc) + timedelta(hours=1),
+        now = datetime.now(timezone.utc)
+        writes.defer(
+            "ping_connection",
+            partial(
+                self.ping_connection,
+                online_at=now,
+                connection_status=ConnectionStatus.periodic_unknown,
+                offline_at=now + timedelta(hours=1),
+            ),
         )
 
-    async def _update_hardware_iccid(self, iccid: str):
+    async def _update_distance(self, data: dict, state: DeviceState):
+        """Fold the record's fix into the GPS odometer.
+
+        A record carrying the device's own odometer rebases the derived one
+        onto it, offset the same way as the ``odometer_km`` tag.
+        """
+        position = data.get("position")
+        if position is None and data.get("odometer_km") is None:
+            return
+
+        from dm_common import distance
+
+        odometer = distance.GpsOdometer(state)
+        t = distance.epoch(data["device_time_utc"])
+        if position is not None and t is not None:
+            odometer.add(distance.Fix(
+                t,
+                position["lat"],
+                position["long"],
+                data.get("gps_accuracy_m"),
+                data.get("pdop"),
+                data.get("speed_kmh"),
+            ))
+        if data.get("odometer_km") is not None:
+            odometer.reconcile(data["odometer_km"] + self.config.odometer_offset_km.value)
+        odometer.update()
+
+        if odometer.km is not None:
+            await self.tags.gps_odometer_km.set(round(odometer.km, 3))
+        if odometer.speed_kmh is not None:
+            await self.tags.gps_speed_kmh.set(round(odometer.speed_kmh, 1))
+
+    async def _update_hardware_iccid(self, iccid: str, writes: WriteCoalescer):
         """Publish the SIM ICCID to the dv-hardware channel like host_configurator.
 
         Only republishes when the ICCID changes, so a stable SIM doesn't spam
@@ -107,10 +208,10 @@ class DigitalMatterProcessor(Application):
         if self.tags.sim_iccid.value == iccid:
             return
 
-        log.info(f"Publishing SIM ICCID {iccid} to {HARDWARE_CHANNEL}")
+        log.info("publishing sim iccid", iccid=iccid, channel=HARDWARE_CHANNEL)
         # Match host_configurator's snapshot shape: the SIM ICCID lives under
         # the top-level "modem" key as sim_iccid.
         snapshot = {"modem": {"sim_iccid": iccid}}
-        await self.api.create_message(HARDWARE_CHANNEL, snapshot)
-        await self.api.update_channel_aggregate(HARDWARE_CHANNEL, snapshot)
+        writes.create_message(HARDWARE_CHANNEL, snapshot)
+        writes.update_channel_aggregate(HARDWARE_CHANNEL, snapshot)
         await self.tags.sim_iccid.set(iccid)
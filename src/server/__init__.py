@@ -0,0 +1,6 @@
+"""A long-running, multi-core server for the connector.
+
+Hosts the Digital Matter integration and the device processors in warm
+worker processes, as an alternative to one Lambda invocation per POST. See
+the README's "On-Prem Server" section.
+"""
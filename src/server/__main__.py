@@ -0,0 +1,43 @@
+import argparse
+import os
+
+from .app import AccessPolicy
+from .host import ServerSettings
+from .runner import serve
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Digital Matter connector as a long-running server.")
+    parser.add_argument("--settings", help="path to the server settings JSON file")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--fake-api", action="store_true", help="serve an in-memory Doover API and use it")
+    parser.add_argument(
+        "--secret",
+        default=os.environ.get("DM_SERVER_SECRET"),
+        help="shared secret posts must send in the X-DM-Secret header (default: $DM_SERVER_SECRET)",
+    )
+    parser.add_argument(
+        "--allow-cidr",
+        action="append",
+        metavar="CIDR",
+        help="accept posts from this network without the secret (repeatable)",
+    )
+    args = parser.parse_args()
+
+    if args.settings:
+        settings = ServerSettings.load(args.settings)
+    elif args.fake_api:
+        settings = ServerSettings(integration_agent_id=1)
+    else:
+        parser.error("--settings is required unless --fake-api is given")
+    try:
+        access = AccessPolicy.from_args(args.secret, args.allow_cidr)
+    except ValueError as e:
+        parser.error(f"--allow-cidr: {e}")
+    serve(settings, args.host, args.port, args.workers, args.fake_api, access)
+
+
+if __name__ == "__main__":
+    main()
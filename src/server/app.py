@@ -0,0 +1,201 @@
+"""HTTP front for the long-running server.
+
+Each worker process serves the same routes as the single-process server:
+
+* ``POST /ingest[/...]`` - an OEM Server connector POST (the JSON body as the
+  connector sends it; the full request URL is the invocation URL, so
+  connector URL templates and ``?iccid=`` work as they do on Lambda)
+* ``POST /tts`` - a The Things Stack uplink webhook
+* ``GET /health``
+
+With several workers, a frontend process owns the public port and forwards
+each request to a worker over a Unix socket, picked by a stable hash of the
+device's serial number (OEM) or DevEUI (TTS). A device is therefore always
+handled by the same worker: its warm caches live there, and its records and
+processor events are never processed concurrently by two processes.
+
+The app on the public port only accepts posts that carry the shared secret in
+:data:`SECRET_HEADER` or come from an allowed network (see
+:class:`AccessPolicy`); anything else gets a 401. With neither configured,
+only loopback clients are accepted. ``/health`` is always open, and workers
+behind the frontend trust it, since they only listen on Unix sockets.
+
+The frontend passes the public request URL to workers in
+:data:`INVOCATION_URL_HEADER`. Only workers behind the frontend read it; a
+worker on the public port uses its own request URL, so a client can't route
+its upload elsewhere by sending the header.
+"""
+from __future__ import annotations
+
+import asyncio
+import hmac
+import ipaddress
+import zlib
+from dataclasses import dataclass, field
+
+import aiohttp
+import msgspec
+from aiohttp import web
+
+from dm_common import logs
+
+from .host import AppHost
+
+log = logs.get_logger(__name__)
+
+INVOCATION_URL_HEADER = "X-Invocation-Url"
+SECRET_HEADER = "X-DM-Secret"
+LOOPBACK = (ipaddress.ip_network("127.0.0.0/8"), ipaddress.ip_network("::1/128"))
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+
+class _SerialOnly(msgspec.Struct):
+    SerNo: int | str | None = None
+
+
+class _TtsIds(msgspec.Struct):
+    dev_eui: str | None = None
+
+
+class _TtsOnly(msgspec.Struct):
+    end_device_ids: _TtsIds | None = None
+
+
+_serial_decoder = msgspec.json.Decoder(_SerialOnly)
+_tts_decoder = msgspec.json.Decoder(_TtsOnly)
+
+
+@dataclass
+class AccessPolicy:
+    """Who may post to the public port: a shared secret, or source networks."""
+    secret: str | None = None
+    networks: list[ipaddress.IPv4Network | ipaddress.IPv6Network] = field(default_factory=list)
+
+    @classmethod
+    def from_args(cls, secret: str | None, cidrs: list[str] | None) -> AccessPolicy:
+        return cls(secret or None, [ipaddress.ip_network(c, strict=False) for c in cidrs or ()])
+
+    def allows(self, request: web.Request) -> bool:
+        if self.secret is not None:
+            supplied = request.headers.get(SECRET_HEADER, "")
+            if hmac.compare_digest(supplied.encode(), self.secret.encode()):
+                return True
+        networks = self.networks if (self.secret is not None or self.networks) else LOOPBACK
+        try:
+            remote = ipaddress.ip_address(request.remote or "")
+        except ValueError:
+            return False
+        return any(remote in network for network in networks)
+
+
+def _access_middleware(policy: AccessPolicy):
+    @web.middleware
+    async def check_access(request: web.Request, handler):
+        if request.method != "GET" and not policy.allows(request):
+            log.warning("rejected unauthorised request", path=request.path, remote=request.remote)
+            return web.Response(status=401, text="unauthorised")
+        return await handler(request)
+
+    return check_access
+
+
+def _application(access: AccessPolicy | None) -> web.Application:
+    middlewares = [_access_middleware(access)] if access is not None else []
+    return web.Application(client_max_size=MAX_BODY_BYTES, middlewares=middlewares)
+
+
+def shard_for(key: str | None, workers: int) -> int:
+    """Stable worker index for a serial number or DevEUI."""
+    if workers <= 1 or not key:
+        return 0
+    return zlib.crc32(str(key).upper().encode()) % workers
+
+
+def shard_key(path: str, body: bytes) -> str | None:
+    try:
+        if path.startswith("/tts"):
+            ids = _tts_decoder.decode(body).end_device_ids
+            return ids.dev_eui if ids else None
+        serial = _serial_decoder.decode(body).SerNo
+        return None if serial is None else str(serial)
+    except msgspec.DecodeError:
+        return None  # the worker will reject it properly
+
+
+def make_worker_app(
+    host: AppHost, access: AccessPolicy | None = None, behind_frontend: bool = False
+) -> web.Application:
+    async def ingest(request: web.Request) -> web.Response:
+        body = await request.read()
+        url = str(request.url)
+        if behind_frontend:
+            url = request.headers.get(INVOCATION_URL_HEADER) or url
+        if not await host.handle_oem(body, url):
+            return web.Response(status=400, text="invalid payload")
+        return web.Response(text="OK")
+
+    async def tts(request: web.Request) -> web.Response:
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="invalid JSON")
+        if not await host.handle_tts(data):
+            return web.Response(status=404, text="unknown device")
+        return web.Response(text="OK")
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"ok": True})
+
+    async def on_cleanup(app):
+        await host.close()
+
+    app = _application(access)
+    app.router.add_post("/tts", tts)
+    app.router.add_post("/ingest", ingest)
+    app.router.add_post("/ingest/{tail:.*}", ingest)
+    app.router.add_get("/health", health)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def make_frontend_app(worker_sockets: list[str], access: AccessPolicy | None = None) -> web.Application:
+    sessions: list[aiohttp.ClientSession] = []
+
+    async def on_startup(app):
+        for path in worker_sockets:
+            sessions.append(aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=path)))
+
+    async def on_cleanup(app):
+        await asyncio.gather(*(s.close() for s in sessions))
+
+    async def forward(request: web.Request) -> web.Response:
+        body = await request.read()
+        worker = shard_for(shard_key(request.path, body), len(sessions))
+        async with sessions[worker].post(
+            f"http://worker{request.path_qs}",
+            data=body,
+            headers={
+                INVOCATION_URL_HEADER: str(request.url),
+                "Content-Type": request.content_type,
+            },
+        ) as resp:
+            return web.Response(status=resp.status, body=await resp.read())
+
+    async def health(request: web.Request) -> web.Response:
+        results = []
+        for session in sessions:
+            try:
+                async with session.get("http://worker/health") as resp:
+                    results.append(resp.status == 200)
+            except aiohttp.ClientError:
+                results.append(False)
+        return web.json_response({"ok": all(results), "workers": results}, status=200 if all(results) else 503)
+
+    app = _application(access)
+    app.router.add_post("/tts", forward)
+    app.router.add_post("/ingest", forward)
+    app.router.add_post("/ingest/{tail:.*}", forward)
+    app.router.add_get("/health", health)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
@@ -0,0 +1,104 @@
+"""An in-memory stand-in for the Doover Data API, served over HTTP.
+
+Implements the handful of endpoints the connector uses (create message,
+fetch / patch / put channel aggregate) with the same request and response
+shapes, so the server can be run and benchmarked entirely locally::
+
+    python -m server --fake-api --workers 4
+
+Aggregates are PATCH-merged like the real API, and ``?replace=`` drops the
+named dotted keys first. Nothing is persisted.
+"""
+from __future__ import annotations
+
+import asyncio
+import copy
+import itertools
+import json
+
+from aiohttp import web
+
+
+def _merge(target: dict, update: dict):
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+class FakeDataApi:
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.messages: dict[tuple[int, str], list[dict]] = {}
+        self.aggregates: dict[tuple[int, str], dict] = {}
+        self.requests = 0
+        self.log: list[tuple[str, int, str]] = []
+        self._ids = itertools.count(1)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        base = "/agents/{agent_id}/channels/{channel}"
+        app.router.add_post(base + "/messages", self.create_message)
+        app.router.add_get(base + "/aggregate", self.fetch_aggregate)
+        app.router.add_patch(base + "/aggregate", self.update_aggregate)
+        app.router.add_put(base + "/aggregate", self.update_aggregate)
+        return app
+
+    async def _enter(self, request: web.Request) -> tuple[int, str]:
+        self.requests += 1
+        key = int(request.match_info["agent_id"]), request.match_info["channel"]
+        self.log.append((request.method, *key))
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        return key
+
+    async def _body(self, request: web.Request) -> tuple[dict, list[dict]]:
+        if request.content_type.startswith("multipart/"):
+            body, attachments = {}, []
+            async for part in await request.multipart():
+                if part.name == "json_payload":
+                    body = json.loads(await part.text())
+                else:
+                    data = await part.read()
+                    attachments.append(
+                        {"id": next(self._ids), "filename": part.filename, "size": len(data)}
+                    )
+            return body, attachments
+        return await request.json(), []
+
+    def _aggregate(self, key) -> dict:
+        return {"data": self.aggregates.get(key, {}), "attachments": [], "last_updated": None}
+
+    async def create_message(self, request: web.Request) -> web.Response:
+        key = await self._enter(request)
+        body, attachments = await self._body(request)
+        message = {
+            "id": next(self._ids),
+            "author_id": 0,
+            "channel": {"agent_id": key[0], "name": key[1]},
+            "data": body.get("data"),
+            "attachments": [],
+        }
+        self.messages.setdefault(key, []).append({**message, "files": attachments})
+        return web.json_response(message)
+
+    async def fetch_aggregate(self, request: web.Request) -> web.Response:
+        key = await self._enter(request)
+        return web.json_response(self._aggregate(key))
+
+    async def update_aggregate(self, request: web.Request) -> web.Response:
+        key = await self._enter(request)
+        data, _ = await self._body(request)
+        if request.method == "PUT":
+            self.aggregates[key] = copy.deepcopy(data)
+        else:
+            current = self.aggregates.setdefault(key, {})
+            for path in request.query.getall("replace", []):
+                parent = current
+                *parents, leaf = path.split(".")
+                for part in parents:
+                    parent = parent.setdefault(part, {})
+                parent.pop(leaf, None)
+            _merge(current, data)
+        return web.json_response(self._aggregate(key))
@@ -0,0 +1,291 @@
+"""Hosts the integration and device processors in a long-lived process.
+
+One :class:`AppHost` per worker process keeps a single warm
+``DigitalMatterIntegration`` and one warm processor instance per device
+agent it serves, all sharing one pooled HTTP session to the Doover API.
+Where Lambda would set these up per invocation (token upgrade, tag values,
+deployment config, a fresh session), the host does it once, refreshing the
+integration's tag values every :data:`TAG_REFRESH_S`.
+
+Records the integration forwards to an agent this host serves are handed to
+that agent's processor in-process, one event at a time per agent, instead of
+waiting for Doover to invoke it. Such agents should not also have the
+processor's cloud subscription enabled.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import copy
+import importlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from pydoover.models import ChannelID, IngestionEndpointEvent, Message, MessageCreateEvent
+from pydoover.tags.manager import TagsManagerProcessor
+
+from dm_common import logs
+from dm_common.writes import PooledDataClient
+
+log = logs.get_logger(__name__)
+
+DEFAULT_API_URL = "https://data.doover.com/api"
+
+# How long the integration's tag values (serial_number_lookup) are trusted.
+TAG_REFRESH_S = 60.0
+# How often the integration's scheduled work (spool drain, fleet flush,
+# fast-ack queue) runs.
+SCHEDULE_S = 60.0
+
+PROCESSOR_APPS = {
+    "digital_matter_processor": "processor.application:DigitalMatterProcessor",
+    "g62_processor": "g62.application:G62Processor",
+}
+
+_INGESTION_DEFAULTS = {
+    "dv_proc_ingestion": {"cidr_ranges": []},
+    "dv_proc_extended_permissions": {"devices": [], "groups": [], "apps_installed": []},
+}
+
+
+@dataclass
+class AgentSpec:
+    agent_id: int
+    app: str
+    app_key: str
+    config: dict = field(default_factory=dict)
+    dev_eui: str | None = None
+
+
+@dataclass
+class ServerSettings:
+    """What Lambda would get from Doover per invocation, given up front.
+
+    Loaded from a JSON file::
+
+        {
+          "api_url": "https://data.doover.com/api",
+          "token": "...",
+          "integration": {"agent_id": 100, "app_key": "digital_matter_integration_1",
+                          "config": {...}},
+          "agents": {"42": {"app": "digital_matter_processor",
+                            "app_key": "digital_matter_processor_1", "config": {...}},
+                     "43": {"app": "g62_processor", "app_key": "g62_processor_1",
+                            "dev_eui": "70B3D5E75E000001"}}
+        }
+
+    ``token`` falls back to the ``DOOVER_API_TOKEN`` environment variable.
+    """
+
+    integration_agent_id: int
+    integration_app_key: str = "digital_matter_integration_1"
+    integration_config: dict = field(default_factory=dict)
+    agents: dict[int, AgentSpec] = field(default_factory=dict)
+    api_url: str = DEFAULT_API_URL
+    token: str | None = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ServerSettings":
+        integration = data.get("integration") or {}
+        agents = {}
+        for agent_id, spec in (data.get("agents") or {}).items():
+            if spec["app"] not in PROCESSOR_APPS:
+                raise ValueError(f"agent {agent_id}: unknown app {spec['app']!r}")
+            agents[int(agent_id)] = AgentSpec(
+                int(agent_id),
+                spec["app"],
+                spec.get("app_key") or f"{spec['app']}_1",
+                spec.get("config") or {},
+                (spec.get("dev_eui") or "").upper() or None,
+            )
+        return cls(
+            integration_agent_id=int(integration["agent_id"]),
+            integration_app_key=integration.get("app_key", "digital_matter_integration_1"),
+            integration_config=integration.get("config") or {},
+            agents=agents,
+            api_url=data.get("api_url", DEFAULT_API_URL),
+            token=data.get("token") or os.environ.get("DOOVER_API_TOKEN"),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "ServerSettings":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def to_dict(self) -> dict:
+        return {
+            "api_url": self.api_url,
+            "token": self.token,
+            "integration": {
+                "agent_id": self.integration_agent_id,
+                "app_key": self.integration_app_key,
+                "config": self.integration_config,
+            },
+            "agents": {
+                str(a.agent_id): {"app": a.app, "app_key": a.app_key, "config": a.config, "dev_eui": a.dev_eui}
+                for a in self.agents.values()
+            },
+        }
+
+
+def _load_app(name: str):
+    module_name, attr = PROCESSOR_APPS[name].split(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+class _DispatchingApi:
+    """The integration's API client, handing forwarded records to local processors."""
+
+    def __init__(self, api, host: "AppHost"):
+        self._api = api
+        self._host = host
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+    async def create_message(self, channel_name, data, **kwargs):
+        message = await self._api.create_message(channel_name, data, **kwargs)
+        agent_id = kwargs.get("agent_id")
+        if channel_name == "on_dm_event" and agent_id in self._host.settings.agents:
+            self._host.dispatch(agent_id, channel_name, data, getattr(message, "id", 0))
+        return message
+
+
+class AppHost:
+    def __init__(self, settings: ServerSettings):
+        self.settings = settings
+        self.integration = None
+        self._tags_loaded_at = float("-inf")
+        self._tags_lock = asyncio.Lock()
+        self._processors: dict[int, Any] = {}
+        self._agent_locks: dict[int, asyncio.Lock] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._dev_euis = {a.dev_eui: a.agent_id for a in settings.agents.values() if a.dev_eui}
+        self._scheduler: asyncio.Task | None = None
+
+    def _client(self, agent_id: int) -> PooledDataClient:
+        api = PooledDataClient(self.settings.api_url)
+        if self.settings.token:
+            api.set_token(self.settings.token)
+        api.agent_id = agent_id
+        api.lookup_ip = False
+        return api
+
+    async def start(self, schedule: bool = True):
+        from integration.application import DigitalMatterIntegration
+
+        api = self._client(self.settings.integration_agent_id)
+        await api.setup()
+        app = DigitalMatterIntegration()
+        app.api = _DispatchingApi(api, self)
+        app.agent_id = self.settings.integration_agent_id
+        app.app_key = api.app_key = self.settings.integration_app_key
+        app.config._inject_deployment_config({**_INGESTION_DEFAULTS, **self.settings.integration_config})
+        self.integration = app
+        await self._refresh_tags(force=True)
+        if schedule:
+            self._scheduler = asyncio.create_task(self._run_schedule())
+
+    async def close(self):
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+        await self.settle()
+        if self.integration is not None:
+            await self.integration.on_schedule(None)  # flush what's pending
+            await self.integration.api.close()
+
+    async def _refresh_tags(self, force: bool = False):
+        if not force and time.monotonic() - self._tags_loaded_at < TAG_REFRESH_S:
+            return
+        async with self._tags_lock:
+            if not force and time.monotonic() - self._tags_loaded_at < TAG_REFRESH_S:
+                return
+            app = self.integration
+            aggregate = await app.api.fetch_channel_aggregate("tag_values")
+            app.tag_manager = TagsManagerProcessor(app.app_key, app.api, app.agent_id, aggregate.data or {})
+            self._tags_loaded_at = time.monotonic()
+
+    async def _run_schedule(self):
+        while True:
+            await asyncio.sleep(SCHEDULE_S)
+            try:
+                await self.integration.on_schedule(None)
+            except Exception as e:
+                log.exception("scheduled run failed", error=e)
+
+    async def handle_oem(self, body: bytes, invocation_url: str | None = None) -> bool:
+        """Process one OEM Server POST body. Returns False if it was rejected."""
+        await self._refresh_tags()
+        # a shallow copy per request: shares config, client and tags, but
+        # not the per-upload state the handler keeps on the instance
+        app = copy.copy(self.integration)
+        event = IngestionEndpointEvent(
+            0,
+            app.agent_id,
+            0,
+            base64.b64encode(body).decode(),
+            parser=app.parse_ingestion_event_payload,
+            invocation_url=invocation_url,
+        )
+        if event.payload is None:
+            return False
+        await app.on_ingestion_endpoint(event)
+        return True
+
+    async def handle_tts(self, data: dict) -> bool:
+        """Process one TTS uplink webhook. Returns False for an unknown device."""
+        dev_eui = ((data.get("end_device_ids") or {}).get("dev_eui") or "").upper()
+        agent_id = self._dev_euis.get(dev_eui)
+        if agent_id is None:
+            log.warning("uplink from unknown device", dev_eui=dev_eui)
+            return False
+        self.dispatch(agent_id, "on_tts_event", data)
+        return True
+
+    def dispatch(self, agent_id: int, channel: str, data: dict, message_id: int = 0):
+        """Queue an event for the agent's processor; events per agent run in order."""
+        task = asyncio.create_task(self._run_processor(agent_id, channel, data, message_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def settle(self):
+        """Wait for every dispatched processor event to finish."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def _processor(self, agent_id: int):
+        app = self._processors.get(agent_id)
+        if app is not None:
+            return app
+        spec = self.settings.agents[agent_id]
+        app = _load_app(spec.app)()
+        api = app.api = self._client(agent_id)
+        await api.setup()
+        app.agent_id = agent_id
+        app.app_key = api.app_key = spec.app_key
+        app.config._inject_deployment_config(spec.config)
+        aggregate = await api.fetch_channel_aggregate("tag_values")
+        app.tag_manager = TagsManagerProcessor(spec.app_key, api, agent_id, aggregate.data or {})
+        app.tags = app.tags_cls(spec.app_key, app.tag_manager, app.config)
+        app.connection_config = None
+        await app.tags.setup()
+        self._processors[agent_id] = app
+        return app
+
+    async def _run_processor(self, agent_id: int, channel: str, data: dict, message_id: int):
+        lock = self._agent_locks.setdefault(agent_id, asyncio.Lock())
+        async with lock:
+            try:
+                app = await self._processor(agent_id)
+                app.api._invoking_channel_name = channel
+                event = MessageCreateEvent(
+                    ChannelID(agent_id, channel),
+                    Message(message_id, 0, ChannelID(agent_id, channel), data, []),
+                )
+                await app.on_message_create(event)
+                await app.tag_manager.commit_tags()
+            except Exception as e:
+                log.exception("processor event failed", agent_id=agent_id, channel=channel, error=e)
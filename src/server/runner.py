@@ -0,0 +1,121 @@
+"""Process management for the long-running server.
+
+``workers=1`` serves the worker app straight on the public port. With more,
+each worker runs in its own process (spawned, so nothing is shared but the
+settings) behind a Unix socket, and the frontend shards requests across
+them. Each worker gets its own publish spool directory. The access policy is
+enforced by whichever app owns the public port.
+"""
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+
+from aiohttp import web
+
+from dm_common import logs
+from dm_common.writes import close_shared_session
+
+from .app import AccessPolicy, make_frontend_app, make_worker_app
+from .fake_api import FakeDataApi
+from .host import AppHost, ServerSettings
+
+log = logs.get_logger(__name__)
+
+WORKER_START_TIMEOUT_S = 30.0
+
+
+async def _serve_until_stopped(runner: web.AppRunner, site_factory):
+    await runner.setup()
+    await site_factory(runner).start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await close_shared_session()
+
+
+async def _run_worker(
+    settings: dict, socket_path: str | None, port: int | None, host: str, access: AccessPolicy | None = None
+):
+    app_host = AppHost(ServerSettings.from_dict(settings))
+    await app_host.start()
+    runner = web.AppRunner(
+        make_worker_app(app_host, access, behind_frontend=socket_path is not None), access_log=None
+    )
+    if socket_path:
+        await _serve_until_stopped(runner, lambda r: web.UnixSite(r, socket_path))
+    else:
+        await _serve_until_stopped(runner, lambda r: web.TCPSite(r, host, port))
+
+
+def _worker_main(settings: dict, socket_path: str, index: int):
+    from dm_common import spool
+
+    spool.SPOOL_DIR = os.path.join(spool.SPOOL_DIR, f"worker-{index}")
+    asyncio.run(_run_worker(settings, socket_path, None, ""))
+
+
+async def _serve(
+    settings: ServerSettings, host: str, port: int, workers: int, fake_api: bool, access: AccessPolicy
+):
+    fake_runner = None
+    if fake_api:
+        fake_runner = web.AppRunner(FakeDataApi().app(), access_log=None)
+        await fake_runner.setup()
+        site = web.TCPSite(fake_runner, "127.0.0.1", 0)
+        await site.start()
+        settings.api_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        settings.token = settings.token or "local"
+        log.info("fake Doover API", url=settings.api_url)
+
+    try:
+        if workers <= 1:
+            await _run_worker(settings.to_dict(), None, port, host, access)
+            return
+
+        with tempfile.TemporaryDirectory(prefix="dm-server-") as tmp:
+            sockets = [os.path.join(tmp, f"worker-{i}.sock") for i in range(workers)]
+            ctx = multiprocessing.get_context("spawn")
+            procs = [
+                ctx.Process(target=_worker_main, args=(settings.to_dict(), path, i), daemon=True)
+                for i, path in enumerate(sockets)
+            ]
+            for proc in procs:
+                proc.start()
+            try:
+                deadline = time.monotonic() + WORKER_START_TIMEOUT_S
+                while not all(os.path.exists(p) for p in sockets):
+                    if time.monotonic() > deadline or not all(p.is_alive() for p in procs):
+                        raise RuntimeError("workers failed to start")
+                    await asyncio.sleep(0.05)
+                log.info("serving", host=host, port=port, workers=workers)
+                runner = web.AppRunner(make_frontend_app(sockets, access), access_log=None)
+                await _serve_until_stopped(runner, lambda r: web.TCPSite(r, host, port))
+            finally:
+                for proc in procs:
+                    proc.terminate()
+                for proc in procs:
+                    proc.join(5)
+    finally:
+        if fake_runner is not None:
+            await fake_runner.cleanup()
+
+
+def serve(
+    settings: ServerSettings,
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    workers: int = 1,
+    fake_api: bool = False,
+    access: AccessPolicy | None = None,
+):
+    asyncio.run(_serve(settings, host, port, workers, fake_api, access or AccessPolicy()))
@@ -0,0 +1,84 @@
+"""
+Shared fixtures.
+"""
+import pytest
+import pytest_asyncio
+
+from .fakes import FakeApi, FakeTagManager, configure_integration, setup_processor
+
+
+@pytest.fixture(autouse=True)
+def isolated_spool(tmp_path, monkeypatch):
+    """Keep each test's publish spool (and its backoff) to itself."""
+    from dm_common import spool
+
+    monkeypatch.setattr(spool, "SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(spool, "_backoff", {})
+    monkeypatch.setattr(spool, "_attempts", {})
+    return tmp_path / "spool"
+
+
+@pytest.fixture(autouse=True)
+def isolated_fleet(monkeypatch):
+    """Start each test with no fleet status pending and no recent flush."""
+    from integration import fleet
+
+    monkeypatch.setattr(fleet, "_pending", {})
+    monkeypatch.setattr(fleet, "_last_flush", float("-inf"))
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(monkeypatch):
+    """Start each test with no warm device state cached."""
+    from dm_common import state
+
+    monkeypatch.setattr(state, "_cache", {})
+
+
+@pytest.fixture(autouse=True)
+def isolated_archive(monkeypatch):
+    """Start each test with no payloads remembered as already processed."""
+    from collections import OrderedDict
+
+    from integration import archive
+
+    monkeypatch.setattr(archive, "_seen", OrderedDict())
+
+
+@pytest.fixture
+def fake_api():
+    return FakeApi()
+
+
+@pytest.fixture
+def integration(fake_api):
+    """A DigitalMatterIntegration wired to fakes, mapping serial 1001 -> agent 42."""
+    from integration.application import DigitalMatterIntegration
+
+    app = DigitalMatterIntegration()
+    configure_integration(app)
+    app.api = fake_api
+    app.tag_manager = FakeTagManager(
+        {"digital_matter_processor_1": {"serial_number_lookup": {"1001": 42}}}
+    )
+    return app
+
+
+@pytest_asyncio.fixture
+async def processor(fake_api):
+    """A DigitalMatterProcessor wired to fakes as agent 42."""
+    from processor.application import DigitalMatterProcessor
+
+    return await setup_processor(
+        DigitalMatterProcessor(),
+        fake_api,
+        {"dv_proc_subscription": ["on_dm_event"], "dv_serial_number": "1001"},
+    )
+
+
+@pytest_asyncio.fixture
+async def g62(fake_api):
+    """A G62Processor wired to fakes as agent 42."""
+    from g62.application import G62Processor
+
+    return await setup_processor(G62Processor(), fake_api, {})
@@ -0,0 +1,151 @@
+"""
+Fakes for exercising the applications without the Doover API.
+"""
+import base64
+import copy
+import itertools
+import json
+
+from pydoover.models import Aggregate, ChannelID, IngestionEndpointEvent, Message, MessageCreateEvent
+
+
+def _merge(target, update):
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+class FakeApi:
+    """Records every outbound API call instead of making it.
+
+    Aggregates are kept (and PATCH-merged) per ``(agent_id, channel)`` so
+    code that reads back what it wrote sees the same thing it would live.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.aggregates = {}
+        self._ids = itertools.count(1)
+
+    def _record(self, method, *args, **kwargs):
+        self.calls.append((method, args, kwargs))
+
+    def calls_to(self, method, channel=None):
+        return [
+            c for c in self.calls
+            if c[0] == method and (channel is None or c[1][0] == channel)
+        ]
+
+    async def create_message(self, channel_name, data, **kwargs):
+        self._record("create_message", channel_name, data, **kwargs)
+        return Message(next(self._ids), 0, None, data, [])
+
+    async def update_channel_aggregate(self, channel_name, data, **kwargs):
+        self._record("update_channel_aggregate", channel_name, data, **kwargs)
+        key = (kwargs.get("agent_id"), channel_name)
+        if kwargs.get("replace_data"):
+            self.aggregates[key] = copy.deepcopy(data)
+        else:
+            current = self.aggregates.setdefault(key, {})
+            for path in kwargs.get("replace_keys") or []:
+                parent = current
+                *parents, leaf = path.split(".")
+                for part in parents:
+                    parent = parent.setdefault(part, {})
+                parent.pop(leaf, None)
+            _merge(current, data)
+        return Aggregate(copy.deepcopy(self.aggregates[key]), [], None)
+
+    async def fetch_channel_aggregate(self, channel_name, agent_id=None, **kwargs):
+        self._record("fetch_channel_aggregate", channel_name, agent_id=agent_id)
+        data = self.aggregates.get((agent_id, channel_name), {})
+        return Aggregate(copy.deepcopy(data), [], None)
+
+    async def ping_connection_at(self, online_at, **kwargs):
+        self._record("ping_connection_at", online_at, **kwargs)
+
+    async def update_connection_config(self, config, **kwargs):
+        self._record("update_connection_config", config, **kwargs)
+
+
+class FakeTagManager:
+    def __init__(self, tag_values=None):
+        self._tag_values = tag_values or {}
+
+    def get_tag(self, key, default=None, app_key=None, raise_key_error=False):
+        try:
+            return self._tag_values[app_key][key]
+        except KeyError:
+            if raise_key_error:
+                raise
+            return default
+
+
+async def setup_processor(app, api, deployment_config, agent_id=42, tag_values=None):
+    """Wire a device processor to ``api`` the way ``Application._setup`` would."""
+    from pydoover.tags.manager import TagsManagerProcessor
+
+    app.config._inject_deployment_config(deployment_config)
+    app.api = api
+    app.agent_id = agent_id
+    app.app_key = f"{type(app).__name__.lower()}_1"
+    app.tag_manager = TagsManagerProcessor(app.app_key, api, agent_id, tag_values or {})
+    app.tags = app.tags_cls(app.app_key, app.tag_manager, app.config)
+    app.connection_config = None
+    await app.tags.setup()
+    return app
+
+
+def message_event(channel, data, agent_id=42):
+    return MessageCreateEvent(ChannelID(agent_id, channel), Message(1, 0, ChannelID(agent_id, channel), data, []))
+
+
+def configure_integration(app, **options):
+    """Load the integration's deployment config, with optional overrides."""
+    app.config._inject_deployment_config({
+        "dv_proc_ingestion": {"cidr_ranges": []},
+        "dv_proc_extended_permissions": {"devices": [], "groups": [], "apps_installed": []},
+        **options,
+    })
+
+
+def encode_payload(payload) -> str:
+    """Wrap a JSON body the way Doover Data hands it to the ingestion handler."""
+    return base64.b64encode(json.dumps(payload).encode()).decode()
+
+
+def ingestion_event(payload, invocation_url=None, parser=None):
+    """Build an ingestion event.
+
+    With no ``parser`` the payload is passed through as the already-decoded
+    body; pass the app's ``parse_ingestion_event_payload`` (and an
+    :func:`encode_payload` string) to exercise parsing too.
+    """
+    return IngestionEndpointEvent(
+        1, 1, 1, payload, parser=parser or (lambda p: p), invocation_url=invocation_url
+    )
+
+
+def oem_event(app, payload, invocation_url=None):
+    """An ingestion event carrying ``payload`` as the OEM Server would POST it,
+    parsed by ``app`` exactly as it is live."""
+    return ingestion_event(
+        encode_payload(payload),
+        invocation_url=invocation_url,
+        parser=app.parse_ingestion_event_payload,
+    )
+
+
+class FakeNetworkServer:
+    """Stands in for the LoRaWAN network server's downlink queue."""
+
+    def __init__(self):
+        self.pushed = []
+        self.fail = False
+
+    async def push(self, application_id, device_id, port, payload):
+        if self.fail:
+            raise ConnectionError("network server unavailable")
+        self.pushed.append((application_id, device_id, port, payload))
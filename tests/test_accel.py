@@ -0,0 +1,115 @@
+"""
+Tests for accelerometer trace decoding and analysis.
+"""
+import numpy as np
+import pytest
+
+from dm_common import accel
+from dm_common.decoders.oem import parse_dm_record
+
+from .fakes import oem_event
+
+RATE_HZ = 400
+SCALE_MG = 4  # mg per count
+
+
+def _trace_field(samples_g):
+    counts = np.round(np.asarray(samples_g) * 1000 / SCALE_MG).astype(int)
+    return {"FType": 15, "Rate": RATE_HZ, "Scale": SCALE_MG, "Samples": counts.tolist()}
+
+
+def _decode(samples_g):
+    field = _trace_field(samples_g)
+    return accel.decode_trace(field["Samples"], field["Rate"], field["Scale"])
+
+
+def _pulse(n, start, length, vector_g, gravity=(0.0, 0.0, 1.0)):
+    """A resting trace with a constant-acceleration pulse."""
+    samples = np.tile(np.asarray(gravity), (n, 1))
+    samples[start:start + length] += vector_g
+    return samples
+
+
+def test_decode_trace_record():
+    field = _trace_field(_pulse(100, 50, 10, (-1.0, 0, 0)))
+    record = {"Reason": 23, "Fields": [{"FType": 2, "DIn": 1}, field]}
+
+    parsed = parse_dm_record(record)
+    trace = parsed["accel_trace"]
+
+    assert isinstance(trace, accel.AccelTrace)
+    assert len(trace) == 100
+    assert trace.rate_hz == RATE_HZ
+    assert trace.g[0] == pytest.approx([0, 0, 1.0])
+    assert parsed["ignition_on"] is True
+
+
+def test_split_trace_fields_are_joined():
+    samples = _pulse(200, 100, 20, (0, 1.0, 0))
+    record = {"Reason": 24, "Fields": [_trace_field(samples[:120]), _trace_field(samples[120:])]}
+
+    trace = parse_dm_record(record)["accel_trace"]
+    assert len(trace) == 200
+
+
+def test_records_without_trace_do_not_carry_one():
+    assert "accel_trace" not in parse_dm_record({"Reason": 11, "Fields": []})
+
+
+def test_trace_bytes_round_trip():
+    trace = parse_dm_record({"Fields": [_trace_field(_pulse(500, 100, 50, (3, 0, 0)))]})["accel_trace"]
+    restored = accel.AccelTrace.from_bytes(trace.to_bytes(), trace.rate_hz, trace.scale_mg)
+    np.testing.assert_array_equal(restored.counts, trace.counts)
+
+
+def test_analyse_harsh_brake():
+    # 0.5 g of braking for 0.5 s -> delta-v of 0.5 * 9.80665 * 0.5 m/s
+    samples = _pulse(1000, 200, 200, (-0.5, 0, 0))
+    summary = accel.analyse(_decode(samples))
+
+    assert summary["classification"] == "harsh_brake"
+    assert summary["peak_g"] == pytest.approx(0.5, abs=0.01)
+    assert summary["delta_v_kmh"] == pytest.approx(0.5 * 9.80665 * 0.5 * 3.6, rel=0.02)
+    assert summary["impact_duration_ms"] == pytest.approx(500, abs=5)
+    assert summary["peak_at_ms"] == pytest.approx(500, abs=5)
+    assert summary["samples"] == 1000
+
+
+@pytest.mark.parametrize(
+    "vector, expected",
+    [
+        ((0.6, 0, 0), "harsh_acceleration"),
+        ((0, -0.8, 0), "harsh_cornering"),
+        ((0, 0, 1.0), "vertical_shock"),
+        ((-4.0, 1.0, 0), "impact"),
+        ((-9.0, 0, 0), "severe_impact"),
+        ((0.1, 0, 0), "none"),
+    ],
+)
+def test_analyse_classification(vector, expected):
+    samples = _pulse(400, 100, 20, vector)
+    assert accel.analyse(_decode(samples))["classification"] == expected
+
+
+@pytest.mark.asyncio
+async def test_integration_stores_trace_out_of_band(integration, fake_api):
+    samples = _pulse(2000, 400, 40, (-5.0, 0, 0))
+    payload = {
+        "SerNo": 1001,
+        "Records": [{"Reason": 23, "SeqNo": 7, "DateUTC": "2024-01-01T00:00:00Z",
+                     "Fields": [_trace_field(samples)]}],
+    }
+
+    await integration.on_ingestion_endpoint(oem_event(integration, payload))
+
+    (trace_call,) = fake_api.calls_to("create_message", "dm_accel_traces")
+    _, (_, data), kwargs = trace_call
+    assert data["classification"] == "impact"
+    assert data["sequence_number"] == 7
+    (file,) = kwargs["files"]
+    restored = accel.AccelTrace.from_bytes(file.data, data["sample_rate_hz"], data["scale_mg"])
+    assert len(restored) == 2000
+
+    for _, (_, record), _ in fake_api.calls_to("create_message", "on_dm_event"):
+        assert "accel_trace" not in record
+        assert record["accel_summary"]["classification"] == "impact"
@@ -0,0 +1,142 @@
+"""
+Tests for raw payload archival.
+"""
+import json
+
+import pytest
+
+from integration import archive
+from integration.archive import RawArchive
+from dm_common.decoders.oem import decode_payload, parse_dm_record
+
+from .fakes import FakeApi, configure_integration, oem_event
+
+
+def _payload(serial=1001, n=20, day=1):
+    return {
+        "SerNo": serial,
+        "IMEI": "352000000000001",
+        "ICCID": "8961000000000000001",
+        "ProdId": 97,
+        "FW": "97.2.1.11",
+        "Records": [
+            {
+                "SeqNo": i,
+                "Reason": 11,
+                "DateUTC": f"2024-01-{day:02d} {i // 60:02d}:{i % 60:02d}:00",
+                "Fields": [
+                    {"GpsUTC": "2024-01-01 00:00:00", "Lat": -33.8688 + i * 1e-4, "Long": 151.2093,
+                     "Alt": 50, "Spd": 1500, "SpdAcc": 2, "Head": 90, "PDOP": 12, "PosAcc": 5,
+                     "GpsStat": 7, "FType": 0},
+                    {"DIn": 1, "DOut": 0, "DevStat": 0, "FType": 2},
+                    {"AnalogueData": {"1": 4100, "2": 1350, "3": 2500, "4": 20, "5": 12340}, "FType": 6},
+                ],
+            }
+            for i in range(n)
+        ],
+    }
+
+
+async def _store(store, serial, payload):
+    raw = json.dumps(payload).encode()
+    stored = await store.store(serial, raw, decode_payload(raw).Records)
+    await store.commit()
+    return stored
+
+
+@pytest.mark.asyncio
+async def test_retry_is_archived_once(integration, fake_api):
+    for _ in range(3):
+        await integration.on_ingestion_endpoint(oem_event(integration, _payload()))
+
+    assert len(fake_api.calls_to("create_message", "dm_raw")) == 1
+    # a retry's records aren't published again either
+    assert len(fake_api.calls_to("create_message", "on_dm_event")) == 20
+
+
+@pytest.mark.asyncio
+async def test_retry_detected_from_index_on_cold_container():
+    api = FakeApi()
+    payload = _payload()
+
+    assert await _store(RawArchive(api), 1001, payload) is True
+    archive._seen.clear()  # new container
+    assert await _store(RawArchive(api), 1001, payload) is False
+    assert len(api.calls_to("create_message", "dm_raw")) == 1
+
+    # only this serial's index is read
+    (fetch,) = api.calls_to("fetch_channel_aggregate")[-1:]
+    assert fetch[1][0] == archive.index_channel(1001)
+
+
+@pytest.mark.asyncio
+async def test_upload_not_indexed_until_published(integration, fake_api, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise RuntimeError("publish failed")
+
+    monkeypatch.setattr(integration, "_publish_records", fail)
+    with pytest.raises(RuntimeError):
+        await integration.on_ingestion_endpoint(oem_event(integration, _payload()))
+    monkeypatch.undo()
+
+    # the redelivered body is processed rather than dropped as a retry
+    await integration.on_ingestion_endpoint(oem_event(integration, _payload()))
+    assert len(fake_api.calls_to("create_message", "on_dm_event")) == 20
+
+
+@pytest.mark.asyncio
+async def test_archive_round_trip_and_size():
+    api = FakeApi()
+    payload = _payload(n=50)
+    raw = json.dumps(payload).encode()
+
+    await RawArchive(api).store(1001, raw, decode_payload(raw).Records)
+
+    (call,) = api.calls_to("create_message", "dm_raw")
+    _, (_, meta), kwargs = call
+    (file,) = kwargs["files"]
+    assert archive.decompress(meta["codec"], file.data) == raw
+
+    parsed_volume = sum(len(json.dumps(parse_dm_record(r))) for r in payload["Records"])
+    assert meta["compressed_size"] < parsed_volume / 4
+
+
+@pytest.mark.asyncio
+async def test_index_lookup_by_date_range():
+    api = FakeApi()
+    for day in (1, 2, 3):
+        payload = _payload(day=day, n=5)
+        await _store(RawArchive(api), 1001, payload)
+    other = _payload(serial=2002, day=2, n=5)
+    await _store(RawArchive(api), 2002, other)
+
+    store = RawArchive(api)
+    assert len(await store.lookup(1001)) == 3
+    assert len(await store.lookup(1001, start="2024-01-02", end="2024-01-02 23:59:59")) == 1
+    assert len(await store.lookup(1001, start="2024-01-02")) == 2
+    assert len(await store.lookup(2002)) == 1
+
+
+@pytest.mark.asyncio
+async def test_index_is_bounded(monkeypatch):
+    monkeypatch.setattr(archive, "INDEX_ENTRIES_PER_SERIAL", 3)
+    api = FakeApi()
+    store = RawArchive(api)
+    for day in range(1, 6):
+        payload = _payload(day=day, n=1)
+        await _store(store, 1001, payload)
+
+    index = api.aggregates[(None, archive.index_channel(1001))]
+    assert sorted(v[0] for v in index.values()) == [
+        "2024-01-03 00:00:00", "2024-01-04 00:00:00", "2024-01-05 00:00:00",
+    ]
+
+
+def test_tenant_dictionary_from_config(integration, caplog):
+    configure_integration(integration, archive_dictionaries="acme=ZGljdA==, bad=!!, nosep")
+
+    acme = integration._archive(integration._route("https://x/ingest?tenant=acme"))
+    assert acme.dictionary == b"dict"
+    assert integration._archive(integration._route("https://x/ingest?tenant=other")).dictionary is None
+    assert integration._archive(integration._route("https://x/ingest")).dictionary is None
+    assert caplog.text.count("skipping archive dictionary") == 2
@@ -0,0 +1,80 @@
+"""
+Conformance tests for the decoder registry.
+
+Every registered device model must ship a golden vector file in
+``tests/vectors/<model>.json``. LoRaWAN vectors are ``{port, payload (hex),
+expected}``; OEM vectors are ``{record, expected}``. ``expected: null`` means
+the frame must be rejected.
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from dm_common import decoders
+
+VECTORS_DIR = Path(__file__).parent / "vectors"
+
+
+def _load_vectors(model):
+    return json.loads((VECTORS_DIR / f"{model}.json").read_text())
+
+
+def _assert_matches(actual, expected):
+    if expected is None:
+        assert actual is None
+        return
+    assert actual is not None
+    assert set(actual) == set(expected)
+    for key, value in expected.items():
+        if isinstance(value, float):
+            assert actual[key] == pytest.approx(value)
+        else:
+            assert actual[key] == value
+
+
+@pytest.mark.parametrize("model", decoders.models())
+def test_every_model_has_vectors(model):
+    assert (VECTORS_DIR / f"{model}.json").exists()
+    assert _load_vectors(model)
+
+
+@pytest.mark.parametrize("model", decoders.models())
+def test_golden_vectors(model):
+    entry = decoders.get_entry(model)
+    for case in _load_vectors(model):
+        if entry.frames is None:
+            actual = entry.load()(case["record"])
+        else:
+            actual = decoders.decode(model, bytes.fromhex(case["payload"]), case["port"])
+        _assert_matches(actual, case["expected"])
+
+
+def test_unknown_frames_rejected_before_import():
+    assert decoders.get_decoder("g62", port=9, length=11) is None
+    assert decoders.get_decoder("g62", port=2, length=10) is None
+    assert decoders.get_decoder("no-such-model") is None
+
+
+def test_decoders_are_lazily_imported():
+    code = (
+        "import sys\n"
+        "from dm_common import decoders\n"
+        "assert 'dm_common.decoders.oyster3' not in sys.modules\n"
+        "assert 'g62.decoder' not in sys.modules\n"
+        "decoders.decode('g62', bytes(3), 5)\n"
+        "assert 'g62.decoder' in sys.modules\n"
+        "assert 'dm_common.decoders.oyster3' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_register_custom_model():
+    entry = decoders.register("test-model", "g62.decoder:decode", frames={5: (3,)})
+    try:
+        assert decoders.decode("TEST-MODEL", bytes([0x81, 1, 2]), 5)["sequence"] == 1
+        assert entry.accepts(5, 4) is False
+    finally:
+        decoders._REGISTRY.pop("test-model")
@@ -0,0 +1,168 @@
+"""
+Tests for GPS-derived distance: the batched haversine, jitter filtering, the
+odometer carried in device state, and both processors' use of it.
+"""
+import subprocess
+import sys
+
+import pytest
+
+from dm_common import distance
+from dm_common.distance import STATE_KEY, Fix, GpsOdometer, haversine_km, measure, measure_track
+from dm_common.state import STATE_CHANNEL, DeviceState
+from dm_common.channels import DECODED_UPLINK_CHANNEL
+
+from .fakes import message_event
+
+M_PER_DEG_LAT = 111_195.0
+
+
+def _north(metres, t, accuracy=5.0, **kwargs):
+    return Fix(t, -33.0 + metres / M_PER_DEG_LAT, 151.0, accuracy, **kwargs)
+
+
+def test_haversine_matches_known_distances():
+    assert haversine_km(0, 0, 1, 0) == pytest.approx(111.195, abs=0.01)
+    # Sydney -> Melbourne
+    assert haversine_km(-33.8688, 151.2093, -37.8136, 144.9631) == pytest.approx(713.4, abs=1)
+    out = haversine_km([0, 0], [0, 0], [1, 0], [0, 1])
+    assert out.shape == (2,)
+
+
+def test_straight_track_is_measured_in_full():
+    fixes = [_north(100 * i, 10.0 * i) for i in range(11)]  # 1 km at 36 km/h
+    travel = measure(fixes)
+    assert travel.distance_km == pytest.approx(1.0, rel=1e-3)
+    assert travel.steps == 10
+    assert travel.speed_kmh == pytest.approx(36, rel=1e-3)
+    assert travel.anchor is fixes[-1]
+
+    # the same track as arrays
+    track = measure_track(*zip(*((f.t, f.lat, f.lng, f.accuracy_m) for f in fixes)))
+    assert track.distance_km == pytest.approx(travel.distance_km, rel=1e-12)
+    assert (track.anchor.t, track.anchor.lat) == (fixes[-1].t, fixes[-1].lat)
+
+
+@pytest.mark.parametrize("noise_m", [0, 3, 20])
+def test_scalar_and_vectorised_paths_agree(noise_m):
+    fixes = [_north(60 * i + (-1) ** i * noise_m, 5.0 * i, accuracy=[5, 80, None, 8][i % 4]) for i in range(80)]
+    small = Fix(0, 0, 0)
+    for n in (2, 5, distance.BATCH_MIN_FIXES - 1):
+        batch = fixes[:n]
+        scalar = measure(batch)
+        vector = measure_track(*zip(*((f.t, f.lat, f.lng, f.accuracy_m) for f in batch)))
+        assert scalar.distance_km == pytest.approx(vector.distance_km, rel=1e-12)
+        assert (scalar.steps, scalar.dropped) == (vector.steps, vector.dropped)
+        assert scalar.speed_kmh == pytest.approx(vector.speed_kmh, rel=1e-12)
+    assert measure([small]).anchor is small
+
+
+def test_single_fixes_dont_import_numpy():
+    code = (
+        "import sys; from dm_common import distance as d;"
+        "d.measure([d.Fix(0, -33, 151, 5)], d.Fix(-60, -33.01, 151, 5));"
+        "assert 'numpy' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_jitter_and_bad_fixes_are_not_travel():
+    # parked, wandering a few metres either way
+    parked = [_north(offset, 60.0 * i) for i, offset in enumerate([0, 3, -2, 4, -3, 1, 0, 2])]
+    travel = measure(parked)
+    assert travel.distance_km == 0
+    assert travel.speed_kmh == 0
+
+    # a fix with poor accuracy or PDOP is dropped rather than measured to
+    fixes = [_north(0, 0), _north(2000, 10, accuracy=80), _north(300, 20, pdop=90), _north(400, 30)]
+    travel = measure(fixes)
+    assert travel.dropped == 2
+    assert travel.distance_km == pytest.approx(0.4, rel=1e-3)
+
+    # a step implying 3600 km/h is a bad fix
+    assert measure([_north(0, 0), _north(10_000, 10)]).distance_km == 0
+
+
+def test_reported_speed_counts_small_steps():
+    # creeping along at walking pace: each step is within the jitter floor
+    fixes = [_north(5 * i, 5.0 * i, speed_kmh=4) for i in range(21)]
+    assert measure(fixes).distance_km == pytest.approx(0.1, rel=1e-3)
+    fixes = [_north(5 * i, 5.0 * i) for i in range(21)]
+    assert measure(fixes).distance_km == 0
+
+
+def test_odometer_joins_batches_and_rebases():
+    state = DeviceState()
+    odometer = GpsOdometer(state)
+    for i in range(6):
+        odometer.add(_north(100 * i, 10.0 * i))
+    odometer.update()
+    assert odometer.km == pytest.approx(0.5, rel=1e-3)
+
+    # the next invocation carries on from the last fix
+    odometer = GpsOdometer(state)
+    odometer.add(_north(500, 50))  # already measured
+    odometer.add(_north(700, 70))
+    odometer.update()
+    assert odometer.km == pytest.approx(0.7, rel=1e-3)
+
+    # the device's odometer wins, and travel after it is added on
+    odometer = GpsOdometer(state)
+    odometer.reconcile(1234.0)
+    odometer.add(_north(800, 80))
+    odometer.update()
+    assert odometer.km == pytest.approx(1234.1, rel=1e-6)
+    assert state[STATE_KEY]["fix"][0] == 80
+
+
+@pytest.mark.asyncio
+async def test_processor_tracks_gps_odometer(processor, fake_api):
+    def event(seq, minute, metres, **extra):
+        return message_event("on_dm_event", {
+            "serial_number": 1001,
+            "sequence_number": seq,
+            "device_time_utc": f"2024-01-01 00:{minute:02d}:00",
+            "position": {"lat": -33.0 + metres / M_PER_DEG_LAT, "long": 151.0},
+            "gps_accuracy_m": 5,
+            "pdop": 12,
+            **extra,
+        })
+
+    await processor.on_message_create(event(1, 0, 0))
+    await processor.on_message_create(event(2, 1, 1000))
+    assert processor.tags.gps_odometer_km.value == pytest.approx(1.0, abs=1e-3)
+    assert processor.tags.gps_speed_kmh.value == pytest.approx(60, abs=0.1)
+
+    # a late record doesn't move the odometer
+    await processor.on_message_create(event(3, 0, 5000))
+    assert processor.tags.gps_odometer_km.value == pytest.approx(1.0, abs=1e-3)
+
+    await processor.on_message_create(event(4, 2, 2000, odometer_km=500.0))
+    assert processor.tags.gps_odometer_km.value == 500.0
+    assert fake_api.aggregates[(None, STATE_CHANNEL)]["data"][STATE_KEY]["km"] == 500.0
+
+
+@pytest.mark.asyncio
+async def test_g62_measures_decoded_batch(g62, fake_api):
+    def part1(second, metres):
+        return {
+            "_type": "data_part_1",
+            "latitude": -33.0 + metres / M_PER_DEG_LAT,
+            "longitude": 151.0,
+            "speed_kmh": 36,
+            "received_at": f"2024-01-01T00:00:{second:02d}Z",
+        }
+
+    records = [
+        {"_type": "data_part_2", "gps_accuracy_m": 4, "received_at": "2024-01-01T00:00:00Z"},
+        part1(1, 0),
+        part1(11, 100),
+        part1(21, 200),
+        {"_type": "odometer", "runtime_s": 10, "odometer_km": 42.0, "received_at": "2024-01-01T00:00:22Z"},
+        part1(31, 300),
+    ]
+    await g62.on_message_create(message_event(DECODED_UPLINK_CHANNEL, {"dev_eui": "70B3D5E75E000001", "records": records}))
+
+    assert g62.tags.gps_odometer_km.value == pytest.approx(42.1, abs=1e-3)
+    assert g62.tags.gps_speed_kmh.value == pytest.approx(36, abs=0.1)
+    assert len(fake_api.calls_to("update_channel_aggregate", STATE_CHANNEL)) == 1
@@ -0,0 +1,176 @@
+"""
+Tests for the G62 downlink scheduler.
+"""
+import base64
+
+import pytest
+
+from g62 import downlink
+from g62.downlink import DownlinkScheduler, decode_frame, encode_frame, parse_parameters
+
+from .fakes import FakeNetworkServer, message_event
+
+DEVICE = {"application_id": "fleet", "device_id": "g62-0001"}
+
+
+def _frames(network):
+    return [decode_frame(payload) for *_, payload in network.pushed]
+
+
+def test_frame_round_trip():
+    frame = encode_frame(130, {7: 1, 3: 0xFFFFFFFF})
+    assert len(frame) == 11
+    assert decode_frame(frame) == (2, {3: 0xFFFFFFFF, 7: 1})
+
+
+@pytest.mark.parametrize("raw", [{"256": 1}, {"1": -1}, {"1": 2**32}, {"1": 1.5}, {"x": 1}])
+def test_invalid_parameters(raw):
+    with pytest.raises(ValueError):
+        parse_parameters(raw)
+
+
+@pytest.mark.asyncio
+async def test_changes_are_coalesced_into_fewest_frames():
+    network = FakeNetworkServer()
+    scheduler = DownlinkScheduler({"device": DEVICE}, max_payload=11)
+    scheduler.enqueue({1: 10, 2: 20})
+    scheduler.enqueue({1: 11, 3: 30})
+
+    assert await scheduler.service(network, now=0) == 2
+    assert _frames(network) == [(0, {1: 11, 2: 20}), (1, {3: 30})]
+    assert network.pushed[0][:3] == ("fleet", "g62-0001", downlink.DOWNLINK_PORT)
+    assert scheduler.pending == 0 and scheduler.inflight == 2
+
+
+@pytest.mark.asyncio
+async def test_acks_clear_frames_and_rejections_count_as_failed():
+    network = FakeNetworkServer()
+    scheduler = DownlinkScheduler({"device": DEVICE}, max_payload=11)
+    scheduler.enqueue({1: 1, 2: 2, 3: 3})
+    await scheduler.service(network, now=0)
+
+    assert scheduler.ack(0, accepted=True)
+    assert scheduler.ack(1, accepted=False)
+    assert not scheduler.ack(99, accepted=True)
+    assert scheduler.idle
+    assert scheduler.state["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_unacked_frames_are_retried_with_backoff_then_dropped():
+    network = FakeNetworkServer()
+    scheduler = DownlinkScheduler({"device": DEVICE})
+    scheduler.enqueue({5: 60})
+    await scheduler.service(network, now=0)
+
+    assert await scheduler.service(network, now=downlink.RETRY_BASE_S - 1) == 0
+    assert await scheduler.service(network, now=downlink.RETRY_BASE_S) == 1
+    assert _frames(network)[-1] == (1, {5: 60})  # a resend gets a fresh sequence
+    assert scheduler.state["inflight"][0]["retry_at"] == 3 * downlink.RETRY_BASE_S
+
+    now = downlink.RETRY_BASE_S
+    while scheduler.inflight:
+        now = scheduler.state["inflight"][0]["retry_at"]
+        await scheduler.service(network, now=now)
+    assert len(network.pushed) == downlink.MAX_ATTEMPTS
+    assert scheduler.state["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_resend_carries_newer_changes():
+    network = FakeNetworkServer()
+    scheduler = DownlinkScheduler({"device": DEVICE})
+    scheduler.enqueue({1: 1, 2: 2})
+    await scheduler.service(network, now=0)
+    scheduler.enqueue({2: 22, 3: 3})
+
+    # not due yet: the new values go out on their own and leave the old frame
+    # holding only what they don't supersede
+    await scheduler.service(network, now=1)
+    assert _frames(network)[-1] == (1, {2: 22, 3: 3})
+    assert scheduler.state["inflight"][0]["params"] == {"1": 1}
+
+    scheduler.enqueue({4: 4})
+    await scheduler.service(network, now=downlink.RETRY_BASE_S)
+    assert _frames(network)[-1] == (2, {1: 1, 4: 4})
+
+
+@pytest.mark.asyncio
+async def test_change_joining_a_resend_gets_its_own_attempts():
+    network = FakeNetworkServer()
+    scheduler = DownlinkScheduler({"device": DEVICE})
+    scheduler.enqueue({1: 1})
+    await scheduler.service(network, now=0)
+
+    for _ in range(downlink.MAX_ATTEMPTS - 2):
+        await scheduler.service(network, now=scheduler.state["inflight"][0]["retry_at"])
+
+    # parameter 1's last send carries a new change
+    scheduler.enqueue({2: 2})
+    await scheduler.service(network, now=scheduler.state["inflight"][0]["retry_at"])
+    assert len(network.pushed) == downlink.MAX_ATTEMPTS
+    assert _frames(network)[-1][1] == {1: 1, 2: 2}
+
+    # parameter 1 is given up on; parameter 2 has been sent once and goes again
+    await scheduler.service(network, now=scheduler.state["inflight"][0]["retry_at"])
+    assert scheduler.state["failed"] == 1
+    assert _frames(network)[-1][1] == {2: 2}
+    assert scheduler.state["inflight"][0]["tries"] == {"2": 2}
+
+
+@pytest.mark.asyncio
+async def test_network_failure_keeps_changes_queued():
+    network = FakeNetworkServer()
+    network.fail = True
+    scheduler = DownlinkScheduler({"device": DEVICE})
+    scheduler.enqueue({1: 1})
+    assert await scheduler.service(network, now=0) == 0
+    assert scheduler.pending == 1 and scheduler.inflight == 0
+
+
+def test_sequence_numbers_wrap_and_skip_inflight():
+    scheduler = DownlinkScheduler({"next_seq": 127, "inflight": [{"seq": 0, "params": {"1": 1}}]})
+    assert [scheduler._next_sequence() for _ in range(2)] == [127, 1]
+
+
+def _uplink(port, hex_payload):
+    return {
+        "end_device_ids": {
+            "dev_eui": "70B3D5E75E000001",
+            "device_id": "g62-0001",
+            "application_ids": {"application_id": "fleet"},
+        },
+        "uplink_message": {"f_port": port, "frm_payload": base64.b64encode(bytes.fromhex(hex_payload)).decode()},
+    }
+
+
+@pytest.mark.asyncio
+async def test_processor_queues_sends_and_matches_acks(g62, fake_api, monkeypatch):
+    network = FakeNetworkServer()
+
+    async def network_server():
+        return network
+
+    monkeypatch.setattr(g62, "_network_server", network_server)
+
+    # no device ids yet, so the change waits for the next uplink
+    await g62.on_message_create(message_event("dm_downlink", {"parameters": {"12": 300, "13": 1}}))
+    assert network.pushed == []
+    assert g62.tags.downlink_pending.value == 2
+
+    await g62.on_message_create(message_event("on_tts_event", _uplink(2, "0d08d0eb43b5205a2d3ec8")))
+    assert _frames(network) == [(0, {12: 300, 13: 1})]
+    assert g62.tags.downlink_pending.value == 0
+    assert g62.tags.downlink_inflight.value == 1
+    assert g62.tags.downlink_last_seq.value == 0
+
+    # port 5 ack: sequence 0, accepted, firmware 1.3
+    await g62.on_message_create(message_event("on_tts_event", _uplink(5, "800103")))
+    assert g62.tags.downlink_inflight.value == 0
+    assert g62.tags.downlink_failed.value == 0
+    assert fake_api.aggregates[(None, downlink.DOWNLINK_CHANNEL)]["inflight"] == []
+
+    # idle queue: ordinary uplinks don't read it
+    fake_api.calls.clear()
+    await g62.on_message_create(message_event("on_tts_event", _uplink(2, "0d08d0eb43b5205a2d3ec8")))
+    assert not fake_api.calls_to("fetch_channel_aggregate")
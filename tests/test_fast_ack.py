@@ -0,0 +1,259 @@
+"""
+Tests for fast-ack ingestion and the upload queue consumer.
+"""
+import json
+import os
+import time
+
+import pytest
+
+from integration import upload_queue
+from integration.application import CONSUMER_BUDGET_S, CONSUMER_RESERVE_S
+from integration.upload_queue import FileQueue, MemoryQueue, QueuedUpload, SqsQueue
+
+from .fakes import configure_integration, oem_event
+
+
+@pytest.fixture(autouse=True)
+def clear_memory_queues():
+    MemoryQueue._queues.clear()
+    yield
+    MemoryQueue._queues.clear()
+
+
+def _payload(serial=1001, n=3, start=0):
+    return {
+        "SerNo": serial,
+        "Records": [
+            {"SeqNo": i, "Reason": 11, "Fields": [{"FType": 2, "DIn": 1}]}
+            for i in range(start, start + n)
+        ],
+    }
+
+
+def _seqs(api, channel="on_dm_event"):
+    return [c[1][1]["sequence_number"] for c in api.calls_to("create_message", channel)]
+
+
+@pytest.mark.asyncio
+async def test_fast_ack_enqueues_without_api_calls(integration, fake_api):
+    configure_integration(integration, fast_ack_queue="memory://uploads")
+
+    event = oem_event(integration, _payload(), invocation_url="https://x/ingest?iccid=8961000000000000001")
+    await integration.on_ingestion_endpoint(event)
+
+    assert fake_api.calls == []
+    assert len(MemoryQueue("uploads")) == 1
+
+    assert await integration.consume_uploads() == 1
+    assert _seqs(fake_api) == [0, 1, 2]
+    assert fake_api.calls_to("create_message", "dm_events")[0][1][1]["sim_iccid"] == "8961000000000000001"
+    assert len(fake_api.calls_to("create_message", "dm_raw")) == 1
+    assert not MemoryQueue("uploads").inflight
+
+
+@pytest.mark.asyncio
+async def test_invalid_body_is_rejected_not_queued(integration, fake_api):
+    configure_integration(integration, fast_ack_queue="memory://uploads")
+    await integration.on_ingestion_endpoint(oem_event(integration, {"Records": []}))
+    assert len(MemoryQueue("uploads")) == 0
+
+
+@pytest.mark.asyncio
+async def test_consumer_keeps_per_serial_order_across_batches(integration, fake_api):
+    queue = MemoryQueue("uploads")
+    for start in range(0, 12, 3):
+        for serial in (1001, 2002):
+            await queue.send(QueuedUpload(json.dumps(_payload(serial, start=start)).encode()))
+
+    assert await integration.consume_uploads(queue, batch_size=3) == 8
+
+    forwarded = [c[1][1] for c in fake_api.calls_to("create_message", "dm_events")]
+    for serial in (1001, 2002):
+        assert [r["sequence_number"] for r in forwarded if r["serial_number"] == serial] == list(range(12))
+
+
+@pytest.mark.asyncio
+async def test_consumer_orders_each_serial_by_enqueue_time(integration, fake_api):
+    queue = MemoryQueue("uploads")
+    # received newest first, as SQS may deliver them
+    for n, start in enumerate((6, 3, 0)):
+        upload = QueuedUpload(json.dumps(_payload(1001, start=start)).encode(), enqueued_at=1000.0 - n)
+        await queue.send(upload)
+
+    assert await integration.consume_uploads(queue) == 3
+    assert _seqs(fake_api, "dm_events") == list(range(9))
+
+
+@pytest.mark.asyncio
+async def test_failed_upload_is_left_for_redelivery(integration, fake_api, monkeypatch):
+    queue = MemoryQueue("uploads")
+    await queue.send(QueuedUpload(json.dumps(_payload(1001)).encode()))
+    await queue.send(QueuedUpload(json.dumps(_payload(2002)).encode()))
+
+    original = integration._process_upload
+
+    async def process(payload, *args):
+        if payload.SerNo == 2002:
+            raise RuntimeError("boom")
+        return await original(payload, *args)
+
+    monkeypatch.setattr(integration, "_process_upload", process)
+    assert await integration.consume_uploads(queue) == 1
+    assert len(queue.inflight) == 1
+
+    queue.release()  # visibility timeout
+    monkeypatch.setattr(integration, "_process_upload", original)
+    assert await integration.consume_uploads(queue) == 1
+    serials = [c[1][1]["serial_number"] for c in fake_api.calls_to("create_message", "dm_events")]
+    assert serials == [1001] * 3 + [2002] * 3
+
+
+@pytest.mark.asyncio
+async def test_oversized_upload_is_processed_inline(integration, fake_api, monkeypatch):
+    configure_integration(integration, fast_ack_queue="memory://uploads")
+    monkeypatch.setattr(MemoryQueue, "max_body_bytes", 10)
+    await integration.on_ingestion_endpoint(oem_event(integration, _payload()))
+    assert len(MemoryQueue("uploads")) == 0
+    assert _seqs(fake_api) == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_alarms_published_before_queueing(integration, fake_api):
+    configure_integration(integration, fast_ack_queue="memory://uploads")
+    payload = _payload(n=4)
+    payload["Records"][2]["Reason"] = 48  # Duress
+    await integration.on_ingestion_endpoint(oem_event(integration, payload))
+
+    assert _seqs(fake_api) == [2]
+    assert len(MemoryQueue("uploads")) == 1
+
+    # the consumer publishes the rest, still superseded by the alarm
+    assert await integration.consume_uploads() == 1
+    forwarded = [c[1][1] for c in fake_api.calls_to("create_message", "on_dm_event")]
+    assert [r["sequence_number"] for r in forwarded] == [2, 0, 1, 3]
+    assert [r.get("superseded", False) for r in forwarded] == [False, True, True, False]
+    assert _seqs(fake_api, "dm_events") == [2, 0, 1, 3]
+
+
+@pytest.mark.asyncio
+async def test_unpublished_alarms_are_left_to_the_consumer(integration, fake_api, monkeypatch):
+    configure_integration(integration, fast_ack_queue="memory://uploads")
+    payload = _payload(n=2)
+    payload["Records"][1]["Reason"] = 48
+
+    async def fail(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(integration, "_publish_records", fail)
+    await integration.on_ingestion_endpoint(oem_event(integration, payload))
+    monkeypatch.undo()
+
+    assert await integration.consume_uploads() == 1
+    assert _seqs(fake_api) == [1, 0]
+
+
+@pytest.mark.asyncio
+async def test_file_queue_claims_acks_and_redelivers(tmp_path):
+    queue = FileQueue(tmp_path / "q", visibility_timeout_s=60)
+    for n in range(3):
+        await queue.send(QueuedUpload(f"body-{n}".encode(), "https://x"))
+
+    first = await queue.receive(2)
+    assert [u.body for u in first] == [b"body-0", b"body-1"]
+    assert [u.body for u in await queue.receive(10)] == [b"body-2"]
+    assert await queue.receive(10) == []
+
+    await queue.ack(first)
+    (unacked,) = list((tmp_path / "q" / "inflight").iterdir())
+    old = time.time() - 120
+    os.utime(unacked, (old, old))
+    assert [u.body for u in await queue.receive(10)] == [b"body-2"]
+
+
+class FakeSqs:
+    def __init__(self):
+        self.messages = {}
+        self.inflight = {}
+        self.deleted = []
+        # receipt handle -> deletes to fail before one succeeds
+        self.fail = {}
+
+    def send_message(self, QueueUrl, MessageBody):
+        self.messages[f"r{len(self.messages) + len(self.inflight)}"] = MessageBody
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, WaitTimeSeconds):
+        assert MaxNumberOfMessages <= 10
+        handles = list(self.messages)[:MaxNumberOfMessages]
+        for h in handles:
+            self.inflight[h] = self.messages.pop(h)
+        return {"Messages": [{"ReceiptHandle": h, "Body": self.inflight[h]} for h in handles]}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        assert len(Entries) <= 10
+        failed = []
+        for entry in Entries:
+            if self.fail.get(entry["ReceiptHandle"]):
+                self.fail[entry["ReceiptHandle"]] -= 1
+                failed.append({"Id": entry["Id"], "SenderFault": False, "Code": "InternalError"})
+                continue
+            self.deleted.append(entry["ReceiptHandle"])
+            self.inflight.pop(entry["ReceiptHandle"])
+        return {"Successful": [], "Failed": failed}
+
+
+@pytest.mark.asyncio
+async def test_sqs_queue_round_trip():
+    sqs = FakeSqs()
+    queue = SqsQueue("https://sqs.ap-southeast-2.amazonaws.com/1/uploads", client=sqs)
+    await queue.send(QueuedUpload(b"\x00raw", "https://x"))
+    for n in range(24):
+        await queue.send(QueuedUpload(b"more"))
+
+    uploads = await queue.receive(30)
+    assert len(uploads) == 25
+    assert uploads[0].body == b"\x00raw"
+    assert uploads[0].invocation_url == "https://x"
+    await queue.ack(uploads)
+    assert len(sqs.deleted) == 25 and not sqs.messages and not sqs.inflight
+
+    assert not queue.accepts(QueuedUpload(b"x" * 300_000))
+
+
+@pytest.mark.asyncio
+async def test_sqs_ack_retries_failed_deletes(caplog):
+    sqs = FakeSqs()
+    queue = SqsQueue("https://sqs.ap-southeast-2.amazonaws.com/1/uploads", client=sqs)
+    for n in range(3):
+        await queue.send(QueuedUpload(b"body"))
+    uploads = await queue.receive(3)
+    sqs.fail = {"r1": 1, "r2": 10}
+
+    await queue.ack(uploads)
+    assert sorted(sqs.deleted) == ["r0", "r1"]
+    assert list(sqs.inflight) == ["r2"]
+    assert "upload ack failed" in caplog.text
+
+
+def test_consumer_budget_fits_the_invocation(integration):
+    class Context:
+        def __init__(self, remaining_ms):
+            self.remaining_ms = remaining_ms
+
+        def get_remaining_time_in_millis(self):
+            return self.remaining_ms
+
+    assert integration._consumer_budget() == CONSUMER_BUDGET_S
+    integration.lambda_context = Context(300_000)
+    assert integration._consumer_budget() == CONSUMER_BUDGET_S
+    integration.lambda_context = Context(100_000)
+    assert integration._consumer_budget() == 100 - CONSUMER_RESERVE_S
+    integration.lambda_context = Context(10_000)
+    assert integration._consumer_budget() == 0
+
+
+def test_from_url(tmp_path):
+    assert isinstance(upload_queue.from_url("memory://a"), MemoryQueue)
+    assert upload_queue.from_url(f"file://{tmp_path}").directory == tmp_path
+    with pytest.raises(ValueError):
+        upload_queue.from_url("redis://nope")
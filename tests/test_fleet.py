@@ -0,0 +1,121 @@
+"""
+Tests for the incrementally maintained fleet status aggregate.
+"""
+import pytest
+
+from integration import fleet
+from integration.fleet import FLEET_CHANNEL, FleetStatus
+
+from .fakes import FakeApi, FakeTagManager, oem_event
+
+
+def _record(seq, date, **fields):
+    field_list = [{"FType": 2, "DIn": fields.pop("ignition", 0)}]
+    if "lat" in fields:
+        field_list.append({"FType": 0, "Lat": fields.pop("lat"), "Long": fields.pop("lng")})
+    if "batt" in fields:
+        field_list.append({"FType": 6, "AnalogueData": {"1": fields.pop("batt")}})
+    return {"SeqNo": seq, "Reason": fields.pop("reason", 11), "DateUTC": date, "Fields": field_list}
+
+
+@pytest.mark.asyncio
+async def test_upload_updates_fleet_entry(integration, fake_api):
+    payload = {
+        "SerNo": 1001,
+        "Records": [
+            _record(2, "2024-01-01 00:02:00", ignition=1, reason=1),
+            _record(1, "2024-01-01 00:01:00", lat=-37.81, lng=144.96, batt=4100),
+        ],
+    }
+    await integration.on_ingestion_endpoint(oem_event(integration, payload))
+
+    entry = fake_api.aggregates[(None, FLEET_CHANNEL)]["devices"]["1001"]
+    assert entry["agent"] == 42
+    assert entry["seen"] == "2024-01-01 00:02:00"
+    assert entry["reason"] == 1
+    assert entry["ign"] is True
+    assert entry["pos"] == [-37.81, 144.96]
+    assert entry["batt"] == 4.1
+
+
+@pytest.mark.asyncio
+async def test_flushes_are_debounced_and_partial(integration, fake_api):
+    integration.tag_manager = FakeTagManager(
+        {"digital_matter_processor_1": {"serial_number_lookup": {str(s): s for s in range(1, 4)}}}
+    )
+
+    async def upload(serial, date, **fields):
+        payload = {"SerNo": serial, "Records": [_record(1, date, **fields)]}
+        await integration.on_ingestion_endpoint(oem_event(integration, payload))
+
+    await upload(1, "2024-01-01 00:00:00", lat=-37.8, lng=144.9)
+    await upload(2, "2024-01-01 00:00:00")
+    await upload(1, "2024-01-01 00:05:00", ignition=1)
+    assert len(fake_api.calls_to("update_channel_aggregate", FLEET_CHANNEL)) == 1
+    assert set(fleet._pending) == {"1", "2"}
+
+    await integration.on_schedule(None)
+    calls = fake_api.calls_to("update_channel_aggregate", FLEET_CHANNEL)
+    assert len(calls) == 2
+    assert set(calls[1][1][1]["devices"]) == {"1", "2"}  # only what changed
+
+    devices = fake_api.aggregates[(None, FLEET_CHANNEL)]["devices"]
+    # the later upload had no position, so the earlier one's is kept
+    assert devices["1"]["pos"] == [-37.8, 144.9] and devices["1"]["ign"] is True
+    assert devices["1"]["seen"] == "2024-01-01 00:05:00"
+
+
+@pytest.mark.asyncio
+async def test_older_upload_does_not_regress_pending_entry():
+    status = FleetStatus(FakeApi())
+    status.note(1001, [{"device_time_utc": "2024-01-01 00:05:00", "ignition_on": True}], 42)
+    status.note(1001, [{"device_time_utc": "2024-01-01 00:01:00", "ignition_on": False, "battery_voltage": 4.0}], 42)
+    assert fleet._pending["1001"]["ign"] is True
+    assert fleet._pending["1001"]["seen"] == "2024-01-01 00:05:00"
+    assert fleet._pending["1001"]["batt"] == 4.0
+
+
+@pytest.mark.asyncio
+async def test_flush_does_not_regress_a_newer_stored_entry():
+    api = FakeApi()
+    api.aggregates[(None, FLEET_CHANNEL)] = {
+        "devices": {"1001": {"agent": 42, "seen": "2024-01-01 00:05:00", "ign": True}}
+    }
+    status = FleetStatus(api)
+    status.note(1001, [{"device_time_utc": "2024-01-01 00:01:00", "ignition_on": False, "battery_voltage": 4.0}], 42)
+    status.note(2002, [{"device_time_utc": "2024-01-01 00:01:00"}], 43)
+    assert await status.flush(force=True) == 2
+
+    devices = api.aggregates[(None, FLEET_CHANNEL)]["devices"]
+    assert devices["1001"]["seen"] == "2024-01-01 00:05:00"
+    assert devices["1001"]["ign"] is True
+    assert devices["1001"]["batt"] == 4.0
+    assert devices["2002"]["agent"] == 43
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_entries_pending():
+    class FailingApi(FakeApi):
+        async def update_channel_aggregate(self, *args, **kwargs):
+            raise ConnectionError("down")
+
+    status = FleetStatus(FailingApi())
+    status.note(1001, [{"device_time_utc": "2024-01-01 00:00:00"}])
+    assert await status.flush(force=True) == 0
+    assert "1001" in fleet._pending
+
+    status.api = FakeApi()
+    assert await status.flush(force=True) == 1
+    assert not fleet._pending
+
+
+@pytest.mark.asyncio
+async def test_many_pending_serials_flush_early(monkeypatch):
+    monkeypatch.setattr(fleet, "MAX_PENDING", 3)
+    monkeypatch.setattr(fleet, "_last_flush", float("inf"))
+    status = FleetStatus(FakeApi())
+    for serial in range(2):
+        status.note(serial, [{"device_time_utc": "2024-01-01 00:00:00"}])
+    assert not status.due()
+    status.note(2, [{"device_time_utc": "2024-01-01 00:00:00"}])
+    assert status.due()
@@ -0,0 +1,175 @@
+"""
+Tests for the G62 integration: trimmed TTS webhook decoding, the cached
+DevEUI index, edge decoding and batched forwarding, and the processor side
+of the compact records.
+"""
+import base64
+import json
+
+import pytest
+
+from g62 import downlink
+from dm_common.channels import DECODED_UPLINK_CHANNEL
+from g62_integration import devices
+from g62_integration.application import G62Integration
+from g62_integration.devices import dev_eui_index, normalise_dev_eui
+from g62_integration.webhook import decode_uplinks
+
+from .fakes import (
+    FakeNetworkServer,
+    FakeTagManager,
+    configure_integration,
+    encode_payload,
+    ingestion_event,
+    message_event,
+)
+
+DEV_EUI = "70B3D5E75E000001"
+
+
+def _uplink(port, hex_payload, dev_eui=DEV_EUI, received_at="2024-01-01T00:00:00Z"):
+    return {
+        "end_device_ids": {
+            "device_id": "g62-0001",
+            "application_ids": {"application_id": "fleet"},
+            "dev_eui": dev_eui,
+            "dev_addr": "260B1234",
+        },
+        "correlation_ids": ["as:up:01H..."],
+        "received_at": received_at,
+        "uplink_message": {
+            "session_key_id": "AYa...",
+            "f_port": port,
+            "f_cnt": 42,
+            "frm_payload": base64.b64encode(bytes.fromhex(hex_payload)).decode(),
+            "rx_metadata": [
+                {"gateway_ids": {"gateway_id": f"gw-{i}"}, "rssi": -90 - i, "snr": 7.5, "location": {"latitude": -33.0}}
+                for i in range(8)
+            ],
+            "settings": {"data_rate": {"lora": {"bandwidth": 125000, "spreading_factor": 7}}, "frequency": "917000000"},
+            "received_at": received_at,
+            "network_ids": {"net_id": "000013", "tenant_id": "ttn"},
+        },
+    }
+
+
+@pytest.fixture
+def g62_integration(fake_api):
+    """A G62Integration wired to fakes, mapping the test DevEUI -> agent 43."""
+    app = G62Integration()
+    configure_integration(app)
+    app.api = fake_api
+    app.tag_manager = FakeTagManager(
+        {"g62_processor_1": {"serial_number_lookup": {"70-b3-d5-e7-5e-00-00-01": 43, "70b3d5e75e000002": 44}}}
+    )
+    return app
+
+
+def _event(app, body):
+    return ingestion_event(encode_payload(body), parser=app.parse_ingestion_event_payload)
+
+
+def test_webhook_keeps_only_what_is_needed():
+    (uplink,) = decode_uplinks(json.dumps(_uplink(2, "0d08d0eb43b5205a2d3ec8")).encode())
+    assert uplink.end_device_ids.dev_eui == DEV_EUI
+    assert uplink.end_device_ids.application_ids.application_id == "fleet"
+    assert uplink.uplink_message.f_port == 2
+    assert uplink.uplink_message.frm_payload == bytes.fromhex("0d08d0eb43b5205a2d3ec8")
+    assert not hasattr(uplink.uplink_message, "rx_metadata")
+
+    assert len(decode_uplinks(json.dumps([_uplink(2, "00"), {"end_device_ids": {}}]).encode())) == 2
+
+
+def test_dev_eui_index_is_normalised_and_cached(monkeypatch):
+    monkeypatch.setattr(devices, "_cached_source", None)
+    assert normalise_dev_eui("70-b3-d5:e7 5e00 0001") == DEV_EUI
+
+    index = dev_eui_index({"70b3d5e75e000001": 43})
+    assert index == {DEV_EUI: 43}
+    # an equal table (e.g. the next warm invocation's tags) reuses the index
+    assert dev_eui_index({"70b3d5e75e000001": 43}) is index
+    assert dev_eui_index({"70b3d5e75e000001": 45}) == {DEV_EUI: 45}
+
+
+@pytest.mark.asyncio
+async def test_uplink_decoded_and_forwarded(g62_integration, fake_api):
+    await g62_integration.on_ingestion_endpoint(_event(g62_integration, _uplink(2, "0d08d0eb43b5205a2d3ec8")))
+
+    (call,) = fake_api.calls_to("create_message", DECODED_UPLINK_CHANNEL)
+    _, (_, batch), kwargs = call
+    assert kwargs["agent_id"] == 43
+    assert batch["dev_eui"] == DEV_EUI
+    assert batch["device_id"] == "g62-0001" and batch["application_id"] == "fleet"
+    (record,) = batch["records"]
+    assert record["_type"] == "data_part_1"
+    assert record["ignition"] is True
+    assert record["received_at"] == "2024-01-01T00:00:00Z"
+    # the forwarded message is a fraction of the webhook body
+    assert len(json.dumps(batch)) < len(json.dumps(_uplink(2, "0d08d0eb43b5205a2d3ec8"))) / 3
+
+
+@pytest.mark.asyncio
+async def test_uplinks_batched_per_device(g62_integration, fake_api):
+    body = [
+        _uplink(2, "0d08d0eb43b5205a2d3ec8", received_at="2024-01-01T00:00:00Z"),
+        _uplink(2, "0d08d0eb43b5205a2d3ec8", dev_eui="70B3D5E75E000002"),
+        _uplink(4, "1027000064000000", received_at="2024-01-01T00:01:00Z"),
+        _uplink(2, "0d08d0eb43b5205a2d3ec8", dev_eui="70B3D5E75E0000FF"),  # not mapped
+        _uplink(9, "00"),  # not a G62 frame
+        {"end_device_ids": {"dev_eui": DEV_EUI}, "join_accept": {}},  # not an uplink
+    ]
+    await g62_integration.on_ingestion_endpoint(_event(g62_integration, body))
+
+    calls = fake_api.calls_to("create_message", DECODED_UPLINK_CHANNEL)
+    batches = {c[2]["agent_id"]: c[1][1] for c in calls}
+    assert set(batches) == {43, 44}
+    assert [r["_type"] for r in batches[43]["records"]] == ["data_part_1", "odometer"]
+    assert len(batches[44]["records"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_rejects_malformed_body(g62_integration, fake_api):
+    event = ingestion_event(base64.b64encode(b"not json").decode(), parser=g62_integration.parse_ingestion_event_payload)
+    assert event.payload is None
+    await g62_integration.on_ingestion_endpoint(event)
+    assert not fake_api.calls
+
+
+@pytest.mark.asyncio
+async def test_no_lookup_table_forwards_nothing(g62_integration, fake_api):
+    g62_integration.tag_manager = FakeTagManager({})
+    await g62_integration.on_ingestion_endpoint(_event(g62_integration, _uplink(2, "0d08d0eb43b5205a2d3ec8")))
+    assert not fake_api.calls_to("create_message", DECODED_UPLINK_CHANNEL)
+
+
+@pytest.mark.asyncio
+async def test_processor_applies_decoded_batch(g62, fake_api, monkeypatch):
+    network = FakeNetworkServer()
+
+    async def network_server():
+        return network
+
+    monkeypatch.setattr(g62, "_network_server", network_server)
+    fake_api.aggregates[(None, downlink.DOWNLINK_CHANNEL)] = {
+        "inflight": [{"seq": 0, "params": {"12": 300}, "attempts": 1, "sent_at": 0}],
+    }
+    await g62.tags.downlink_inflight.set(1)
+
+    batch = {
+        "dev_eui": DEV_EUI,
+        "device_id": "g62-0001",
+        "application_id": "fleet",
+        "records": [
+            {"_type": "data_part_1", "ignition": True, "latitude": -33.0, "longitude": 151.0, "speed_kmh": 32},
+            {"_type": "odometer", "runtime_s": 10000, "odometer_km": 1.0},
+            {"_type": "downlink_ack", "sequence": 0, "accepted": True, "firmware_version": "1.3"},
+        ],
+    }
+    await g62.on_message_create(message_event(DECODED_UPLINK_CHANNEL, batch))
+
+    assert g62.tags.ignition.value is True
+    assert g62.tags.speed_kmh.value == 32
+    assert g62.tags.odometer_km.value == 1.0
+    assert g62.tags.downlink_inflight.value == 0
+    assert len(fake_api.calls_to("create_message", "location")) == 1
+    assert fake_api.aggregates[(None, downlink.DOWNLINK_CHANNEL)]["device"]["device_id"] == "g62-0001"
@@ -0,0 +1,106 @@
+"""
+Tests for the structured logging layer.
+"""
+import logging
+
+import pytest
+
+from dm_common import logs
+
+from .fakes import oem_event
+
+
+@pytest.fixture(autouse=True)
+def reset_logs():
+    logs.configure(sample_rates="", debug_serials="", max_chars=logs.DEFAULT_MAX_CHARS)
+    yield
+    logs.configure(sample_rates="", debug_serials="", max_chars=logs.DEFAULT_MAX_CHARS)
+
+
+class Expensive:
+    formatted = 0
+
+    def __repr__(self):
+        Expensive.formatted += 1
+        return "expensive"
+
+
+def test_fields_are_not_formatted_unless_emitted(caplog):
+    Expensive.formatted = 0
+    log = logs.get_logger("tests.lazy")
+
+    with caplog.at_level(logging.WARNING, logger="tests.lazy"):
+        log.info("skipped", value=Expensive())
+    assert Expensive.formatted == 0
+
+    with caplog.at_level(logging.INFO, logger="tests.lazy"):
+        log.info("kept", value=Expensive())
+    assert caplog.records[-1].getMessage() == "kept value=expensive"
+    assert caplog.records[-1].msg.fields["value"].__class__ is Expensive
+
+
+def test_values_are_clipped(caplog):
+    logs.configure(max_chars=10)
+    with caplog.at_level(logging.INFO, logger="tests.clip"):
+        logs.get_logger("tests.clip").info("big", data="x" * 1000)
+    assert caplog.records[-1].getMessage() == "big data=xxxxxxxxxx...(+990 chars)"
+    # nothing unclipped rides along as a record extra
+    assert not hasattr(caplog.records[-1], "fields")
+
+
+def test_sampling_is_per_logger_and_spares_warnings(caplog):
+    logs.configure(sample_rates="tests.sampled=0,tests=1")
+    with caplog.at_level(logging.INFO):
+        for _ in range(20):
+            logs.get_logger("tests.sampled.child").info("routine")
+        logs.get_logger("tests.sampled").warning("problem")
+        logs.get_logger("tests.other").info("kept")
+
+    assert [r.getMessage() for r in caplog.records] == ["problem", "kept"]
+
+
+def test_parse_rates():
+    assert logs._parse_rates("0.25") == {"": 0.25}
+    assert logs._parse_rates("integration=0.1, processor=1") == {"integration": 0.1, "processor": 1.0}
+
+
+def test_malformed_environment_falls_back_to_defaults(monkeypatch, caplog):
+    monkeypatch.setenv("DM_LOG_SAMPLE", "integration=lots")
+    monkeypatch.setenv("DM_LOG_MAX_CHARS", "256k")
+    with caplog.at_level(logging.WARNING, logger="dm_common.logs"):
+        logs.configure()
+
+    assert logs._settings.sample_rates == {}
+    assert logs._settings.max_chars == logs.DEFAULT_MAX_CHARS
+    assert "invalid DM_LOG_SAMPLE" in caplog.text
+    assert "invalid DM_LOG_MAX_CHARS" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_integration_logs_summary_not_payload(integration, caplog):
+    payload = {
+        "SerNo": 1001,
+        "Records": [{"Reason": 11, "Fields": [{"FType": 6, "AnalogueData": {"1": 4100}}]}] * 20,
+    }
+    with caplog.at_level(logging.INFO):
+        await integration.on_ingestion_endpoint(oem_event(integration, payload))
+
+    messages = [r.getMessage() for r in caplog.records]
+    assert any(m.startswith("oem upload serial=1001 records=20 bytes=") for m in messages)
+    assert not any("AnalogueData" in m or "battery_voltage" in m for m in messages)
+    assert sum(len(m) for m in messages) < 1024
+
+
+@pytest.mark.asyncio
+async def test_debug_serial_dumps_full_payload(integration, caplog):
+    logs.configure(sample_rates="0", debug_serials="1001")
+    payload = {"SerNo": 1001, "Records": [{"Reason": 11, "Fields": [{"FType": 2, "DIn": 1}]}]}
+
+    with caplog.at_level(logging.INFO):
+        await integration.on_ingestion_endpoint(oem_event(integration, payload))
+
+    messages = [r.getMessage() for r in caplog.records]
+    assert not any(m.startswith("oem upload") for m in messages)  # sampled out
+    (dump,) = [m for m in messages if m.startswith("oem payload")]
+    assert '"DIn": 1' in dump
+    assert any(m.startswith("forwarding record") and "ignition_on" in m for m in messages)
@@ -0,0 +1,116 @@
+"""
+Memory budgets for the handlers, measured with dm_common.memprof.
+
+Budgets are roughly twice what the handlers used when they were set; a
+regression that copies a payload or mapping per record will blow through them.
+"""
+import base64
+import gc
+
+import pytest
+
+from dm_common import memprof
+
+from .fakes import FakeTagManager, message_event, oem_event
+
+KB = 1024
+MB = 1024 * KB
+
+OEM_500_RECORD_BUDGET = 1536 * KB
+BIG_MAPPING_OVERHEAD_BUDGET = 256 * KB
+G62_BURST_BUDGET = 256 * KB
+
+
+def _oem_payload(serial=1001, n=500):
+    return {
+        "SerNo": serial,
+        "Records": [
+            {
+                "SeqNo": i,
+                "Reason": 11,
+                "DateUTC": "2024-01-01 00:00:00",
+                "Fields": [
+                    {"FType": 0, "Lat": -37.8 + i * 1e-4, "Long": 144.9, "Alt": 30, "Spd": 12, "PosAcc": 5},
+                    {"FType": 2, "DIn": 1},
+                    {"FType": 6, "AnalogueData": {"1": 4100, "3": 2500, "4": 1200}},
+                ],
+            }
+            for i in range(n)
+        ],
+    }
+
+
+async def _profile(name, handler, *args):
+    gc.collect()
+    with memprof.session(name, force=True) as session:
+        await handler(*args)
+    return session.report()
+
+
+def test_stages_and_sites_are_reported():
+    with memprof.session("unit", force=True) as session:
+        with memprof.stage("small"):
+            small = bytearray(10 * KB)
+        with memprof.stage("big"):
+            big = bytearray(MB)
+        del small, big
+
+    report = session.report()
+    assert report["handler"] == "unit"
+    assert report["stages"]["small"] < MB <= report["stages"]["big"]
+    assert report["peak_bytes"] >= MB
+    site, size = report["top"][0]
+    assert "test_memory.py" in site and size >= MB
+
+
+def test_disabled_profiling_is_a_no_op(monkeypatch):
+    monkeypatch.delenv("DM_MEMPROFILE", raising=False)
+    with memprof.session("off") as session:
+        with memprof.stage("anything"):
+            pass
+    assert session is None
+
+
+@pytest.mark.asyncio
+async def test_oem_500_record_payload(integration):
+    event = oem_event(integration, _oem_payload())
+    report = await _profile("oem", integration.on_ingestion_endpoint, event)
+
+    assert {"lookup", "parse", "publish"} <= report["stages"].keys()
+    assert report["peak_bytes"] < OEM_500_RECORD_BUDGET, report
+
+
+@pytest.mark.asyncio
+async def test_big_serial_mapping_is_not_copied(integration):
+    payload = _oem_payload(n=5)
+    await integration.on_ingestion_endpoint(oem_event(integration, payload))  # warm up
+    small = await _profile("small", integration.on_ingestion_endpoint, oem_event(integration, payload))
+
+    mapping = {str(serial): serial for serial in range(100_000)}
+    mapping["1001"] = 42
+    integration.tag_manager = FakeTagManager(
+        {"digital_matter_processor_1": {"serial_number_lookup": mapping}}
+    )
+    big = await _profile("big", integration.on_ingestion_endpoint, oem_event(integration, payload))
+
+    assert big["peak_bytes"] - small["peak_bytes"] < BIG_MAPPING_OVERHEAD_BUDGET, big
+
+
+@pytest.mark.asyncio
+async def test_long_g62_burst(g62, fake_api):
+    uplink = {
+        "end_device_ids": {"dev_eui": "70B3D5E75E000001"},
+        "uplink_message": {
+            "f_port": 2,
+            "frm_payload": base64.b64encode(bytes.fromhex("0d08d0eb43b5205a2d3ec8")).decode(),
+        },
+    }
+
+    async def burst():
+        for _ in range(1000):
+            await g62.on_message_create(message_event("on_tts_event", uplink))
+            fake_api.calls.clear()  # the fake's call log isn't the handler's memory
+
+    report = await _profile("g62", burst)
+    assert {"decode", "apply", "flush"} <= report["stages"].keys()
+    assert report["peak_bytes"] < G62_BURST_BUDGET, report
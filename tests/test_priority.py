@@ -0,0 +1,83 @@
+"""
+Tests for the alarm priority lane: alarm records are published ahead of the
+rest of an upload, and the records they overtook don't roll back the
+device's latest state.
+"""
+import pytest
+
+from .fakes import FakeTagManager, message_event, oem_event
+
+
+def _record(seq, reason, lat=-33.0):
+    return {
+        "SeqNo": seq,
+        "Reason": reason,
+        "DateUTC": f"2024-01-01 00:{seq:02d}:00",
+        "Fields": [{"FType": 0, "Lat": lat + seq * 1e-3, "Long": 151.0}],
+    }
+
+
+@pytest.mark.asyncio
+async def test_alarms_published_before_the_batch(integration, fake_api):
+    records = [_record(i, 11) for i in range(5)]
+    records[1]["Reason"] = 20  # Towing Alert
+    records.append(_record(5, 48))  # Duress, at the back of the batch
+    records.append(_record(6, 11))
+
+    await integration.on_ingestion_endpoint(oem_event(integration, {"SerNo": 1001, "Records": records}))
+
+    forwarded = [c[1][1] for c in fake_api.calls_to("create_message", "on_dm_event")]
+    events = [c[1][1] for c in fake_api.calls_to("create_message", "dm_events")]
+    assert [r["sequence_number"] for r in forwarded] == [1, 5, 0, 2, 3, 4, 6]
+    assert [r["sequence_number"] for r in events] == [1, 5, 0, 2, 3, 4, 6]
+    # the alarms go out before the body is even archived
+    channels = [c[1][0] for c in fake_api.calls if c[0] == "create_message"]
+    assert channels.index("dm_raw") > channels.index("on_dm_event")
+
+    superseded = {r["sequence_number"] for r in forwarded if r.get("superseded")}
+    assert superseded == {0, 2, 3, 4}
+
+
+@pytest.mark.asyncio
+async def test_batch_without_alarms_keeps_order(integration, fake_api):
+    records = [_record(i, 11) for i in range(4)]
+    await integration.on_ingestion_endpoint(oem_event(integration, {"SerNo": 1001, "Records": records}))
+
+    forwarded = [c[1][1] for c in fake_api.calls_to("create_message", "on_dm_event")]
+    assert [r["sequence_number"] for r in forwarded] == [0, 1, 2, 3]
+    assert not any(r.get("superseded") for r in forwarded)
+
+
+@pytest.mark.asyncio
+async def test_unmapped_integration_publishes_nothing(integration, fake_api):
+    integration.tag_manager = FakeTagManager({})
+    records = [_record(0, 11), _record(1, 48)]
+    await integration.on_ingestion_endpoint(oem_event(integration, {"SerNo": 1001, "Records": records}))
+
+    assert not fake_api.calls_to("create_message", "dm_events")
+    assert not fake_api.calls_to("create_message", "on_dm_event")
+
+
+@pytest.mark.asyncio
+async def test_processor_keeps_state_from_the_alarm(processor, fake_api):
+    alarm = {
+        "serial_number": 1001,
+        "uplink_reason": "Duress",
+        "device_time_utc": "2024-01-01 00:05:00",
+        "position": {"lat": -33.5, "long": 151.0},
+    }
+    older = {
+        "serial_number": 1001,
+        "uplink_reason": "Heartbeat",
+        "device_time_utc": "2024-01-01 00:01:00",
+        "position": {"lat": -33.1, "long": 151.0},
+        "superseded": True,
+    }
+    await processor.on_message_create(message_event("on_dm_event", alarm))
+    await processor.on_message_create(message_event("on_dm_event", older))
+
+    assert processor.tags.uplink_reason.value == "Duress"
+    assert processor.tags.device_time.value == "2024-01-01 00:05:00"
+    assert len(fake_api.calls_to("update_channel_aggregate", "location")) == 1
+    # the older fix still lands in the location history
+    assert len(fake_api.calls_to("create_message", "location")) == 2
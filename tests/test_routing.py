@@ -0,0 +1,90 @@
+"""
+Tests for invocation URL routing.
+"""
+import pytest
+
+from integration import routing
+from integration.routing import Router, extract_iccid
+
+from .fakes import FakeTagManager, configure_integration, oem_event
+
+ICCID = "8961000000000000001"
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        f"https://x/ingest?iccid={ICCID}",
+        f"https://x/ingest?ICCID={ICCID}",
+        f"https://x/ingest/{ICCID}",
+        f"https://x/ingest?sim={ICCID}&other=1",
+    ],
+)
+def test_extract_iccid_is_tolerant(url):
+    assert extract_iccid(url) == ICCID
+
+
+@pytest.mark.parametrize("url", [None, "", "https://x/ingest", "https://x/ingest?iccid=1234"])
+def test_no_iccid(url):
+    assert extract_iccid(url) is None
+
+
+def test_path_template():
+    router = Router(("/ingest/{tenant}/{iccid}",))
+    route = router.route(f"https://x/base/ingest/acme/{ICCID}/?model=oem")
+    assert (route.iccid, route.tenant, route.model, route.app_key) == (ICCID, "acme", "oem", None)
+
+
+def test_query_template_renames_keys():
+    router = Router(("/t/{tenant}?sim={iccid}&app={app_key}",))
+    route = router.route(f"https://x/t/acme?SIM={ICCID}&app=fleet_processor_1")
+    assert route.iccid == ICCID
+    assert route.app_key == "fleet_processor_1"
+    assert route.params == {"tenant": "acme", "iccid": ICCID, "app_key": "fleet_processor_1"}
+
+
+def test_first_matching_template_wins():
+    router = Router(("/a/{tenant}", "/b/{model}"))
+    assert router.route("https://x/b/oem").model == "oem"
+    assert router.route("https://x/a/acme").tenant == "acme"
+
+
+def test_invalid_templated_iccid_falls_back_to_scan():
+    router = Router(("/ingest/{iccid}/{tenant}",))
+    route = router.route(f"https://x/ingest/unknown/acme?x={ICCID}")
+    assert route.iccid == ICCID and route.tenant == "acme"
+
+
+def test_bad_templates_are_skipped(caplog):
+    router = Router(("/a/{1x}", "/b/{tenant}/{tenant}", "?sim={9}", "/c/{tenant}"))
+    assert router.templates == ("/c/{tenant}",)
+    assert caplog.text.count("skipping connector URL template") == 3
+    assert router.route("https://x/c/acme").tenant == "acme"
+    assert router.route(f"https://x/a/{ICCID}").iccid == ICCID
+
+
+def test_routes_are_cached_per_url():
+    router = Router(("/ingest/{tenant}",))
+    first = router.route("https://x/ingest/acme")
+    assert router.route("https://x/ingest/acme") is first
+    assert router.route.cache_info().hits == 1
+    assert routing.router_for("/a/{tenant}, /b/{model}").templates == ("/a/{tenant}", "/b/{model}")
+    assert routing.router_for("/a/{tenant}, /b/{model}") is routing.router_for("/a/{tenant}, /b/{model}")
+
+
+@pytest.mark.asyncio
+async def test_app_key_picks_the_serial_lookup(integration, fake_api):
+    configure_integration(integration, connector_url_templates="/ingest/{app_key}/{iccid}")
+    integration.tag_manager = FakeTagManager({
+        "digital_matter_processor_1": {"serial_number_lookup": {"1001": 42}},
+        "fleet_processor_1": {"serial_number_lookup": {"1001": 77}},
+    })
+    payload = {"SerNo": 1001, "Records": [{"Reason": 11, "Fields": [{"FType": 2, "DIn": 1}]}]}
+
+    await integration.on_ingestion_endpoint(
+        oem_event(integration, payload, invocation_url=f"https://x/ingest/fleet_processor_1/{ICCID}")
+    )
+
+    (call,) = fake_api.calls_to("create_message", "on_dm_event")
+    assert call[2]["agent_id"] == 77
+    assert call[1][1]["sim_iccid"] == ICCID
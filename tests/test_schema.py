@@ -0,0 +1,124 @@
+"""
+Tests for OEM payload schema validation.
+"""
+import base64
+import copy
+import json
+import random
+
+import pytest
+
+from integration import archive
+
+from .fakes import encode_payload, ingestion_event, oem_event
+
+
+def _payload():
+    return {
+        "SerNo": 1001,
+        "IMEI": "352000000000001",
+        "Records": [
+            {
+                "SeqNo": i,
+                "Reason": 11,
+                "DateUTC": f"2024-01-01 00:{i:02d}:00",
+                "Fields": [
+                    {"FType": 0, "Lat": -33.8688 + i * 1e-4, "Long": 151.2093, "Alt": 50,
+                     "Spd": 1500, "Head": 90, "PDOP": 12, "PosAcc": 5},
+                    {"FType": 2, "DIn": 1},
+                    {"FType": 6, "AnalogueData": {"1": 4100, "2": 1350, "3": 2500, "4": 20}},
+                    {"FType": 27, "Odo": 123456, "RH": 7200},
+                    {"FType": 15, "Rate": 100, "Scale": 4, "Samples": [[0, 0, 250]] * 8},
+                ],
+            }
+            for i in range(3)
+        ],
+    }
+
+
+_JUNK = [None, "", "x", -1, 0, 1e308, -1e308, 2**64, True, [], {}, [1, 2], {"a": 1}]
+
+
+def _containers(node, path=()):
+    if isinstance(node, dict):
+        yield node, path
+        for key, value in node.items():
+            yield from _containers(value, path + (key,))
+    elif isinstance(node, list):
+        yield node, path
+        for i, value in enumerate(node):
+            yield from _containers(value, path + (i,))
+
+
+def _mutate(payload, rng):
+    """Randomly retype, drop or add one value somewhere in the payload."""
+    payload = copy.deepcopy(payload)
+    node, _ = rng.choice(list(_containers(payload)))
+    keys = list(node) if isinstance(node, dict) else list(range(len(node)))
+    action = rng.random()
+    if keys and action < 0.6:
+        node[rng.choice(keys)] = copy.deepcopy(rng.choice(_JUNK))
+    elif keys and action < 0.85:
+        del node[rng.choice(keys)]
+    elif isinstance(node, dict):
+        node[rng.choice(["FType", "Extra", "Samples", "Records"])] = copy.deepcopy(rng.choice(_JUNK))
+    else:
+        node.append(copy.deepcopy(rng.choice(_JUNK)))
+    return payload
+
+
+@pytest.mark.asyncio
+async def test_valid_payload_is_accepted(integration, fake_api):
+    await integration.on_ingestion_endpoint(oem_event(integration, _payload()))
+    assert len(fake_api.calls_to("create_message", "dm_events")) == 3
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b"",
+        b"not json",
+        b'{"Records": []}',                                   # no SerNo
+        b'{"SerNo": 1001, "Records": {}}',
+        b'{"SerNo": 1001, "Records": [{"Fields": [{"Lat": 1}]}]}',  # no FType
+        b'{"SerNo": 1001, "Records": [{"Fields": [{"FType": 0, "Lat": 91.5, "Long": 151}]}]}',
+        b'{"SerNo": 1001, "Records": [{"Fields": [{"FType": 6, "AnalogueData": [1, 2]}]}]}',
+        b'{"SerNo": 1001, "Records": [{"Fields": [{"FType": 15, "Samples": [[40000, 0, 0]]}]}]}',
+        b'{"SerNo": 1001, "Records": [{"Reason": "11", "Fields": []}]}',
+    ],
+)
+@pytest.mark.asyncio
+async def test_malformed_payload_is_rejected_before_any_api_call(integration, fake_api, body):
+    event = ingestion_event(
+        base64.b64encode(body).decode(), parser=integration.parse_ingestion_event_payload
+    )
+    assert event.payload is None
+    await integration.on_ingestion_endpoint(event)
+    assert fake_api.calls == []
+
+
+@pytest.mark.asyncio
+async def test_fuzzed_payloads_are_rejected_or_fully_processed(integration, fake_api):
+    rng = random.Random(30)
+    rejected = 0
+    for _ in range(500):
+        payload = _mutate(_payload(), rng)
+        # each body is processed as new, even if a mutation repeats one
+        fake_api.calls.clear()
+        fake_api.aggregates.clear()
+        archive._seen.clear()
+
+        event = ingestion_event(encode_payload(payload), parser=integration.parse_ingestion_event_payload)
+        if event.payload is None:
+            rejected += 1
+            await integration.on_ingestion_endpoint(event)
+            assert fake_api.calls == [], json.dumps(payload)
+            continue
+
+        await integration.on_ingestion_endpoint(event)
+        if event.payload.SerNo:
+            published = fake_api.calls_to("create_message", "dm_events")
+            assert len(published) == len(event.payload.Records), json.dumps(payload)
+
+    # the mutations should exercise both paths
+    assert 0 < rejected < 500
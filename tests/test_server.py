@@ -0,0 +1,233 @@
+"""
+Tests for the long-running server: warm hosting, local processor dispatch,
+the HTTP routes, access checks and sharding. Runs against the in-memory Doover API over
+real HTTP.
+"""
+import base64
+import json
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from dm_common.writes import close_shared_session
+from server.app import (
+    INVOCATION_URL_HEADER,
+    SECRET_HEADER,
+    AccessPolicy,
+    make_frontend_app,
+    make_worker_app,
+    shard_for,
+    shard_key,
+)
+from server.fake_api import FakeDataApi
+from server.host import AppHost, ServerSettings
+
+DEV_EUI = "70B3D5E75E000001"
+
+
+def _oem_body(serial=1001):
+    return json.dumps({
+        "SerNo": serial,
+        "Records": [{
+            "SeqNo": 1,
+            "Reason": 11,
+            "DateUTC": "2024-01-01 00:00:00",
+            "Fields": [{"FType": 0, "Lat": -37.8, "Long": 144.9}],
+        }],
+    }).encode()
+
+
+def _tts_body():
+    return {
+        "end_device_ids": {"device_id": "g62-1", "dev_eui": DEV_EUI.lower()},
+        "uplink_message": {
+            "f_port": 2,
+            "frm_payload": base64.b64encode(bytes.fromhex("0d08d0eb43b5205a2d3ec8")).decode(),
+        },
+    }
+
+
+@pytest_asyncio.fixture
+async def data_api():
+    fake = FakeDataApi()
+    fake.aggregates[(100, "tag_values")] = {
+        "digital_matter_processor_1": {"serial_number_lookup": {"1001": 42}},
+    }
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    fake.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    yield fake
+    await runner.cleanup()
+    await close_shared_session()
+
+
+@pytest_asyncio.fixture
+async def host(data_api):
+    settings = ServerSettings.from_dict({
+        "api_url": data_api.url,
+        "token": "test",
+        "integration": {"agent_id": 100},
+        "agents": {
+            "42": {"app": "digital_matter_processor", "config": {"dv_serial_number": "1001"}},
+            "43": {"app": "g62_processor", "dev_eui": DEV_EUI},
+        },
+    })
+    app_host = AppHost(settings)
+    await app_host.start(schedule=False)
+    yield app_host
+    await app_host.close()
+
+
+@pytest.mark.asyncio
+async def test_oem_post_is_processed_locally(host, data_api):
+    assert await host.handle_oem(_oem_body(), data_api.url + "/ingest")
+    await host.settle()
+
+    assert (42, "on_dm_event") in data_api.messages
+    tags = data_api.aggregates[(42, "tag_values")]["digital_matter_processor_1"]
+    assert tags["uplink_reason"] == "Heartbeat"
+    assert (42, "location") in data_api.aggregates
+
+
+@pytest.mark.asyncio
+async def test_processors_and_tags_stay_warm(host, data_api):
+    for _ in range(3):
+        await host.handle_oem(_oem_body(), None)
+        await host.settle()
+
+    # tag values are fetched once at start-up (integration) and once when
+    # the processor is first needed, not per upload
+    assert data_api.log.count(("GET", 100, "tag_values")) == 1
+    assert data_api.log.count(("GET", 42, "tag_values")) == 1
+    assert len(host._processors) == 1
+
+
+@pytest.mark.asyncio
+async def test_tts_uplink_routed_by_dev_eui(host, data_api):
+    assert await host.handle_tts(_tts_body())
+    await host.settle()
+    assert data_api.aggregates[(43, "tag_values")]["g62_processor_1"]["ignition"] is True
+
+    unknown = _tts_body()
+    unknown["end_device_ids"]["dev_eui"] = "0000000000000000"
+    assert not await host.handle_tts(unknown)
+
+
+@pytest.mark.asyncio
+async def test_worker_routes(host, data_api):
+    async with TestClient(TestServer(make_worker_app(host))) as client:
+        resp = await client.post("/ingest/dm?iccid=1", data=_oem_body())
+        assert resp.status == 200
+        resp = await client.post("/ingest", data=b"not json")
+        assert resp.status == 400
+        resp = await client.post("/tts", json=_tts_body())
+        assert resp.status == 200
+        assert (await client.get("/health")).status == 200
+        await host.settle()
+    assert (42, "on_dm_event") in data_api.messages
+
+
+@pytest.mark.asyncio
+async def test_frontend_forwards_to_worker_socket(host, data_api, tmp_path):
+    socket_path = str(tmp_path / "worker.sock")
+    worker = web.AppRunner(make_worker_app(host, behind_frontend=True))
+    await worker.setup()
+    await web.UnixSite(worker, socket_path).start()
+    try:
+        async with TestClient(TestServer(make_frontend_app([socket_path]))) as client:
+            resp = await client.post("/ingest", data=_oem_body())
+            assert resp.status == 200
+            health = await (await client.get("/health")).json()
+            assert health == {"ok": True, "workers": [True]}
+        await host.settle()
+    finally:
+        await worker.shutdown()
+    assert (42, "on_dm_event") in data_api.messages
+
+
+@pytest.mark.asyncio
+async def test_public_routes_require_secret_or_network(host, data_api, tmp_path):
+    async with TestClient(TestServer(make_worker_app(host, AccessPolicy(secret="s3cret")))) as client:
+        assert (await client.post("/ingest", data=_oem_body())).status == 401
+        resp = await client.post("/tts", json=_tts_body(), headers={SECRET_HEADER: "wrong"})
+        assert resp.status == 401
+        resp = await client.post("/ingest", data=_oem_body(), headers={SECRET_HEADER: "s3cret"})
+        assert resp.status == 200
+        assert (await client.get("/health")).status == 200
+
+    # the test client connects from loopback
+    for cidrs, status in ((["10.0.0.0/8"], 401), (["127.0.0.0/8"], 200), (None, 200)):
+        access = AccessPolicy.from_args(None, cidrs)
+        async with TestClient(TestServer(make_worker_app(host, access))) as client:
+            assert (await client.post("/ingest", data=_oem_body())).status == status
+
+    socket_path = str(tmp_path / "worker.sock")
+    worker = web.AppRunner(make_worker_app(host, behind_frontend=True))
+    await worker.setup()
+    await web.UnixSite(worker, socket_path).start()
+    try:
+        frontend = make_frontend_app([socket_path], AccessPolicy.from_args("s3cret", ["10.0.0.0/8"]))
+        async with TestClient(TestServer(frontend)) as client:
+            assert (await client.post("/ingest", data=_oem_body())).status == 401
+            resp = await client.post("/ingest", data=_oem_body(), headers={SECRET_HEADER: "s3cret"})
+            assert resp.status == 200
+    finally:
+        await worker.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_invocation_url_header_only_trusted_behind_frontend(host, monkeypatch, tmp_path):
+    urls = []
+
+    async def handle_oem(body, url):
+        urls.append(url)
+        return True
+
+    monkeypatch.setattr(host, "handle_oem", handle_oem)
+    spoofed = {INVOCATION_URL_HEADER: "https://x/ingest?tenant=other&app_key=other"}
+    async with TestClient(TestServer(make_worker_app(host))) as client:
+        assert (await client.post("/ingest?iccid=1", data=_oem_body(), headers=spoofed)).status == 200
+    assert urls[-1].endswith("/ingest?iccid=1")
+
+    socket_path = str(tmp_path / "worker.sock")
+    worker = web.AppRunner(make_worker_app(host, behind_frontend=True))
+    await worker.setup()
+    await web.UnixSite(worker, socket_path).start()
+    try:
+        async with TestClient(TestServer(make_frontend_app([socket_path]))) as client:
+            assert (await client.post("/ingest?iccid=2", data=_oem_body(), headers=spoofed)).status == 200
+    finally:
+        await worker.shutdown()
+    # the frontend overwrites whatever the client sent with the public URL
+    assert urls[-1].endswith("/ingest?iccid=2")
+
+
+def test_sharding_is_stable():
+    assert shard_for("1001", 4) == shard_for("1001", 4)
+    assert shard_for(DEV_EUI.lower(), 4) == shard_for(DEV_EUI, 4)
+    assert shard_for(None, 4) == 0
+    assert shard_for("1001", 1) == 0
+    assert {shard_for(str(s), 4) for s in range(100)} == {0, 1, 2, 3}
+
+    assert shard_key("/ingest", _oem_body(1001)) == "1001"
+    assert shard_key("/tts", json.dumps(_tts_body()).encode()) == DEV_EUI.lower()
+    assert shard_key("/ingest", b"garbage") is None
+
+
+def test_settings_round_trip(monkeypatch):
+    monkeypatch.setenv("DOOVER_API_TOKEN", "from-env")
+    settings = ServerSettings.from_dict({
+        "integration": {"agent_id": 1},
+        "agents": {"2": {"app": "g62_processor", "dev_eui": "abc"}},
+    })
+    assert settings.token == "from-env"
+    assert settings.agents[2].dev_eui == "ABC"
+    assert settings.agents[2].app_key == "g62_processor_1"
+    assert ServerSettings.from_dict(settings.to_dict()) == settings
+
+    with pytest.raises(ValueError):
+        ServerSettings.from_dict({"integration": {"agent_id": 1}, "agents": {"2": {"app": "nope"}}})
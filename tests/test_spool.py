@@ -0,0 +1,214 @@
+"""
+Tests for the publish spool.
+"""
+import asyncio
+
+import pytest
+
+from dm_common import spool
+from dm_common.spool import Spool, SpooledPublisher, SpoolFull
+from pydoover.models import File
+from pydoover.models.data.exceptions import NotFoundError
+
+from .fakes import FakeApi, oem_event
+
+
+class FlakyApi(FakeApi):
+    """Fails ``create_message`` while ``down``, or after ``fail_after`` calls."""
+
+    def __init__(self, fail_after=None, slow=False):
+        super().__init__()
+        self.down = False
+        self.fail_after = fail_after
+        self.slow = slow
+        self.attempts = 0
+
+    async def create_message(self, channel_name, data, **kwargs):
+        self.attempts += 1
+        if self.slow:
+            await asyncio.sleep(1)
+        if self.down or (self.fail_after is not None and self.attempts > self.fail_after):
+            raise ConnectionError("API unavailable")
+        if kwargs.get("agent_id") == 404:
+            raise NotFoundError("agent deleted")
+        return await super().create_message(channel_name, data, **kwargs)
+
+
+def _payload(n=10):
+    return {
+        "SerNo": 1001,
+        "Records": [
+            {"SeqNo": i, "Reason": 11, "DateUTC": f"2024-01-01 00:00:{i:02d}",
+             "Fields": [{"FType": 2, "DIn": 1}]}
+            for i in range(n)
+        ],
+    }
+
+
+def _seqs(api, channel):
+    return [c[1][1]["sequence_number"] for c in api.calls_to("create_message", channel)]
+
+
+@pytest.mark.asyncio
+async def test_failure_mid_batch_is_spooled_not_raised(integration):
+    # dm_raw archive message, then 3 dm_events/on_dm_event pairs succeed
+    api = integration.api = FlakyApi(fail_after=7)
+
+    await integration.on_ingestion_endpoint(oem_event(integration, _payload()))
+
+    assert _seqs(api, "dm_events") == [0, 1, 2]
+    assert Spool().pending() == 14
+    assert api.attempts == 8  # no further attempts once degraded
+
+
+@pytest.mark.asyncio
+async def test_spool_drains_on_next_warm_invocation(integration, monkeypatch):
+    api = integration.api = FlakyApi(fail_after=7)
+    await integration.on_ingestion_endpoint(oem_event(integration, _payload()))
+
+    api.fail_after = None
+    monkeypatch.setattr(spool, "_backoff", {})  # backoff window has passed
+    other = _payload(2)
+    other["Records"] = [dict(r, SeqNo=r["SeqNo"] + 100) for r in other["Records"]]
+    await integration.on_ingestion_endpoint(oem_event(integration, other))
+
+    # every record published exactly once, in order, per channel
+    assert _seqs(api, "dm_events") == list(range(10)) + [100, 101]
+    assert _seqs(api, "on_dm_event") == list(range(10)) + [100, 101]
+    assert Spool().pending() == 0
+    assert not list(Spool().directory.iterdir())
+
+
+@pytest.mark.asyncio
+async def test_drain_backs_off_exponentially(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(spool.time, "monotonic", lambda: now[0])
+    api = FlakyApi()
+    api.down = True
+    store = Spool()
+    store.append("dm_events", {"n": 1})
+
+    delays = []
+    for _ in range(4):
+        assert await store.drain(api) == 0
+        delays.append(spool._backoff[str(store.directory)][1] - now[0])
+        attempts = api.attempts
+        assert await store.drain(api) == 0  # still backing off
+        assert api.attempts == attempts
+        now[0] += delays[-1]
+    assert delays == [1.0, 2.0, 4.0, 8.0]
+
+    api.down = False
+    assert await store.drain(api) == 1
+    assert str(store.directory) not in spool._backoff
+
+
+@pytest.mark.asyncio
+async def test_drain_replays_in_batches_with_acks(monkeypatch):
+    monkeypatch.setattr(spool, "SEGMENT_BYTES", 200)
+    store = Spool()
+    for n in range(30):
+        store.append("dm_events", {"n": n})
+    assert len(list(store.directory.glob("seg-*.jsonl"))) > 1
+
+    api = FlakyApi(fail_after=12)
+    assert await store.drain(api, batch_size=5) == 12
+    assert store.pending() == 18
+
+    api.fail_after = None
+    assert await store.drain(api, force=True) == 18
+    assert [c[1][1]["n"] for c in api.calls_to("create_message")] == list(range(30))
+    assert not list(store.directory.iterdir())
+
+
+@pytest.mark.asyncio
+async def test_rejected_entries_are_dead_lettered():
+    store = Spool()
+    store.append("on_dm_event", {"n": 1}, agent_id=404)
+    store.append("on_dm_event", {"n": 2}, agent_id=404)
+    store.append("dm_events", {"n": 3})
+
+    api = FlakyApi()
+    assert await store.drain(api) == 1
+    assert [d["data"]["n"] for d in store.dead_letters()] == [1, 2]
+    assert "404" in store.dead_letters()[0]["error"]
+    assert store.pending() == 0
+    assert not list(store.directory.glob("seg-*"))
+
+    # a direct publish that's rejected doesn't degrade the publisher
+    publisher = SpooledPublisher(api, store)
+    await publisher.create_message("on_dm_event", {"n": 4}, agent_id=404)
+    await publisher.create_message("dm_events", {"n": 5})
+    assert publisher.spooled == 0 and not publisher.degraded
+    assert len(store.dead_letters()) == 3
+
+
+@pytest.mark.asyncio
+async def test_entry_that_keeps_failing_is_given_up_on(monkeypatch):
+    store = Spool()
+    store.append("dm_events", {"n": 1})
+    api = FlakyApi()
+    api.down = True
+    for _ in range(spool.MAX_REPLAY_ATTEMPTS - 1):
+        assert await store.drain(api, force=True) == 0
+        assert store.pending() == 1
+    assert await store.drain(api, force=True) == 0
+    assert store.pending() == 0
+    assert api.attempts == spool.MAX_REPLAY_ATTEMPTS
+    assert len(store.dead_letters()) == 1
+
+
+@pytest.mark.asyncio
+async def test_backlog_only_holds_back_its_own_channel():
+    store = Spool()
+    store.append("on_dm_event", {"n": 1}, agent_id=7)
+
+    api = FlakyApi()
+    publisher = SpooledPublisher(api, store)
+    await publisher.create_message("on_dm_event", {"n": 2}, agent_id=7)
+    await publisher.create_message("on_dm_event", {"n": 3}, agent_id=8)
+    await publisher.create_message("dm_events", {"n": 4})
+    assert publisher.spooled == 1
+    assert [c[1][1]["n"] for c in api.calls_to("create_message")] == [3, 4]
+
+    await publisher.drain()
+    assert [c[1][1]["n"] for c in api.calls_to("create_message", "on_dm_event")] == [3, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_slow_api_is_spooled(monkeypatch):
+    monkeypatch.setattr(spool, "PUBLISH_TIMEOUT_S", 0.01)
+    publisher = SpooledPublisher(FlakyApi(slow=True), timeout_s=0.01)
+    await publisher.create_message("dm_events", {"n": 1})
+    await publisher.create_message("dm_events", {"n": 2})
+    assert publisher.spooled == 2
+    assert publisher.api.attempts == 1
+
+
+@pytest.mark.asyncio
+async def test_attachments_survive_the_spool():
+    store = Spool()
+    data = bytes(range(256))
+    store.append("dm_accel_traces", {"a": 1}, agent_id=7, files=[File("t.bin", "application/gzip", len(data), data)])
+
+    api = FakeApi()
+    await store.drain(api)
+    ((_, (channel, _), kwargs),) = api.calls
+    assert kwargs["agent_id"] == 7
+    assert kwargs["files"][0].data == data
+
+
+def test_spool_is_bounded():
+    store = Spool(max_bytes=300)
+    store.append("dm_events", {"n": 1})
+    with pytest.raises(SpoolFull):
+        for _ in range(10):
+            store.append("dm_events", {"n": "x" * 50})
+
+
+@pytest.mark.asyncio
+async def test_full_spool_fails_the_upload(integration, monkeypatch):
+    monkeypatch.setattr(spool, "MAX_SPOOL_BYTES", 0)
+    integration.api = FlakyApi(fail_after=1)
+    with pytest.raises(SpoolFull):
+        await integration.on_ingestion_endpoint(oem_event(integration, _payload()))
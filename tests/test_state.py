@@ -0,0 +1,256 @@
+"""
+Tests for the persisted per-device state and the processors' use of it.
+"""
+import base64
+
+import pytest
+
+from dm_common import state as state_mod
+from dm_common.channels import DECODED_UPLINK_CHANNEL
+from dm_common.state import STATE_CHANNEL, STATE_VERSION, StateStore
+
+from .fakes import FakeApi, message_event
+
+
+@pytest.mark.asyncio
+async def test_round_trip_writes_only_changes():
+    api = FakeApi()
+    store = StateStore(api)
+    state = await store.load()
+    assert state.rev == 0 and not state.dirty
+
+    state["t"] = "2024-01-01 00:00:00"
+    state["n"] = 1
+    assert await store.save(state)
+    assert api.aggregates[(None, STATE_CHANNEL)] == {
+        "v": STATE_VERSION, "rev": 1, "data": {"t": "2024-01-01 00:00:00", "n": 1},
+    }
+
+    # an unchanged assignment isn't a change, so nothing is written
+    api.calls.clear()
+    state["n"] = 1
+    assert await store.save(state)
+    assert not api.calls
+
+    state["n"] = 2
+    state.pop("t")
+    await store.save(state)
+    (call,) = api.calls_to("update_channel_aggregate", STATE_CHANNEL)
+    assert call[1][1] == {"v": STATE_VERSION, "rev": 2, "data": {"n": 2}}
+    assert call[2]["replace_keys"] == ["data.t"]
+    assert api.aggregates[(None, STATE_CHANNEL)]["data"] == {"n": 2}
+
+
+@pytest.mark.asyncio
+async def test_warm_loads_come_from_the_cache(monkeypatch):
+    api = FakeApi()
+    state = await StateStore(api).load()
+    state["n"] = 1
+    await StateStore(api).save(state)
+
+    api.calls.clear()
+    state = await StateStore(api).load()
+    assert state["n"] == 1 and state.rev == 1
+    assert not api.calls_to("fetch_channel_aggregate")
+
+    monkeypatch.setattr(state_mod, "CACHE_TTL_S", 0)
+    await StateStore(api).load()
+    assert api.calls_to("fetch_channel_aggregate")
+
+
+@pytest.mark.asyncio
+async def test_stale_warm_copy_is_caught_after_the_write():
+    api = FakeApi()
+    store = StateStore(api)
+    state = await store.load()
+    state["n"] = 1
+    await store.save(state)
+
+    # another container writes since this one cached the state
+    api.aggregates[(None, STATE_CHANNEL)] = {"v": 1, "rev": 2, "data": {"n": 1, "other": True}}
+
+    state = await store.load()  # warm, so stale
+    state["n"] = 2
+    assert await store.save(state)
+    assert state.conflicted
+    # written first, and the conflict seen in what the write returned
+    assert not api.calls_to("fetch_channel_aggregate")[1:]
+    assert api.aggregates[(None, STATE_CHANNEL)]["data"] == {"n": 2, "other": True}
+    assert (await store.load()).to_dict() == {"n": 2, "other": True}
+
+
+@pytest.mark.asyncio
+async def test_write_racing_the_save_is_adopted_and_reapplied():
+    class RacingApi(FakeApi):
+        races = 1
+
+        async def update_channel_aggregate(self, channel_name, data, **kwargs):
+            if self.races:
+                # another invocation's write lands first
+                self.races -= 1
+                await super().update_channel_aggregate(channel_name, {"data": {"other": self.races}})
+            return await super().update_channel_aggregate(channel_name, data, **kwargs)
+
+    async def advance(state):
+        # derived from a key the other writer owns, so it must be redone
+        state["total"] = state.get("other", 0) + 1
+
+    api = RacingApi()
+    store = StateStore(api)
+    state = await store.load()
+    await advance(state)
+    assert await store.save(state, advance)
+    assert state.conflicted
+    assert api.aggregates[(None, STATE_CHANNEL)]["data"] == {"other": 0, "total": 1}
+
+    # an invocation that keeps losing gives up, and forgets its warm copy
+    api.races = 10
+    state["total"] = 5
+    api.calls.clear()
+    assert not await store.save(state, advance)
+    assert len(api.calls_to("update_channel_aggregate", STATE_CHANNEL)) == 2 * state_mod.SAVE_ATTEMPTS
+    await store.load()
+    assert api.calls_to("fetch_channel_aggregate")
+
+
+@pytest.mark.asyncio
+async def test_failed_save_forgets_the_warm_copy():
+    class FailingApi(FakeApi):
+        async def update_channel_aggregate(self, *args, **kwargs):
+            raise ConnectionError("down")
+
+    api = FailingApi()
+    store = StateStore(api)
+    state = await store.load()
+    state["n"] = 1
+    with pytest.raises(ConnectionError):
+        await store.save(state)
+
+    api.calls.clear()
+    await store.load()
+    assert api.calls_to("fetch_channel_aggregate")
+
+
+@pytest.mark.asyncio
+async def test_newer_version_is_never_overwritten():
+    api = FakeApi()
+    api.aggregates[(None, STATE_CHANNEL)] = {"v": STATE_VERSION + 1, "rev": 5, "data": {"n": "new"}}
+    store = StateStore(api)
+    state = await store.load()
+    assert state["n"] == "new"
+    state["n"] = "old"
+    assert not await store.save(state)
+    assert not api.calls_to("update_channel_aggregate")
+
+
+@pytest.mark.asyncio
+async def test_processor_skips_duplicates_and_keeps_latest(processor, fake_api):
+    def event(seq, time, lat):
+        return message_event("on_dm_event", {
+            "serial_number": 1001,
+            "sequence_number": seq,
+            "device_time_utc": time,
+            "uplink_reason": "Heartbeat",
+            "position": {"lat": lat, "long": 151.0},
+        })
+
+    await processor.on_message_create(event(2, "2024-01-01 00:02:00", -33.2))
+    await processor.on_message_create(event(2, "2024-01-01 00:02:00", -33.2))  # redelivered
+    await processor.on_message_create(event(1, "2024-01-01 00:01:00", -33.1))  # late
+
+    assert len(fake_api.calls_to("create_message", "location")) == 2
+    assert fake_api.aggregates[(None, "location")]["lat"] == -33.2
+    assert processor.tags.device_time.value == "2024-01-01 00:02:00"
+    data = fake_api.aggregates[(None, STATE_CHANNEL)]["data"]
+    assert (data["t"], data["seq"]) == ("2024-01-01 00:02:00", 2)
+    # loaded once, written once: the late record changed nothing
+    assert len(fake_api.calls_to("fetch_channel_aggregate", STATE_CHANNEL)) == 1
+    assert len(fake_api.calls_to("update_channel_aggregate", STATE_CHANNEL)) == 1
+
+
+@pytest.mark.asyncio
+async def test_warm_processor_writes_without_reading(processor, fake_api):
+    def event(seq, minute):
+        return message_event("on_dm_event", {
+            "serial_number": 1001, "sequence_number": seq, "device_time_utc": f"2024-01-01 00:{minute:02d}:00",
+        })
+
+    for seq in range(1, 4):
+        await processor.on_message_create(event(seq, seq))
+    assert len(fake_api.calls_to("fetch_channel_aggregate", STATE_CHANNEL)) == 1
+    assert len(fake_api.calls_to("update_channel_aggregate", STATE_CHANNEL)) == 3
+
+    # another container wrote since; seen in the write's result, not a read
+    blob = fake_api.aggregates[(None, STATE_CHANNEL)]
+    blob["data"]["other"] = True
+    blob["rev"] += 1
+    await processor.on_message_create(event(4, 4))
+    assert len(fake_api.calls_to("fetch_channel_aggregate", STATE_CHANNEL)) == 1
+    data = fake_api.aggregates[(None, STATE_CHANNEL)]["data"]
+    assert (data["t"], data["seq"], data["other"]) == ("2024-01-01 00:04:00", 4, True)
+
+
+@pytest.mark.asyncio
+async def test_g62_skips_retried_webhooks(g62, fake_api):
+    def uplink(received_at):
+        return message_event("on_tts_event", {
+            "end_device_ids": {"dev_eui": "70B3D5E75E000001"},
+            "uplink_message": {
+                "f_port": 2,
+                "frm_payload": base64.b64encode(bytes.fromhex("0d08d0eb43b5205a2d3ec8")).decode(),
+                "received_at": received_at,
+            },
+        })
+
+    await g62.on_message_create(uplink("2024-01-01T00:00:00.1Z"))
+    await g62.on_message_create(uplink("2024-01-01T00:00:00.1Z"))
+    await g62.on_message_create(uplink("2024-01-01T00:01:00.1Z"))
+
+    assert len(fake_api.calls_to("create_message", "location")) == 2
+    assert fake_api.aggregates[(None, STATE_CHANNEL)]["data"]["t"] == "2024-01-01T00:01:00.1Z"
+
+
+@pytest.mark.asyncio
+async def test_g62_applies_late_uplinks_as_history(g62, fake_api):
+    def part1(received_at, f_cnt, ignition):
+        return {
+            "_type": "data_part_1",
+            "ignition": ignition,
+            "latitude": -33.0,
+            "longitude": 151.0,
+            "received_at": received_at,
+            "f_cnt": f_cnt,
+        }
+
+    async def deliver(*records):
+        await g62.on_message_create(message_event(
+            DECODED_UPLINK_CHANNEL, {"dev_eui": "70B3D5E75E000001", "records": list(records)},
+        ))
+
+    await deliver(part1("2024-01-01T00:02:00Z", 2, True))
+    # a late uplink that was never applied: history only
+    await deliver(part1("2024-01-01T00:01:00Z", 1, False))
+    assert g62.tags.ignition.value is True
+    assert len(fake_api.calls_to("create_message", "location")) == 2
+    # a different frame received in the same instant isn't a retry
+    await deliver(part1("2024-01-01T00:02:00Z", 3, False))
+    assert g62.tags.ignition.value is False
+    # but a retry of either is
+    await deliver(part1("2024-01-01T00:01:00Z", 1, True), part1("2024-01-01T00:02:00Z", 3, True))
+    assert len(fake_api.calls_to("create_message", "location")) == 3
+
+    data = fake_api.aggregates[(None, STATE_CHANNEL)]["data"]
+    assert data["t"] == "2024-01-01T00:02:00Z"
+    assert len(data["seen"]) == 3
+
+
+@pytest.mark.asyncio
+async def test_g62_orders_trimmed_receive_times_as_times(g62, fake_api):
+    # TTS trims trailing zeros: ":13Z" is before ":13.1Z" but sorts after it
+    for received_at, f_cnt, ignition in (("2024-01-01T00:00:13Z", 1, False), ("2024-01-01T00:00:13.1Z", 2, True)):
+        await g62.on_message_create(message_event(DECODED_UPLINK_CHANNEL, {
+            "dev_eui": "70B3D5E75E000001",
+            "records": [{"_type": "data_part_1", "ignition": ignition, "received_at": received_at, "f_cnt": f_cnt}],
+        }))
+    assert g62.tags.ignition.value is True
+    assert fake_api.aggregates[(None, STATE_CHANNEL)]["data"]["t"] == "2024-01-01T00:00:13.1Z"
@@ -0,0 +1,131 @@
+"""
+Tests for the compact location track format.
+"""
+import base64
+import json
+import math
+import random
+
+import pytest
+
+from dm_common import track
+
+from .fakes import configure_integration, oem_event
+
+
+def _synthetic_track(n, seed=1, start=(-33.8688, 151.2093), interval_s=15):
+    """A vehicle-like random walk: steady heading changes, 0-30 m/s."""
+    rng = random.Random(seed)
+    lat, lng = start
+    heading = rng.uniform(0, 2 * math.pi)
+    t = 1_700_000_000
+    fixes = []
+    for _ in range(n):
+        heading += rng.gauss(0, 0.2)
+        dist = rng.uniform(0, 30) * interval_s
+        lat += dist * math.cos(heading) / 111_320
+        lng += dist * math.sin(heading) / (111_320 * math.cos(math.radians(lat)))
+        t += interval_s + rng.choice((0, 0, 0, 1, -1))
+        fixes.append({"lat": lat, "lng": lng, "alt": rng.uniform(40, 60), "timestamp": t})
+    return fixes
+
+
+@pytest.mark.parametrize("digits", [5, 6, 7])
+def test_round_trip_within_precision(digits):
+    fixes = _synthetic_track(500)
+    decoded = track.decode(track.encode(fixes, precision_digits=digits))
+
+    assert len(decoded) == len(fixes)
+    tolerance = 0.5 * 10 ** -digits + 1e-12
+    for original, fix in zip(fixes, decoded):
+        assert abs(fix["lat"] - original["lat"]) <= tolerance
+        assert abs(fix["lng"] - original["lng"]) <= tolerance
+        assert fix["timestamp"] == original["timestamp"]
+        assert fix["alt"] == round(original["alt"])
+
+
+def test_round_trip_across_antimeridian_and_without_alt():
+    fixes = [
+        {"lat": -16.5, "lng": 179.999999, "timestamp": "2024-01-01 00:00:00"},
+        {"lat": -16.5, "lng": -179.999999, "timestamp": "2024-01-01T00:00:30Z"},
+        {"lat": 89.9, "lng": 0.0, "timestamp": None},
+    ]
+    decoded = track.decode(track.encode(fixes))
+
+    assert [f["lng"] for f in decoded] == [179.999999, -179.999999, 0.0]
+    assert [f["timestamp"] for f in decoded] == [1704067200, 1704067230, 1704067230]
+    assert "alt" not in decoded[0]
+
+
+def test_out_of_order_and_pre_epoch_times_survive():
+    fixes = [
+        {"lat": -33.0, "lng": 151.0, "timestamp": "2024-01-01 00:05:00"},
+        {"lat": -33.1, "lng": 151.0, "timestamp": "2024-01-01 00:01:00"},
+        {"lat": -33.2, "lng": 151.0, "timestamp": "2024-01-01 00:03:00"},
+    ]
+    segment = track.encode(fixes)
+    assert [f["timestamp"] for f in track.decode(segment)] == [1704067500, 1704067260, 1704067380]
+    assert (segment["start"], segment["end"]) == (1704067260, 1704067500)
+
+    # e.g. a device whose clock was never set
+    fixes = [{"lat": 0.0, "lng": 0.0, "timestamp": -100}, {"lat": 0.0, "lng": 0.0, "timestamp": 5}]
+    assert [f["timestamp"] for f in track.decode(track.encode(fixes))] == [-100, 5]
+
+
+def test_version_1_segments_still_decode():
+    # t0=300, 2 fixes: dt 0 then 30, unsigned
+    buf = bytes([1, 0, 0, 0xAC, 0x02, 2, 0, 2, 2, 30, 2, 2])
+    segment = {"encoding": track.ENCODING, "data": base64.urlsafe_b64encode(buf).decode()}
+    assert track.decode(segment) == [
+        {"lat": 1.0, "lng": 1.0, "timestamp": 300},
+        {"lat": 2.0, "lng": 2.0, "timestamp": 330},
+    ]
+
+
+def test_size_reduction():
+    fixes = _synthetic_track(200)
+    per_fix = sum(
+        len(json.dumps(track.location_point(round(f["lat"], 6), round(f["lng"], 6), round(f["alt"]))))
+        for f in fixes
+    )
+    segment = len(json.dumps(track.encode(fixes)))
+
+    assert segment < per_fix / 3
+
+
+def test_rejects_unknown_encoding():
+    with pytest.raises(ValueError):
+        track.decode({"encoding": "polyline", "data": ""})
+    with pytest.raises(ValueError):
+        track.encode([])
+
+
+@pytest.mark.asyncio
+async def test_integration_publishes_one_track_per_upload(integration, fake_api):
+    configure_integration(integration, compact_location_tracks=True)
+    records = [
+        {"Reason": 6, "SeqNo": i, "DateUTC": f"2024-01-01 00:{i:02d}:00",
+         "Fields": [{"FType": 0, "Lat": -33.8688 + i * 1e-4, "Long": 151.2093, "Alt": 50}]}
+        for i in range(10)
+    ]
+    records.append({"Reason": 11, "SeqNo": 10, "Fields": [{"FType": 0, "Lat": 0, "Long": 0}]})
+
+    await integration.on_ingestion_endpoint(oem_event(integration, {"SerNo": 1001, "Records": records}))
+
+    (call,) = fake_api.calls_to("create_message", "location_track")
+    _, (_, segment), kwargs = call
+    assert kwargs["agent_id"] == 42
+    assert segment["count"] == 10
+    assert track.decode(segment)[-1]["lat"] == pytest.approx(-33.8688 + 9e-4)
+
+    forwarded = [c[1][1] for c in fake_api.calls_to("create_message", "on_dm_event")]
+    assert sum(1 for r in forwarded if r.get("track_published")) == 10
+    assert not forwarded[-1].get("track_published")
+
+
+@pytest.mark.asyncio
+async def test_integration_tracks_off_by_default(integration, fake_api):
+    records = [{"Fields": [{"FType": 0, "Lat": -33.0 - i, "Long": 151.0}]} for i in range(3)]
+    await integration.on_ingestion_endpoint(oem_event(integration, {"SerNo": 1001, "Records": records}))
+
+    assert not fake_api.calls_to("create_message", "location_track")
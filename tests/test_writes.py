@@ -0,0 +1,170 @@
+"""
+Tests for coalesced processor writes.
+"""
+import asyncio
+import base64
+
+import pytest
+
+from dm_common import writes
+from dm_common.writes import WriteCoalescer
+
+from .fakes import FakeApi, message_event
+
+
+def _outbound(api):
+    return [c[0] for c in api.calls]
+
+
+@pytest.mark.asyncio
+async def test_processor_event_outbound_calls(processor, fake_api):
+    data = {
+        "serial_number": 1001,
+        "sim_iccid": "8961000000000000001",
+        "position": {"lat": -33.8688, "long": 151.2093, "alt": 50},
+        "speed_kmh": 54.0,
+        "ignition_on": True,
+        "battery_voltage": 4.1,
+        "run_hours": 2.0,
+        "odometer_km": 1234.5,
+    }
+    await processor.on_message_create(message_event("on_dm_event", data))
+
+    # location aggregate + message, dv-hardware message + aggregate, ping
+    assert sorted(_outbound(fake_api)) == sorted([
+        "update_channel_aggregate", "create_message",
+        "create_message", "update_channel_aggregate",
+        "ping_connection_at",
+    ])
+    assert fake_api.aggregates[(None, "location")] == {"lat": -33.8688, "lng": 151.2093, "alt": 50}
+
+    # tags are buffered until the invocation commits them in one write
+    fake_api.calls.clear()
+    await processor.tag_manager.commit_tags()
+    assert _outbound(fake_api) == ["update_channel_aggregate", "create_message"]
+
+
+@pytest.mark.asyncio
+async def test_processor_track_published_event_outbound_calls(processor, fake_api):
+    data = {"serial_number": 1001, "position": {"lat": -33.0, "long": 151.0}, "track_published": True}
+    await processor.on_message_create(message_event("on_dm_event", data))
+    assert sorted(_outbound(fake_api)) == ["ping_connection_at", "update_channel_aggregate"]
+
+
+@pytest.mark.asyncio
+async def test_g62_uplink_outbound_calls(g62, fake_api):
+    uplink = {
+        "end_device_ids": {"dev_eui": "70B3D5E75E000001"},
+        "uplink_message": {
+            "f_port": 2,
+            "frm_payload": base64.b64encode(bytes.fromhex("0d08d0eb43b5205a2d3ec8")).decode(),
+        },
+    }
+    await g62.on_message_create(message_event("on_tts_event", uplink))
+    assert _outbound(fake_api) == ["create_message"]
+
+
+@pytest.mark.asyncio
+async def test_aggregate_updates_are_merged():
+    api = FakeApi()
+    async with WriteCoalescer(api) as w:
+        w.update_channel_aggregate("hw", {"modem": {"sim_iccid": "1"}})
+        w.update_channel_aggregate("hw", {"modem": {"imei": "2"}, "fw": "3"})
+        w.update_channel_aggregate("hw", {"x": 1}, agent_id=7)
+
+    assert len(api.calls_to("update_channel_aggregate", "hw")) == 2
+    assert api.aggregates[(None, "hw")] == {"modem": {"sim_iccid": "1", "imei": "2"}, "fw": "3"}
+
+
+@pytest.mark.asyncio
+async def test_replace_supersedes_earlier_updates():
+    api = FakeApi()
+    api.aggregates[(None, "location")] = {"stale": True}
+    async with WriteCoalescer(api) as w:
+        w.update_channel_aggregate("location", {"lat": 1})
+        w.update_channel_aggregate("location", {"lat": 2, "lng": 3}, replace_data=True)
+        w.update_channel_aggregate("location", {"alt": 4})
+
+    (call,) = api.calls_to("update_channel_aggregate")
+    assert call[2]["replace_data"] is True
+    assert api.aggregates[(None, "location")] == {"lat": 2, "lng": 3, "alt": 4}
+
+
+@pytest.mark.asyncio
+async def test_deferred_calls_collapse_to_last():
+    seen = []
+
+    async def call(n):
+        seen.append(n)
+
+    async with WriteCoalescer(FakeApi()) as w:
+        for n in range(3):
+            w.defer("ping", lambda n=n: call(n))
+    assert seen == [2]
+
+
+class SlowApi(FakeApi):
+    def __init__(self):
+        super().__init__()
+        self.in_flight = self.max_in_flight = 0
+
+    async def create_message(self, channel_name, data, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if data.get("fail"):
+            raise RuntimeError("boom")
+        return await super().create_message(channel_name, data, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_flush_is_concurrent_across_channels_and_ordered_within():
+    api = SlowApi()
+    w = WriteCoalescer(api, concurrency=4)
+    for channel in "abcd":
+        for i in range(3):
+            w.create_message(channel, {"i": i})
+    await w.flush()
+
+    assert api.max_in_flight == 4
+    for channel in "abcd":
+        assert [c[1][1]["i"] for c in api.calls_to("create_message", channel)] == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_failed_write_raises_after_the_rest_are_sent():
+    api = SlowApi()
+    w = WriteCoalescer(api)
+    w.create_message("a", {"fail": True})
+    w.create_message("b", {})
+    with pytest.raises(RuntimeError):
+        await w.flush()
+    assert len(api.calls_to("create_message", "b")) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_handler_discards_its_writes():
+    api = FakeApi()
+    with pytest.raises(ValueError, match="handler"):
+        async with WriteCoalescer(api) as w:
+            w.create_message("a", {})
+            w.update_channel_aggregate("a", {"x": 1})
+            raise ValueError("handler")
+    assert not api.calls
+    assert len(w) == 0
+
+
+@pytest.mark.asyncio
+async def test_pooled_client_reuses_session_across_invocations():
+    first = writes.PooledDataClient("https://example.invalid")
+    await first.setup()
+    session = first._session
+    await first.close()
+    assert not session.closed
+
+    second = writes.PooledDataClient("https://example.invalid")
+    await second.setup()
+    assert second._session is session
+    await second.close()
+    await session.close()